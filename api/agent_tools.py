@@ -12,11 +12,18 @@ from typing import Dict, Any, Optional
 import httpx
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
+from pymongo import ReturnDocument
 
 from db.config.connection import get_db
 from db.models.dbmodels.requestProgress import RequestProgress, RequestStatus
 from db.models.dbmodels.priorAuthRequest import priorAuthRequest
+from db.models.dbmodels.requestEvent import RequestEventType
 from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.metadata_store import BlobRevisions, pack, unpack
+from services.request_aggregate import header_fields
+from services.request_events import build_event
+from services.request_state import InvalidTransitionError, fail_request, record_step, transition
+from services.validation_executor import get_validation_executor
 
 router = APIRouter()
 
@@ -43,16 +50,22 @@ async def start_new_request(req: StartRequestTool):
     
     try:
         # Create initial request progress record
+        now = datetime.now()
         request_progress = RequestProgress(
             requestId=request_id,
             status=RequestStatus.CREATED,
-            lastUpdatedAt=datetime.now(),
-            remarks=f"New request started with prompt: {req.prompt[:100]}..."
+            lastUpdatedAt=now,
+            statusEnteredAt=now,
+            userId=req.user_id,
+            remarks=f"New request started with prompt: {req.prompt[:100]}...",
+            eventSeq=1
         )
         db = get_db()
         
-        res = await db["requestProgress"].insert_one(request_progress.model_dump(by_alias=True))
-        print(res)
+        await db["requestProgress"].insert_one(request_progress.model_dump(by_alias=True))
+        await record_step(db, None, request_progress.model_dump(), [
+            build_event(RequestEventType.REQUEST_CREATED, request_progress.remarks, {"user_id": req.user_id, "prompt": req.prompt})
+        ], now)
         return StartRequestResponse(
             request_id=request_id,
             status="CREATED",
@@ -80,18 +93,6 @@ async def check_payer_onboarding(payer_id: str, request_id: str = Query(...)):
     try:
         db = get_db()
         
-        # Update request status
-        await db["requestProgress"].update_one(
-            {"requestId": request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.PROCESSING,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Checking payer onboarding: {payer_id}"
-                }
-            }
-        )
-        
         # Check payer in database
         payer = await db["priorAuthPayers"].find_one({"id": payer_id})
         
@@ -100,15 +101,12 @@ async def check_payer_onboarding(payer_id: str, request_id: str = Query(...)):
             if "_id" in payer:
                 payer["_id"] = str(payer["_id"])
                 
-            await db["requestProgress"].update_one(
-                {"requestId": request_id},
-                {
-                    "$set": {
-                        "status": RequestStatus.PROCESSING,
-                        "lastUpdatedAt": datetime.now(),
-                        "remarks": "Payer validated successfully"
-                    }
-                }
+            await transition(
+                request_id,
+                RequestStatus.PROCESSING,
+                "Payer validated successfully",
+                db=db,
+                details={"payer_id": payer_id}
             )
             return PayerCheckResponse(
                 is_onboarded=True,
@@ -116,33 +114,17 @@ async def check_payer_onboarding(payer_id: str, request_id: str = Query(...)):
                 message="Payer is onboarded and active"
             )
         else:
-            await db["requestProgress"].update_one(
-                {"requestId": request_id},
-                {
-                    "$set": {
-                        "status": RequestStatus.FAILED,
-                        "lastUpdatedAt": datetime.now(),
-                        "remarks": f"Payer {payer_id} not found"
-                    }
-                }
-            )
+            await transition(request_id, RequestStatus.FAILED, f"Payer {payer_id} not found", db=db, details={"payer_id": payer_id})
             return PayerCheckResponse(
                 is_onboarded=False,
                 payer_details=None,
                 message=f"Payer {payer_id} is not onboarded"
             )
             
+    except InvalidTransitionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        await db["requestProgress"].update_one(
-            {"requestId": request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.FAILED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Error checking payer: {str(e)}"
-                }
-            }
-        )
+        await fail_request(request_id, f"Error checking payer: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================================
@@ -167,18 +149,6 @@ async def get_patient_details(req: PatientDetailsRequest):
     db = get_db()
     
     try:
-        # Update request status
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.PROCESSING,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Fetching patient details for: {req.patient_id}"
-                }
-            }
-        )
-        
         # Here you would typically call an external patient API
         # For now, we'll return mock data or fetch from local database
         
@@ -207,15 +177,12 @@ async def get_patient_details(req: PatientDetailsRequest):
             ]
         }
         
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.PROCESSING,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": "Patient details fetched successfully"
-                }
-            }
+        await transition(
+            req.request_id,
+            RequestStatus.PROCESSING,
+            "Patient details fetched successfully",
+            db=db,
+            details={"patient_id": req.patient_id}
         )
         
         return PatientDetailsResponse(
@@ -224,17 +191,10 @@ async def get_patient_details(req: PatientDetailsRequest):
             message="Patient details retrieved successfully"
         )
         
+    except InvalidTransitionError as e:
+        return PatientDetailsResponse(patient_data={}, success=False, message=str(e))
     except Exception as e:
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.FAILED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Error fetching patient details: {str(e)}"
-                }
-            }
-        )
+        await fail_request(req.request_id, f"Error fetching patient details: {str(e)}", db=db)
         return PatientDetailsResponse(
             patient_data={},
             success=False,
@@ -260,87 +220,54 @@ class JsonValidationResponse(BaseModel):
 async def validate_patient_json(req: JsonValidationRequest):
     """
     TOOL 4: Validate patient JSON against payer rules
-    Uses existing validation logic from validate_json.py
+    Uses the same validation service as /validate-json, called in-process
     """   
     db = get_db()
     
     try:
-        # Update request status
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.PROCESSING,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Validating JSON for payer: {req.payer_id}"
-                }
-            }
-        )
+        # Run the shared validation service in-process
+        result = await get_validation_executor().validate(req.patient_data)
         
-        # Call existing validation endpoint
-        async with httpx.AsyncClient() as client:
-            validation_request = {
-                "request_id": req.request_id,
-                "json_data": req.patient_data
-            }
-            
-            response = await client.post(
-                f"{os.getenv('BASE_URL', 'http://localhost:8001')}/api/validate-json",
-                json=validation_request,
-                timeout=30.0
+        if result.http_status in [HttpResponseEnum.INTERNAL_SERVER_ERROR, HttpResponseEnum.SERVICE_UNAVAILABLE]:
+            raise Exception(result.error_message or "Validation service error")
+        
+        if result.is_valid:
+            await transition(
+                req.request_id,
+                RequestStatus.PROCESSING,
+                "JSON validation successful",
+                db=db,
+                details={"payer_id": req.payer_id}
+            )
+            return JsonValidationResponse(
+                is_valid=True,
+                validation_errors=[],
+                missing_fields=[],
+                message="JSON validation passed"
+            )
+        else:
+            await transition(
+                req.request_id,
+                RequestStatus.USER_ACTION_REQUIRED,
+                "JSON validation failed - additional info required",
+                db=db,
+                details={
+                    "payer_id": req.payer_id,
+                    "validation_errors": result.validation_errors,
+                    "missing_fields": result.missing_fields
+                }
+            )
+            return JsonValidationResponse(
+                is_valid=False,
+                validation_errors=result.validation_errors or [result.error_message],
+                missing_fields=result.missing_fields,
+                message=result.error_message or "Validation failed"
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                if result.get("is_valid", False):
-                    await db["requestProgress"].update_one(
-                        {"requestId": req.request_id},
-                        {
-                            "$set": {
-                                "status": RequestStatus.PROCESSING,
-                                "lastUpdatedAt": datetime.now(),
-                                "remarks": "JSON validation successful"
-                            }
-                        }
-                    )
-                    return JsonValidationResponse(
-                        is_valid=True,
-                        validation_errors=[],
-                        missing_fields=[],
-                        message="JSON validation passed"
-                    )
-                else:
-                    await db["requestProgress"].update_one(
-                        {"requestId": req.request_id},
-                        {
-                            "$set": {
-                                "status": RequestStatus.USER_ACTION_REQUIRED,
-                                "lastUpdatedAt": datetime.now(),
-                                "remarks": "JSON validation failed - additional info required"
-                            }
-                        }
-                    )
-                    return JsonValidationResponse(
-                        is_valid=False,
-                        validation_errors=result.get("validation_errors", []),
-                        missing_fields=result.get("missing_fields", []),
-                        message=result.get("message", "Validation failed")
-                    )
-            else:
-                raise Exception("Validation service error")
                 
+    except InvalidTransitionError as e:
+        return JsonValidationResponse(is_valid=False, validation_errors=[str(e)], missing_fields=[], message=str(e))
     except Exception as e:
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.FAILED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"JSON validation error: {str(e)}"
-                }
-            }
-        )
+        await fail_request(req.request_id, f"JSON validation error: {str(e)}", db=db)
         return JsonValidationResponse(
             is_valid=False,
             validation_errors=[str(e)],
@@ -375,29 +302,39 @@ async def trigger_n8n_workflow(req: N8NTriggerRequest):
     db = get_db()
     
     try:
-        # Update request status
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.IN_PROGRESS,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": "Triggering N8N workflow"
-                }
-            }
-        )
-        
-        # Create prior auth request record
+        # Create prior auth request record; a retry of a failed trigger keeps the original createdAt
+        now = datetime.now()
+        existing = await db["priorAuthRequest"].find_one({"requestId": req.request_id}, {"createdAt": 1})
         prior_auth_request = priorAuthRequest(
             requestId=req.request_id,
             userId=req.user_id,
             patientId=req.patient_id,
             patientName=req.patient_name,
             payerId=req.payer_id,
-            createdAt=datetime.now(),
-            lastUpdatedAt=datetime.now()
+            createdAt=existing["createdAt"] if existing else now,
+            lastUpdatedAt=now
+        )
+        
+        # Move to IN_PROGRESS before calling the webhook: finished requests are
+        # rejected here, and n8n callbacks that arrive while we wait for the
+        # webhook response are not overwritten afterwards. The request header
+        # is embedded in the aggregate in the same update.
+        await transition(
+            req.request_id,
+            RequestStatus.IN_PROGRESS,
+            "N8N workflow triggered",
+            header_fields(prior_auth_request.dict()),
+            db=db,
+            details={"payer_id": req.payer_id, "patient_id": req.patient_id, "patient_name": req.patient_name}
+        )
+        # Upsert so a retried or repeated trigger doesn't collide with the unique requestId index
+        header = prior_auth_request.dict()
+        created_at = header.pop("createdAt")
+        await db["priorAuthRequest"].update_one(
+            {"requestId": req.request_id},
+            {"$set": header, "$setOnInsert": {"createdAt": created_at}},
+            upsert=True
         )
-        await db["priorAuthRequest"].insert_one(prior_auth_request.dict())
         
         # Call N8N webhook
         async with httpx.AsyncClient() as client:
@@ -418,17 +355,6 @@ async def trigger_n8n_workflow(req: N8NTriggerRequest):
             )
             
             if response.status_code in [200, 201]:
-                await db["requestProgress"].update_one(
-                    {"requestId": req.request_id},
-                    {
-                        "$set": {
-                            "status": RequestStatus.IN_PROGRESS,
-                            "lastUpdatedAt": datetime.now(),
-                            "remarks": "N8N workflow triggered successfully"
-                        }
-                    }
-                )
-                
                 return N8NTriggerResponse(
                     workflow_triggered=True,
                     workflow_id=response.headers.get("X-Workflow-ID"),
@@ -437,17 +363,10 @@ async def trigger_n8n_workflow(req: N8NTriggerRequest):
             else:
                 raise Exception(f"N8N webhook failed: {response.status_code}")
                 
+    except InvalidTransitionError as e:
+        return N8NTriggerResponse(workflow_triggered=False, workflow_id=None, message=str(e))
     except Exception as e:
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.FAILED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"N8N trigger failed: {str(e)}"
-                }
-            }
-        )
+        await fail_request(req.request_id, f"N8N trigger failed: {str(e)}", db=db)
         return N8NTriggerResponse(
             workflow_triggered=False,
             workflow_id=None,
@@ -467,21 +386,22 @@ async def get_request_status(request_id: str):
     db = get_db()
     
     try:
-        request_progress = await db["requestProgress"].find_one({"requestId": request_id})
+        # The aggregate carries the pending action count, so this is a single read
+        request_progress = await db["requestProgress"].find_one(
+            {"requestId": request_id},
+            {"workflowData": 0, "completionData": 0}
+        )
         if not request_progress:
             raise HTTPException(status_code=404, detail="Request not found")
         
-        # Get user actions if any
-        user_actions = await db["priorAuthUserAction"].find({"requestId": request_id}).to_list(None)
-        
         return {
             "request_id": request_id,
             "status": request_progress["status"],
             "last_updated": request_progress["lastUpdatedAt"],
             "remarks": request_progress.get("remarks", ""),
-            "user_actions_pending": len([a for a in user_actions if a.get("actionStatus") == "PENDING"]),
+            "user_actions_pending": max(request_progress.get("pendingActions", 0), 0),
             "workflow_step": request_progress.get("workflowStep"),
-            "metadata": request_progress.get("metadata", {})
+            "metadata": await unpack(request_progress.get("metadata", {}), db)
         }
         
     except HTTPException:
@@ -507,31 +427,35 @@ async def handle_user_action_response(req: UserActionResponse):
     db = get_db()
     
     try:
-        # Update user action status
-        result = await db["priorAuthUserAction"].update_one(
-            {"id": req.action_id, "requestId": req.request_id},
-            {
-                "$set": {
-                    "actionStatus": "COMPLETED",
-                    "actionedAt": datetime.now(),
-                    "metadata": json.dumps(req.response_data)
-                }
-            }
-        )
-        
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="User action not found")
+        # Update user action status; the previous status tells us whether it was still pending
+        async with BlobRevisions(db) as revisions:
+            previous = await db["priorAuthUserAction"].find_one_and_update(
+                {"id": req.action_id, "requestId": req.request_id},
+                {
+                    "$set": {
+                        "actionStatus": "COMPLETED",
+                        "actionedAt": datetime.now(),
+                        "metadata": await pack(
+                            json.dumps(req.response_data), f"priorAuthUserAction/{req.action_id}/metadata", db, revisions
+                        )
+                    }
+                },
+                projection={"actionStatus": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+            
+            if previous is None:
+                raise HTTPException(status_code=404, detail="User action not found")
         
         # Update request status to resume processing
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.PROCESSING,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": "User action completed - ready to resume"
-                }
-            }
+        await transition(
+            req.request_id,
+            RequestStatus.PROCESSING,
+            "User action completed - ready to resume",
+            db=db,
+            event_type=RequestEventType.USER_ACTION_COMPLETED,
+            details={"action_id": req.action_id, "response_data": req.response_data},
+            counters={"pendingActions": -1} if previous.get("actionStatus") == "PENDING" else None
         )
         
         return {
@@ -542,5 +466,7 @@ async def handle_user_action_response(req: UserActionResponse):
         
     except HTTPException:
         raise
+    except InvalidTransitionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,10 +1,28 @@
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel, Field
 
-from db.config.connection import get_db
+from pymongo import ReturnDocument
+
+from db.config.connection import get_analytics_db, get_db
+from db.models.dbmodels.requestEvent import RequestEventType
 from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.dashboard_stats import bucket_counts, payer_status_counts_pipeline, status_counts_pipeline
+from services.status_counters import get_status_counts
+from services.metadata_store import BlobRevisions, pack, unpack, unpack_document, without_packed_fields
+from services.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    REQUESTS_SORT,
+    USER_ACTIONS_SORT,
+    InvalidCursorError,
+    after_cursor,
+    paginate
+)
+from services.request_aggregate import request_header
+from services.request_events import build_event, get_archived_timeline, get_timeline, record_events
+from services.request_rollups import ALL_PAYERS, rollup_query, summarize_rollups, trend_granularity
 
 router = APIRouter()
 
@@ -37,49 +55,40 @@ class UserActionSummary(BaseModel):
 
 @router.get("/dashboard/stats")
 async def get_dashboard_stats(
-    days: int = Query(7, description="Number of days to look back for stats")
+    days: int = Query(7, description="Number of days to look back for stats; 0 for all requests by current status (eventually consistent counters)"),
+    user_id: Optional[str] = Query(None, description="Only count this user's requests")
 ) -> DashboardStats:
     """
     Get dashboard statistics for the specified time period
+    days=0 reads the incrementally maintained statusCounters document
+    (services/status_counters.py): one lookup, whatever the request volume.
+    The counters are updated after each transition, not with it, so they are
+    eventually consistent: a lost update stays off until the reconciler's
+    next pass (STATUS_COUNTERS_RECONCILE_INTERVAL).
+    Read with the analytics read preference (secondaries), so it can lag the
+    primary by up to MONGO_ANALYTICS_MAX_STALENESS_SECONDS.
     """
-    db = get_db()
+    db = get_analytics_db()
     
     try:
-        # Calculate date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Get all requests in the time period
-        requests_cursor = db["requestProgress"].find({
-            "lastUpdatedAt": {"$gte": start_date, "$lte": end_date}
-        })
-        requests = await requests_cursor.to_list(None)
-        
-        total_requests = len(requests)
-        
-        # Count by status
-        status_counts = {}
-        for request in requests:
-            status = request.get("status", "UNKNOWN")
-            status_counts[status] = status_counts.get(status, 0) + 1
-        
-        pending_requests = status_counts.get("IN_PROGRESS", 0) + status_counts.get("PROCESSING", 0)
-        completed_requests = status_counts.get("COMPLETED", 0)
-        failed_requests = status_counts.get("FAILED", 0)
-        user_action_required = status_counts.get("USER_ACTION_REQUIRED", 0)
-        
-        # Calculate success rate
-        success_rate = 0.0
-        if total_requests > 0:
-            success_rate = (completed_requests / total_requests) * 100
+        if days == 0:
+            counts = bucket_counts(await get_status_counts(db, f"user:{user_id}" if user_id else "global"))
+        else:
+            # Calculate date range
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=days)
+            
+            # Counted server-side; only one row per status comes back
+            groups = await db["requestProgress"].aggregate(status_counts_pipeline(start_date, end_date, user_id)).to_list(None)
+            counts = bucket_counts({group["_id"]: group["count"] for group in groups})
         
         return DashboardStats(
-            total_requests=total_requests,
-            pending_requests=pending_requests,
-            completed_requests=completed_requests,
-            failed_requests=failed_requests,
-            user_action_required=user_action_required,
-            success_rate=round(success_rate, 2)
+            total_requests=counts["total"],
+            pending_requests=counts["pending"],
+            completed_requests=counts["completed"],
+            failed_requests=counts["failed"],
+            user_action_required=counts["user_action_required"],
+            success_rate=counts["success_rate"]
         )
         
     except Exception as e:
@@ -87,67 +96,71 @@ async def get_dashboard_stats(
 
 @router.get("/dashboard/requests")
 async def get_recent_requests(
-    limit: int = Query(20, description="Number of requests to return"),
+    response: Response,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE, description="Number of requests to return"),
     status: Optional[str] = Query(None, description="Filter by status"),
-    user_id: Optional[str] = Query(None, description="Filter by user ID")
+    user_id: Optional[str] = Query(None, description="Filter by user ID"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page")
 ) -> List[RequestSummary]:
     """
     Get recent preauth requests with summary information
+    Reads the request aggregate only: header, status and pending action count
+    live on one requestProgress document.
+    Pages are ordered by (lastUpdatedAt, requestId), newest first; the
+    X-Next-Cursor response header resumes the index scan after the last row
+    (services/pagination.py). A request updated while paging moves to the
+    front, so it can be missed by or repeated in pages already underway.
+    Read with the analytics read preference (secondaries), so it can lag the
+    primary by up to MONGO_ANALYTICS_MAX_STALENESS_SECONDS.
     """  
-    db = get_db()
+    db = get_analytics_db()
     
     try:
-        # Build query filter
-        query_filter = {}
+        # Build query filter; requests whose workflow was never triggered have no header yet
+        query_filter = {"createdAt": {"$ne": None}}
         if status:
             query_filter["status"] = status
+        if user_id:
+            query_filter["userId"] = user_id
+        query_filter.update(after_cursor(cursor, REQUESTS_SORT))
         
-        # Get request progress data
-        progress_cursor = db["requestProgress"].find(query_filter).sort([("lastUpdatedAt", -1)]).limit(limit)
-        progress_data = await progress_cursor.to_list(None)
+        # Get request progress data; the summary never returns the metadata blobs
+        progress_cursor = db["requestProgress"].find(query_filter, without_packed_fields("requestProgress")).sort(REQUESTS_SORT).limit(limit + 1)
+        progress_data, next_page = paginate(await progress_cursor.to_list(None), limit, REQUESTS_SORT)
+        if next_page:
+            response.headers[NEXT_CURSOR_HEADER] = next_page
         
         results = []
         for progress in progress_data:
-            request_id = progress["requestId"]
-            
-            # Get original request details
-            original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
-            if not original_request:
-                continue
-            
-            # Filter by user_id if specified
-            if user_id and original_request.get("userId") != user_id:
-                continue
-            
-            # Count pending user actions
-            user_actions_count = await db["priorAuthUserAction"].count_documents({
-                "requestId": request_id,
-                "actionStatus": "PENDING"
-            })
-            
             results.append(RequestSummary(
-                request_id=request_id,
-                patient_name=original_request.get("patientName", "Unknown"),
-                payer_id=original_request.get("payerId", "Unknown"),
+                request_id=progress["requestId"],
+                patient_name=progress.get("patientName") or "Unknown",
+                payer_id=progress.get("payerId") or "Unknown",
                 status=progress.get("status", "UNKNOWN"),
-                created_at=original_request.get("createdAt"),
+                created_at=progress["createdAt"],
                 last_updated=progress.get("lastUpdatedAt"),
                 current_step=progress.get("workflowStep"),
-                user_actions_pending=user_actions_count
+                user_actions_pending=max(progress.get("pendingActions", 0), 0)
             ))
         
         return results
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/dashboard/user-actions")
 async def get_pending_user_actions(
+    response: Response,
     user_id: Optional[str] = Query(None, description="Filter by user ID"),
-    limit: int = Query(10, description="Number of actions to return")
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE, description="Number of actions to return"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page")
 ) -> List[UserActionSummary]:
     """
     Get pending user actions that require attention
+    Pages are ordered by (requestedAt, id), newest first, and resumed with
+    the X-Next-Cursor response header.
     """  
     db = get_db()
     
@@ -156,31 +169,31 @@ async def get_pending_user_actions(
         query_filter = {"actionStatus": "PENDING"}
         if user_id:
             query_filter["userId"] = user_id
+        query_filter.update(after_cursor(cursor, USER_ACTIONS_SORT))
         
         # Get pending user actions
-        actions_cursor = db["priorAuthUserAction"].find(query_filter).sort([("requestedAt", -1)]).limit(limit)
-        actions = await actions_cursor.to_list(None)
+        actions_cursor = db["priorAuthUserAction"].find(query_filter).sort(USER_ACTIONS_SORT).limit(limit + 1)
+        actions, next_page = paginate(await actions_cursor.to_list(None), limit, USER_ACTIONS_SORT)
+        if next_page:
+            response.headers[NEXT_CURSOR_HEADER] = next_page
         
         results = []
         for action in actions:
-            request_id = action["requestId"]
-            
-            # Get patient name from original request
-            original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
-            patient_name = original_request.get("patientName", "Unknown") if original_request else "Unknown"
-            
             results.append(UserActionSummary(
                 action_id=action["id"],
-                request_id=request_id,
-                patient_name=patient_name,
+                request_id=action["requestId"],
+                # Copied onto the action when it is created (or by migrate_request_aggregate.py)
+                patient_name=action.get("patientName") or "Unknown",
                 action_type=action["actionType"],
                 action_status=action["actionStatus"],
                 requested_at=action["requestedAt"],
-                metadata=action.get("metadata")
+                metadata=await unpack(action.get("metadata"), db)
             ))
         
         return results
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -188,24 +201,40 @@ async def get_pending_user_actions(
 async def get_request_details(request_id: str):
     """
     Get detailed information about a specific request
+    Falls back to the archive collections for requests moved there by
+    services/request_archiver.py.
     """    
     db = get_db()
     
     try:
         # Get request progress
         progress = await db["requestProgress"].find_one({"requestId": request_id})
-        if not progress:
-            raise HTTPException(status_code=404, detail="Request not found")
-        
-        # Get original request
-        original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
+        archived = progress is None
+        if not archived:
+            # Get all user actions
+            user_actions_cursor = db["priorAuthUserAction"].find({"requestId": request_id}).sort([("requestedAt", 1)])
+            user_actions = await user_actions_cursor.to_list(None)
+            
+            # Get conversation history if it exists
+            conversation_history = await db.conversationHistory.find({"requestId": request_id}).to_list(None)
+            events = await get_timeline(request_id, db=db)
+        else:
+            progress = await db["requestProgressArchive"].find_one({"requestId": request_id})
+            if not progress:
+                raise HTTPException(status_code=404, detail="Request not found")
+            user_actions_cursor = db["priorAuthUserActionArchive"].find({"requestId": request_id}).sort([("requestedAt", 1)])
+            user_actions = await user_actions_cursor.to_list(None)
+            conversation_history = await db["conversationHistoryArchive"].find({"requestId": request_id}).to_list(None)
+            events = await get_archived_timeline(request_id, db=db)
         
-        # Get all user actions
-        user_actions_cursor = db["priorAuthUserAction"].find({"requestId": request_id}).sort([("requestedAt", 1)])
-        user_actions = await user_actions_cursor.to_list(None)
+        # Original request details are embedded in the aggregate
+        original_request = request_header(progress)
         
-        # Get conversation history if it exists
-        conversation_history = await db.conversationHistory.find({"requestId": request_id}).to_list(None)
+        # Archived copies keep the stored form, so both are decoded the same way
+        collection_suffix = "Archive" if archived else ""
+        await unpack_document(progress, f"requestProgress{collection_suffix}", db)
+        for action in user_actions:
+            await unpack_document(action, f"priorAuthUserAction{collection_suffix}", db)
         
         return {
             "request_id": request_id,
@@ -213,7 +242,8 @@ async def get_request_details(request_id: str):
             "original_request": original_request,
             "user_actions": user_actions,
             "conversation_history": conversation_history,
-            "timeline": await build_request_timeline(db, request_id),
+            "timeline": build_request_timeline(events, progress, original_request, user_actions),
+            "archived": archived,
             "http_status": HttpResponseEnum.OK
         }
         
@@ -222,14 +252,23 @@ async def get_request_details(request_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def build_request_timeline(db, request_id: str) -> List[Dict[str, Any]]:
+def build_request_timeline(
+    events: List[Dict[str, Any]],
+    progress: Dict[str, Any],
+    original_request: Optional[Dict[str, Any]],
+    user_actions: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
     """
-    Build a timeline of events for a request
+    Build a timeline of events for a request from its requestEvents history.
+    Requests recorded before the event log existed get a summary built from
+    the documents the caller already fetched, without further queries.
     """
+    if events:
+        return events
+    
     timeline = []
     
     # Add original request creation
-    original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
     if original_request:
         timeline.append({
             "timestamp": original_request["createdAt"],
@@ -238,8 +277,7 @@ async def build_request_timeline(db, request_id: str) -> List[Dict[str, Any]]:
             "details": {"payer_id": original_request.get("payerId")}
         })
     
-    # Add progress updates (we could store these separately for better timeline)
-    progress = await db["requestProgress"].find_one({"requestId": request_id})
+    # Add the latest progress update (intermediate statuses weren't kept before requestEvents)
     if progress:
         timeline.append({
             "timestamp": progress["lastUpdatedAt"],
@@ -249,9 +287,6 @@ async def build_request_timeline(db, request_id: str) -> List[Dict[str, Any]]:
         })
     
     # Add user actions
-    user_actions_cursor = db["priorAuthUserAction"].find({"requestId": request_id}).sort([("requestedAt", 1)])
-    user_actions = await user_actions_cursor.to_list(None)
-    
     for action in user_actions:
         timeline.append({
             "timestamp": action["requestedAt"],
@@ -271,63 +306,60 @@ async def build_request_timeline(db, request_id: str) -> List[Dict[str, Any]]:
 
 @router.get("/dashboard/payer-stats")
 async def get_payer_statistics(
-    days: int = Query(30, description="Number of days to look back")
+    days: int = Query(30, description="Number of days to look back; 0 for all requests by current status (eventually consistent counters)")
 ):
     """
     Get statistics grouped by payer
+    days=0 reads the per-payer statusCounters documents instead of scanning
+    requests; like /dashboard/stats?days=0 these are eventually consistent.
+    Read with the analytics read preference (secondaries), so it can lag the
+    primary by up to MONGO_ANALYTICS_MAX_STALENESS_SECONDS.
     """ 
-    db = get_db()
+    db = get_analytics_db()
     
     try:
+        if days == 0:
+            payer_stats = []
+            async for counter in db["statusCounters"].find({"scope": "payer"}).sort([("key", 1)]):
+                counts = bucket_counts({status: n for status, n in counter.get("statuses", {}).items() if n > 0})
+                if not counts["total"]:
+                    continue
+                payer_stats.append({
+                    "payer_id": counter["key"],
+                    "total_requests": counts["total"],
+                    "completed_requests": counts["completed"],
+                    "failed_requests": counts["failed"],
+                    "pending_requests": counts["pending"],
+                    "user_action_required": counts["user_action_required"],
+                    "success_rate": counts["success_rate"]
+                })
+            return {
+                "payer_statistics": payer_stats,
+                "period_days": days,
+                "http_status": HttpResponseEnum.OK
+            }
+        
         # Calculate date range
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
-        # Aggregate requests by payer
-        pipeline = [
-            {
-                "$match": {
-                    "createdAt": {"$gte": start_date, "$lte": end_date}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$payerId",
-                    "total_requests": {"$sum": 1},
-                    "requests": {"$push": "$requestId"}
-                }
-            }
-        ]
+        # One aggregation: requests in the window per payer and current status
+        status_counts: Dict[Any, Dict[Any, int]] = {}
+        async for group in db["priorAuthRequest"].aggregate(payer_status_counts_pipeline(start_date, end_date)):
+            payer_counts = status_counts.setdefault(group["_id"].get("payerId"), {})
+            payer_counts[group["_id"].get("status")] = group["count"]
         
-        payer_groups = await db["priorAuthRequest"].aggregate(pipeline).to_list(None)
-        
-        # Get status information for each payer's requests
         payer_stats = []
-        for group in payer_groups:
-            payer_id = group["_id"]
-            request_ids = group["requests"]
-            
-            # Get status counts for this payer's requests
-            status_counts = {}
-            for request_id in request_ids:
-                progress = await db["requestProgress"].find_one({"requestId": request_id})
-                if progress:
-                    status = progress.get("status", "UNKNOWN")
-                    status_counts[status] = status_counts.get(status, 0) + 1
-            
-            # Calculate success rate
-            completed = status_counts.get("COMPLETED", 0)
-            total = group["total_requests"]
-            success_rate = (completed / total * 100) if total > 0 else 0
-            
+        for payer_id, payer_counts in sorted(status_counts.items(), key=lambda item: str(item[0])):
+            counts = bucket_counts(payer_counts)
             payer_stats.append({
                 "payer_id": payer_id,
-                "total_requests": total,
-                "completed_requests": completed,
-                "failed_requests": status_counts.get("FAILED", 0),
-                "pending_requests": status_counts.get("IN_PROGRESS", 0) + status_counts.get("PROCESSING", 0),
-                "user_action_required": status_counts.get("USER_ACTION_REQUIRED", 0),
-                "success_rate": round(success_rate, 2)
+                "total_requests": counts["total"],
+                "completed_requests": counts["completed"],
+                "failed_requests": counts["failed"],
+                "pending_requests": counts["pending"],
+                "user_action_required": counts["user_action_required"],
+                "success_rate": counts["success_rate"]
             })
         
         return {
@@ -339,6 +371,46 @@ async def get_payer_statistics(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/dashboard/trends")
+async def get_request_trends(
+    days: int = Query(90, description="Number of days to look back"),
+    payer_id: Optional[str] = Query(None, description="Only this payer's requests"),
+    granularity: Optional[str] = Query(None, description="'hour' or 'day'; hourly up to 2 days, daily beyond by default")
+):
+    """
+    Requests created, status entries, outcomes and average time per workflow
+    step over time, from the hourly/daily requestRollups buckets
+    (services/request_rollups.py). A window reads one bucket document per
+    hour or day, so a 365-day trend is 365 small documents.
+    Read with the analytics read preference (secondaries), so it can lag the
+    primary by up to MONGO_ANALYTICS_MAX_STALENESS_SECONDS.
+    """
+    db = get_analytics_db()
+    
+    try:
+        if days < 1 or granularity not in (None, "hour", "day"):
+            raise HTTPException(status_code=400, detail="days must be positive and granularity 'hour' or 'day'")
+        granularity = granularity or trend_granularity(days)
+        start_date = datetime.now() - timedelta(days=days)
+        cursor = db["requestRollups"].find(
+            rollup_query(granularity, payer_id or ALL_PAYERS, start_date),
+            {"_id": 0, "payerId": 0, "granularity": 0}
+        ).sort([("bucket", 1)])
+        trends = summarize_rollups(await cursor.to_list(None))
+        
+        return {
+            **trends,
+            "payer_id": payer_id,
+            "granularity": granularity,
+            "period_days": days,
+            "http_status": HttpResponseEnum.OK
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/dashboard/mark-action-completed/{action_id}")
 async def mark_user_action_completed(action_id: str, response_data: Dict[str, Any]):
     """
@@ -347,20 +419,32 @@ async def mark_user_action_completed(action_id: str, response_data: Dict[str, An
     db = get_db()
     
     try:
-        # Update the user action
-        result = await db["priorAuthUserAction"].update_one(
-            {"id": action_id},
-            {
-                "$set": {
-                    "actionStatus": "COMPLETED",
-                    "actionedAt": datetime.now(),
-                    "metadata": response_data.get("metadata", "")
-                }
-            }
-        )
+        # Update the user action; the previous document tells us which request to
+        # record it on and whether it was still counted as pending
+        async with BlobRevisions(db) as revisions:
+            action = await db["priorAuthUserAction"].find_one_and_update(
+                {"id": action_id},
+                {
+                    "$set": {
+                        "actionStatus": "COMPLETED",
+                        "actionedAt": datetime.now(),
+                        "metadata": await pack(response_data.get("metadata", ""), f"priorAuthUserAction/{action_id}/metadata", db, revisions)
+                    }
+                },
+                projection={"requestId": 1, "actionType": 1, "actionStatus": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+            
+            if action is None:
+                raise HTTPException(status_code=404, detail="User action not found")
         
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="User action not found")
+        await record_events(action["requestId"], [
+            build_event(
+                RequestEventType.USER_ACTION_COMPLETED,
+                f"User action completed from dashboard: {action.get('actionType')}",
+                {"action_id": action_id, "response_data": response_data}
+            )
+        ], db=db, counters={"pendingActions": -1} if action.get("actionStatus") == "PENDING" else None)
         
         return {
             "success": True,
@@ -8,7 +8,13 @@ from pydantic import BaseModel, Field
 from db.config.connection import get_db
 from db.models.dbmodels.requestProgress import RequestStatus
 from db.models.dbmodels.priorAuthUserAction import priorAuthUserAction
+from db.models.dbmodels.requestEvent import RequestEventType
 from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.request_aggregate import request_header
+from services.request_archiver import NOT_ARCHIVING
+from services.request_events import build_event
+from services.metadata_store import BlobRevisions, pack_document, unpack_document
+from services.request_state import InvalidTransitionError, fail_request, record_progress, transition
 import uuid
 
 router = APIRouter()
@@ -28,6 +34,36 @@ class N8NCallbackResponse(BaseModel):
     message: str = Field(..., description="Response message")
     http_status: HttpResponseEnum
 
+async def insert_unarchived_action(db, user_action: priorAuthUserAction) -> bool:
+    """
+    Insert a user action unless its request is claimed for archiving (or
+    gone). An action that lands after the archiver copied the request's
+    actions would be orphaned, so the claim is checked again after the
+    insert and a late action is removed. Returns False if it was refused.
+    """
+    if await db["requestProgress"].find_one({"requestId": user_action.requestId, **NOT_ARCHIVING}, {"_id": 1}) is None:
+        return False
+    async with BlobRevisions(db) as revisions:
+        await db["priorAuthUserAction"].insert_one(await pack_document(user_action.dict(), "priorAuthUserAction", user_action.id, db, revisions))
+    if await db["requestProgress"].find_one({"requestId": user_action.requestId, **NOT_ARCHIVING}, {"_id": 1}) is None:
+        await db["priorAuthUserAction"].delete_one({"id": user_action.id})
+        return False
+    return True
+
+async def release_pending_action(request_id: str, action_id: str, error: Exception, db):
+    """Undo the pendingActions increment of a user action that couldn't be stored; never raises"""
+    try:
+        await transition(
+            request_id,
+            None,
+            f"User action {action_id} could not be stored: {error}",
+            db=db,
+            details={"action_id": action_id},
+            counters={"pendingActions": -1}
+        )
+    except Exception as e:
+        print(f"Could not release pending action {action_id} of request {request_id}: {e}")
+
 @router.post("/n8n/callback", response_model=N8NCallbackResponse)
 async def n8n_callback(req: N8NCallbackRequest):
     """
@@ -50,38 +86,52 @@ async def n8n_callback(req: N8NCallbackRequest):
         
         internal_status = status_mapping.get(req.status.lower(), RequestStatus.IN_PROGRESS)
         
-        # Update request progress
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": internal_status,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"N8N Update: {req.message}",
-                    "workflowStep": req.workflow_step,
-                    "metadata": req.metadata or {}
-                }
-            }
-        )
+        # Build the user action up front so its event is recorded with the status change
+        user_action = None
+        events = []
+        if req.user_action_required and req.action_type:
+            user_action = priorAuthUserAction(
+                id=uuid.uuid4().hex,
+                requestId=req.request_id,
+                userId="raman.kumar@wissen.com",
+                actionType=req.action_type,
+                actionStatus="PENDING",
+                requestedAt=datetime.now(),
+                actionedAt=datetime.now(),
+                metadata=req.screenshot_url or json.dumps(req.metadata or {})
+            )
+            events.append(build_event(
+                RequestEventType.USER_ACTION_REQUESTED,
+                f"User action required: {req.action_type}",
+                {"action_id": user_action.id, "action_type": req.action_type, "screenshot_url": req.screenshot_url}
+            ))
+        
+        # Update request progress; returns the updated document (None if the request doesn't exist).
+        # A GridFS revision replaced by this update is only deleted once the update is accepted.
+        async with BlobRevisions(db) as revisions:
+            request_progress = await transition(
+                req.request_id,
+                internal_status,
+                f"N8N Update: {req.message}",
+                await pack_document({"workflowStep": req.workflow_step, "metadata": req.metadata or {}}, "requestProgress", req.request_id, db, revisions),
+                db=db,
+                details={"n8n_status": req.status, "workflow_step": req.workflow_step, "metadata": req.metadata or {}},
+                events=events,
+                counters={"pendingActions": 1} if user_action else None
+            )
+            if request_progress is None:
+                await revisions.discard()
         
         # If user action is required, create a user action record
-        if req.user_action_required and req.action_type:
-            # Get the original request to find user_id
-            original_request = await db["requestProgress"].find_one({"requestId": req.request_id})
-            
-            print("comming the requestid ")
-            if original_request:
-                user_action = priorAuthUserAction(
-                    id=uuid.uuid4().hex,
-                    requestId=req.request_id,
-                    userId="raman.kumar@wissen.com",
-                    actionType=req.action_type,
-                    actionStatus="PENDING",
-                    requestedAt=datetime.now(),
-                    actionedAt=datetime.now(),
-                    metadata=req.screenshot_url or json.dumps(req.metadata or {})
-                )
-                await db["priorAuthUserAction"].insert_one(user_action.dict())
+        if user_action and request_progress:
+            user_action.patientName = request_progress.get("patientName")
+            try:
+                async with BlobRevisions(db) as revisions:
+                    await db["priorAuthUserAction"].insert_one(await pack_document(user_action.dict(), "priorAuthUserAction", user_action.id, db, revisions))
+            except Exception as e:
+                # Take back the pendingActions increment so no phantom pending action is reported
+                await release_pending_action(req.request_id, user_action.id, e, db)
+                raise
         
         return N8NCallbackResponse(
             success=True,
@@ -89,21 +139,16 @@ async def n8n_callback(req: N8NCallbackRequest):
             http_status=HttpResponseEnum.OK
         )
         
+    except InvalidTransitionError as e:
+        # Late or duplicate callback for a request that already moved on; leave it as is
+        return N8NCallbackResponse(
+            success=False,
+            message=str(e),
+            http_status=HttpResponseEnum.CONFLICT
+        )
     except Exception as e:
         # Update request with error status
-        try:
-            await db["requestProgress"].update_one(
-                {"requestId": req.request_id},
-                {
-                    "$set": {
-                        "status": RequestStatus.FAILED,
-                        "lastUpdatedAt": datetime.now(),
-                        "remarks": f"Callback processing error: {str(e)}"
-                    }
-                }
-            )
-        except:
-            pass  # Don't fail if we can't update the status
+        await fail_request(req.request_id, f"Callback processing error: {str(e)}", db=db)
             
         return N8NCallbackResponse(
             success=False,
@@ -120,10 +165,8 @@ async def update_workflow_status(request_id: str, status_data: Dict[str, Any]):
     
     try:
         # Update the request progress with workflow-specific data
-        update_data = {
-            "lastUpdatedAt": datetime.now(),
-            "workflowData": status_data
-        }
+        status = None
+        remarks = None
         
         if "status" in status_data:
             status_mapping = {
@@ -133,15 +176,20 @@ async def update_workflow_status(request_id: str, status_data: Dict[str, Any]):
                 "failed": RequestStatus.FAILED,
                 "cancelled": RequestStatus.FAILED
             }
-            update_data["status"] = status_mapping.get(status_data["status"], RequestStatus.IN_PROGRESS)
+            status = status_mapping.get(status_data["status"], RequestStatus.IN_PROGRESS)
         
         if "message" in status_data:
-            update_data["remarks"] = f"Workflow: {status_data['message']}"
+            remarks = f"Workflow: {status_data['message']}"
         
-        await db["requestProgress"].update_one(
-            {"requestId": request_id},
-            {"$set": update_data}
-        )
+        revisions = BlobRevisions(db)
+        fields = await pack_document({"workflowData": status_data}, "requestProgress", request_id, db, revisions)
+        if status is None:
+            # Progress only; may be deferred to the write-behind queue, which settles the revisions itself
+            await record_progress(request_id, remarks, fields, db=db, details=status_data, revisions=revisions)
+        else:
+            async with revisions:
+                if await transition(request_id, status, remarks, fields, db=db, details=status_data) is None:
+                    await revisions.discard()
         
         return {
             "success": True,
@@ -149,6 +197,8 @@ async def update_workflow_status(request_id: str, status_data: Dict[str, Any]):
             "http_status": HttpResponseEnum.OK
         }
         
+    except InvalidTransitionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -174,20 +224,20 @@ async def save_screenshot(request_id: str, screenshot_data: Dict[str, Any]):
             actionStatus="COMPLETED",
             requestedAt=datetime.now(),
             actionedAt=datetime.now(),
-            metadata=screenshot_data.get("screenshot_url", json.dumps(screenshot_data))
+            metadata=screenshot_data.get("screenshot_url", json.dumps(screenshot_data)),
+            patientName=original_request.get("patientName")
         )
-        await db["priorAuthUserAction"].insert_one(user_action.dict())
+        if not await insert_unarchived_action(db, user_action):
+            raise HTTPException(status_code=404, detail="Request not found")
         
-        # Also update the request progress
-        await db["requestProgress"].update_one(
-            {"requestId": request_id},
-            {
-                "$set": {
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": "Screenshot captured",
-                    "latestScreenshot": screenshot_data.get("screenshot_url")
-                }
-            }
+        # Also update the request progress (no status change; may be deferred to the write-behind queue)
+        await record_progress(
+            request_id,
+            "Screenshot captured",
+            {"latestScreenshot": screenshot_data.get("screenshot_url")},
+            db=db,
+            event_type=RequestEventType.SCREENSHOT_CAPTURED,
+            details={"action_id": user_action.id, "screenshot_url": screenshot_data.get("screenshot_url")}
         )
         
         return {
@@ -196,6 +246,8 @@ async def save_screenshot(request_id: str, screenshot_data: Dict[str, Any]):
             "http_status": HttpResponseEnum.OK
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -212,11 +264,14 @@ async def get_workflow_info(request_id: str):
         if not request_progress:
             raise HTTPException(status_code=404, detail="Request not found")
         
-        # Get original request details
-        original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
+        # Original request details are embedded in the aggregate
+        original_request = request_header(request_progress)
+        await unpack_document(request_progress, "requestProgress", db)
         
         # Get user actions
         user_actions = await db["priorAuthUserAction"].find({"requestId": request_id}).to_list(None)
+        for action in user_actions:
+            await unpack_document(action, "priorAuthUserAction", db)
         
         return {
             "request_id": request_id,
@@ -242,21 +297,21 @@ async def complete_workflow(request_id: str, completion_data: Dict[str, Any]):
     
     try:
         # Update request progress to completed
-        await db["requestProgress"].update_one(
-            {"requestId": request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.COMPLETED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": f"Workflow completed: {completion_data.get('message', 'Success')}",
-                    "completionData": completion_data,
-                    "completedAt": datetime.now()
-                }
-            }
-        )
+        async with BlobRevisions(db) as revisions:
+            completed = await transition(
+                request_id,
+                RequestStatus.COMPLETED,
+                f"Workflow completed: {completion_data.get('message', 'Success')}",
+                await pack_document({"completionData": completion_data, "completedAt": datetime.now()}, "requestProgress", request_id, db, revisions),
+                db=db,
+                details=completion_data
+            )
+            if completed is None:
+                await revisions.discard()
         
-        # Create a completion user action record
-        original_request = await db["priorAuthRequest"].find_one({"requestId": request_id})
+        # Create a completion user action record. The transition above refreshed
+        # lastUpdatedAt under the archiving guard, so the request can't be claimed now
+        original_request = await db["priorAuthRequest"].find_one({"requestId": request_id}) if completed else None
         if original_request:
             user_action = priorAuthUserAction(
                 id=uuid.uuid4().hex,
@@ -266,9 +321,11 @@ async def complete_workflow(request_id: str, completion_data: Dict[str, Any]):
                 actionStatus="COMPLETED",
                 requestedAt=datetime.now(),
                 actionedAt=datetime.now(),
-                metadata=json.dumps(completion_data)
+                metadata=json.dumps(completion_data),
+                patientName=original_request.get("patientName")
             )
-            await db["priorAuthUserAction"].insert_one(user_action.dict())
+            async with BlobRevisions(db) as revisions:
+                await db["priorAuthUserAction"].insert_one(await pack_document(user_action.dict(), "priorAuthUserAction", user_action.id, db, revisions))
         
         return {
             "success": True,
@@ -277,5 +334,7 @@ async def complete_workflow(request_id: str, completion_data: Dict[str, Any]):
             "http_status": HttpResponseEnum.OK
         }
         
+    except InvalidTransitionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
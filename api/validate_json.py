@@ -1,95 +1,91 @@
 import json
 import os
-from datetime import datetime
 
-from jsonschema import validate, ValidationError
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
 
 from db.config.connection import get_db
 from db.models.dbmodels.requestProgress import RequestStatus
-from db.models.requestmodels.validationRequest import ValidationRequest
-from db.models.requestmodels.jsonValidatorRequest import JsonValidatorRequest
-from db.models.responseModels.jsonValidatorResponse import JsonValidatorResponse
+from db.models.requestModels.validationRequest import ValidationRequest
+from db.models.requestModels.jsonValidatorRequest import JsonValidatorRequest, ValidationMode
+from db.models.requestModels.jsonBatchValidatorRequest import JsonBatchValidatorRequest
+from db.models.responseModels.jsonBatchValidatorResponse import JsonBatchItemResult, JsonBatchValidatorResponse
 from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.request_state import InvalidTransitionError, fail_request, transition
+from services.validation_executor import get_validation_executor
+from services.streaming_validation import validate_stream
 
 router = APIRouter()
 
-def load_validation_rules():
-    """Load validation rules from all_rules.json"""
-    try:
-        rules_path = os.path.join(os.path.dirname(__file__), '..', 'rulesets', 'all_rules.json')
-        with open(rules_path, 'r') as file:
-            return json.load(file)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load validation rules: {str(e)}")
-
-def get_payer_id_from_json(json_data):
-    """Extract payer ID from JSON data"""
-    try:
-        if isinstance(json_data, dict) and 'response' in json_data:
-            if isinstance(json_data['response'], list) and len(json_data['response']) > 0:
-                return json_data['response'][0].get('payerid')
-    except Exception:
-        pass
-    return None
+# Batches larger than this are streamed back as NDJSON unless the caller says otherwise
+VALIDATION_BATCH_STREAM_THRESHOLD = int(os.getenv("VALIDATION_BATCH_STREAM_THRESHOLD", "500"))
 
 @router.post("/validate-json")
 async def validate_json_payload(req: JsonValidatorRequest):
     """
     Endpoint to validate JSON payload against payer-specific rules.
     This API is called after the planner-agent API and after JSON is fetched using get_patientdetails.
+    Agent tools call services.validation_service directly instead of going through this route.
+    Large payloads are validated on the worker pool so the event loop stays free.
+    per_item / fast_fail modes validate `response` items in parallel chunks.
     """
-    try:
-        # Load validation rules
-        all_rules = load_validation_rules()
-        
-        # Extract payer ID from the JSON data
-        payer_id = get_payer_id_from_json(req.json_data)
-        
-        if not payer_id:
-            return JsonValidatorResponse(
-                is_valid=False,
-                http_status=HttpResponseEnum.BAD_REQUEST,
-                error_message="Unable to extract payer ID from JSON data"
-            )
-        
-        # Check if we have validation rules for this payer
-        if payer_id not in all_rules:
-            return JsonValidatorResponse(
-                is_valid=False,
-                http_status=HttpResponseEnum.BAD_REQUEST,
-                error_message=f"No validation rules found for payer ID: {payer_id}"
-            )
-        
-        # Get the validation schema for this payer
-        payer_schema = all_rules[payer_id]
+    executor = get_validation_executor()
+    if req.mode == ValidationMode.FULL:
+        return await executor.validate(req.json_data)
+    return await executor.validate_items(req.json_data, fast_fail=req.mode == ValidationMode.FAST_FAIL)
+
+@router.post("/validate-json/stream")
+async def validate_json_stream(
+    request: Request,
+    fast_fail: bool = Query(False, description="Stop reading the body at the first failing item")
+):
+    """
+    Streaming variant of /validate-json for very large payloads.
+    The body is the patient JSON itself (not wrapped in json_data); it is parsed
+    incrementally and each `response` item is validated as soon as it is complete.
+    """
+    return await validate_stream(get_validation_executor(), request.stream(), fast_fail=fast_fail)
+
+@router.get("/validate-json/stats")
+async def get_validation_stats():
+    """
+    Worker pool and result cache counters for this worker
+    """
+    return {
+        **get_validation_executor().stats(),
+        "http_status": HttpResponseEnum.OK
+    }
+
+@router.post("/validate-json/batch")
+async def validate_json_batch(req: JsonBatchValidatorRequest):
+    """
+    Validate many JSON payloads in one call.
+    Payloads are grouped by payer so each group shares one compiled validator,
+    and results come back in input order (as NDJSON lines when streaming).
+    """
+    executor = get_validation_executor()
+    stream = req.stream if req.stream is not None else len(req.payloads) > VALIDATION_BATCH_STREAM_THRESHOLD
+    
+    if stream:
+        async def ndjson_results():
+            async for index, result in executor.validate_batch(req.payloads):
+                item = JsonBatchItemResult(index=index, **result.model_dump())
+                yield json.dumps(item.model_dump(mode="json")) + "\n"
         
-        # Validate the JSON data against the schema
-        try:
-            validate(instance=req.json_data, schema=payer_schema)
-            
-            # If validation passes
-            return JsonValidatorResponse(
-                is_valid=True,
-                http_status=HttpResponseEnum.OK,
-                error_message=None
-            )
-            
-        except ValidationError as ve:
-            # If validation fails
-            return JsonValidatorResponse(
-                is_valid=False,
-                http_status=HttpResponseEnum.BAD_REQUEST,
-                error_message=f"JSON validation failed: {ve.message}"
-            )
+        return StreamingResponse(ndjson_results(), media_type="application/x-ndjson")
     
-    except Exception as e:
-        # Handle any other exceptions
-        return JsonValidatorResponse(
-            is_valid=False,
-            http_status=HttpResponseEnum.INTERNAL_SERVER_ERROR,
-            error_message=f"Internal server error during validation: {str(e)}"
-        )
+    results = [
+        JsonBatchItemResult(index=index, **result.model_dump())
+        async for index, result in executor.validate_batch(req.payloads)
+    ]
+    valid_count = sum(1 for r in results if r.is_valid)
+    return JsonBatchValidatorResponse(
+        results=results,
+        total=len(results),
+        valid_count=valid_count,
+        invalid_count=len(results) - valid_count,
+        http_status=HttpResponseEnum.OK
+    )
 
 @router.post("/payers/{payer_id}/validate")
 async def validate_payer(req:ValidationRequest):
@@ -99,28 +95,18 @@ async def validate_payer(req:ValidationRequest):
 
         payer = await db.collections("priorAuthPayers").find_one({"id": req.payer_id})
         if payer:
-            await db["requestProgress"].update_one(
-                {"requestId": req.request_id},
-                {
-                    "$set": {
-                        "status": RequestStatus.VALIDATED,
-                        "lastUpdatedAt": datetime.now(),
-                        "remarks": "Payer info reterived successfully"
-                    }
-                }
+            await transition(
+                req.request_id,
+                RequestStatus.VALIDATED,
+                "Payer info reterived successfully",
+                db=db,
+                details={"payer_id": req.payer_id}
             )
             return {"status": HttpResponseEnum.OK, "message": "Payer validated successfully"}
         else:
             return {"status": HttpResponseEnum.NOT_FOUND, "message": "Payer not found"}
+    except InvalidTransitionError as e:
+        return {"status": HttpResponseEnum.CONFLICT, "message": str(e)}
     except Exception as e:
-        await db["requestProgress"].update_one(
-            {"requestId": req.request_id},
-            {
-                "$set": {
-                    "status": RequestStatus.FAILED,
-                    "lastUpdatedAt": datetime.now(),
-                    "remarks": str(e)
-                }
-            }
-        )
+        await fail_request(req.request_id, str(e), db=db)
         return {"status": HttpResponseEnum.INTERNAL_SERVER_ERROR, "message": str(e)}
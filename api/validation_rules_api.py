@@ -0,0 +1,156 @@
+"""
+Versioned validation rules and code tables management
+Publishing a new version is picked up by every worker through the ruleset
+watcher, without a restart or redeploy
+"""
+
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from jsonschema.exceptions import SchemaError
+from pydantic import BaseModel, Field
+from pymongo import DESCENDING
+
+from db.config.connection import get_db
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.code_tables import get_code_table_registry
+from services.ruleset_store import (
+    CODE_TABLES_COLLECTION,
+    VALIDATION_RULES_COLLECTION,
+    get_ruleset_watcher,
+    publish_code_table,
+    publish_ruleset
+)
+from services.validator_registry import get_validator_registry
+
+router = APIRouter()
+
+class PublishRulesRequest(BaseModel):
+    rules: Dict[str, Any] = Field(..., description="JSON schema for the payer's patient payloads")
+    created_by: str = Field(..., description="User publishing this version")
+    remarks: Optional[str] = Field(None, description="Change notes for this version")
+
+class PublishCodeTableRequest(BaseModel):
+    codes: List[str] = Field(..., description="Allowed codes; duplicates and blanks are dropped")
+    created_by: str = Field(..., description="User publishing this version")
+    remarks: Optional[str] = Field(None, description="Change notes for this version")
+
+@router.get("/validation-rules")
+async def get_active_rules():
+    """
+    Versions currently served from this worker's in-memory cache
+    """
+    try:
+        snapshot = get_validator_registry().get_snapshot()
+        return {
+            "source": snapshot.source,
+            "token": snapshot.token,
+            "loaded_at": snapshot.loaded_at,
+            "versions": snapshot.versions,
+            "watch_mode": get_ruleset_watcher().mode,
+            "http_status": HttpResponseEnum.OK
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/validation-rules/{payer_id}/versions")
+async def get_rule_versions(payer_id: str):
+    """
+    Version history for one payer, newest first
+    """
+    db = get_db()
+    
+    try:
+        versions = await db[VALIDATION_RULES_COLLECTION].find(
+            {"payerId": payer_id},
+            {"_id": 0, "rules": 0}
+        ).sort([("version", DESCENDING)]).to_list(None)
+        
+        return {
+            "payer_id": payer_id,
+            "versions": versions,
+            "http_status": HttpResponseEnum.OK
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/validation-rules/{payer_id}")
+async def publish_payer_rules(payer_id: str, req: PublishRulesRequest):
+    """
+    Publish a new version of a payer's rules
+    """
+    db = get_db()
+    
+    try:
+        rule = await publish_ruleset(db, payer_id, req.rules, req.created_by, req.remarks)
+        return {
+            "success": True,
+            "payer_id": payer_id,
+            "version": rule.version,
+            "http_status": HttpResponseEnum.CREATED
+        }
+        
+    except SchemaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schema: {e.message}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/code-tables")
+async def get_active_code_tables():
+    """
+    Code tables currently loaded in this worker, with their sizes and versions
+    """
+    try:
+        tables = get_code_table_registry().get_tables()
+        return {
+            "source": tables.source,
+            "token": tables.token,
+            "loaded_at": tables.loaded_at,
+            "tables": tables.stats(),
+            "http_status": HttpResponseEnum.OK
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/code-tables/{name}/versions")
+async def get_code_table_versions(name: str):
+    """
+    Version history for one code table, newest first
+    """
+    db = get_db()
+    
+    try:
+        versions = await db[CODE_TABLES_COLLECTION].find(
+            {"name": name},
+            {"_id": 0, "codes": 0}
+        ).sort([("version", DESCENDING)]).to_list(None)
+        
+        return {
+            "name": name,
+            "versions": versions,
+            "http_status": HttpResponseEnum.OK
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/code-tables/{name}")
+async def publish_code_table_version(name: str, req: PublishCodeTableRequest):
+    """
+    Publish a new version of a code table
+    """
+    db = get_db()
+    
+    try:
+        table = await publish_code_table(db, name, req.codes, req.created_by, req.remarks)
+        return {
+            "success": True,
+            "name": name,
+            "version": table.version,
+            "codes": len(table.codes),
+            "http_status": HttpResponseEnum.CREATED
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,7 +1,15 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.read_preferences import (
+    Nearest, Primary, PrimaryPreferred, ReadPreference, Secondary, SecondaryPreferred
+)
 
-from typing import Optional
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,15 +18,229 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "preauth_agent_db")
 
+def _optional_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+# Connection pool settings (per process; multiply by worker count when sizing the server)
+MONGO_MAX_POOL_SIZE = _optional_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _optional_int("MONGO_MIN_POOL_SIZE", 5)
+MONGO_MAX_IDLE_TIME_MS = _optional_int("MONGO_MAX_IDLE_TIME_MS", 300000)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _optional_int("MONGO_WAIT_QUEUE_TIMEOUT_MS")
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _optional_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_CONNECT_TIMEOUT_MS = _optional_int("MONGO_CONNECT_TIMEOUT_MS", 10000)
+MONGO_SOCKET_TIMEOUT_MS = _optional_int("MONGO_SOCKET_TIMEOUT_MS")
+
+# Read routing for dashboard analytics; agent tools and n8n callbacks always read from the primary.
+# Max staleness must be at least 90 seconds (driver minimum); -1 means no limit
+MONGO_ANALYTICS_READ_PREFERENCE = os.getenv("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+MONGO_ANALYTICS_MAX_STALENESS_SECONDS = _optional_int("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", 90)
+
+READ_PREFERENCE_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
 client: Optional[AsyncIOMotorClient] = None
 db: Optional[AsyncIOMotorDatabase] = None
+analytics_db: Optional[AsyncIOMotorDatabase] = None
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Live connection pool counters per server, fed by the driver's CMAP events.
+    Events arrive on driver threads, so every update takes the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Dict[str, int]] = {}
+
+    def _server(self, address) -> Dict[str, int]:
+        key = f"{address[0]}:{address[1]}"
+        if key not in self._servers:
+            self._servers[key] = {
+                "open": 0,
+                "checked_out": 0,
+                "waiting": 0,
+                "total_created": 0,
+                "total_closed": 0,
+                "total_checkouts": 0,
+                "failed_checkouts": 0,
+                "pool_clears": 0
+            }
+        return self._servers[key]
+
+    def _update(self, address, **deltas):
+        with self._lock:
+            server = self._server(address)
+            for field, delta in deltas.items():
+                server[field] += delta
+
+    def pool_created(self, event):
+        self._update(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event.address, pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event.address, open=1, total_created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1, total_closed=1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, failed_checkouts=1)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, checked_out=1, total_checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, checked_out=-1)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {address: dict(counters) for address, counters in self._servers.items()}
+
+
+pool_listener = PoolStatsListener()
+
+
+# Servers that answered reads for the current HTTP request. The middleware in
+# main.py sets a fresh set per request; Motor copies the context into its
+# executor threads, so the listener adds to that same set.
+read_sources: ContextVar[Optional[Set[Tuple[str, int]]]] = ContextVar("read_sources", default=None)
+
+READ_COMMANDS = {"find", "getMore", "aggregate", "count", "distinct"}
+
+
+class ReadSourceListener(monitoring.CommandListener):
+    def started(self, event):
+        sources = read_sources.get()
+        if sources is not None and event.command_name in READ_COMMANDS:
+            sources.add(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+read_source_listener = ReadSourceListener()
+
+
+def get_read_preference(mode: str, max_staleness: Optional[int] = -1):
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference '{mode}', expected one of {sorted(READ_PREFERENCE_MODES)}")
+    if mode == "primary":
+        return ReadPreference.PRIMARY
+    return READ_PREFERENCE_MODES[mode](max_staleness=-1 if max_staleness is None else max_staleness)
+
+
+def describe_read_sources(addresses: Set[Tuple[str, int]]) -> List[str]:
+    """'<role> <host:port>' per server, role from the driver's current view of the topology"""
+    roles = {"RSPrimary": "primary", "RSSecondary": "secondary", "Standalone": "standalone", "Mongos": "mongos"}
+    servers = client.topology_description.server_descriptions() if client is not None else {}
+    described = []
+    for address in sorted(addresses):
+        server = servers.get(address)
+        role = roles.get(server.server_type_name, server.server_type_name.lower()) if server else "unknown"
+        described.append(f"{role} {address[0]}:{address[1]}")
+    return described
+
+
+def get_pool_options() -> Dict[str, Any]:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS
+    }
+    return {name: value for name, value in options.items() if value is not None}
 
 def init_db():
-    global client, db
-    client = AsyncIOMotorClient(MONGO_URI)
-    db = client[MONGO_DB_NAME]
+    global client, db, analytics_db
+    client = AsyncIOMotorClient(
+        MONGO_URI, event_listeners=[pool_listener, read_source_listener], **get_pool_options()
+    )
+    # Explicit, so a readPreference in MONGO_URI can't move agent tool reads off the primary
+    db = client.get_database(MONGO_DB_NAME, read_preference=ReadPreference.PRIMARY)
+    analytics_db = client.get_database(
+        MONGO_DB_NAME,
+        read_preference=get_read_preference(MONGO_ANALYTICS_READ_PREFERENCE, MONGO_ANALYTICS_MAX_STALENESS_SECONDS)
+    )
+
+async def warm_up_db() -> bool:
+    """
+    Ping the server and open minPoolSize connections up front, so the first
+    requests after a deploy don't pay for connection setup.
+    Returns False (and logs) instead of raising when the server is unreachable.
+    """
+    try:
+        start = time.perf_counter()
+        await get_db().command("ping")
+        latency = (time.perf_counter() - start) * 1000
+        # Concurrent pings force the pool to open that many connections
+        await asyncio.gather(*(get_db().command("ping") for _ in range(MONGO_MIN_POOL_SIZE or 0)))
+        print(f"MongoDB reachable ({latency:.1f} ms), {MONGO_MIN_POOL_SIZE} pooled connections warmed")
+        return True
+    except Exception as e:
+        print(f"MongoDB warm-up failed: {e}")
+        return False
+
+def close_db():
+    """Close every pooled connection; call once in-flight requests have finished"""
+    global client, db, analytics_db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+    analytics_db = None
+
+def get_pool_stats() -> Dict[str, Any]:
+    return {
+        "options": get_pool_options(),
+        "servers": pool_listener.stats()
+    }
+
+def get_read_routing() -> Dict[str, Any]:
+    return {
+        "primary": "primary",
+        "analytics": analytics_db.read_preference.document if analytics_db is not None else None
+    }
 
 def get_db() -> AsyncIOMotorDatabase:
     if db is None:
         raise RuntimeError("Database not initialized. Call init_db() first.")
     return db
+
+def get_analytics_db() -> AsyncIOMotorDatabase:
+    """
+    Database handle for dashboard analytics, read with MONGO_ANALYTICS_READ_PREFERENCE
+    (secondaries by default), so aggregations don't compete with the agent tool writes
+    on the primary. Results may lag the primary by up to the configured max staleness.
+    """
+    if analytics_db is None:
+        raise RuntimeError("Database not initialized. Call init_db() first.")
+    return analytics_db
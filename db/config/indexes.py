@@ -0,0 +1,214 @@
+"""
+Declarative index registry
+Every index the APIs rely on is declared here, next to the query it serves,
+and applied idempotently at startup (main.py lifespan) and by init_db.py.
+Declared and actual indexes are compared to report drift.
+"""
+
+from typing import Any, Dict, List, Tuple
+import os
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+# "apply" creates missing indexes, "sync" also rebuilds declared indexes whose
+# options changed (e.g. requestId becoming unique), "report" only reports drift,
+# "off" skips index management
+DB_INDEX_MODE = os.getenv("DB_INDEX_MODE", "apply").lower()
+
+# Options that make two indexes on the same keys different
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "requestProgress": [
+        # Every agent tool / n8n callback update and the request detail lookups
+        IndexModel([("requestId", ASCENDING)], unique=True),
+        # /dashboard/requests?status=...
+        IndexModel([("status", ASCENDING), ("lastUpdatedAt", DESCENDING), ("requestId", DESCENDING)]),
+        # /dashboard/requests without a filter. Pages are sorted by (lastUpdatedAt, requestId);
+        # the requestId tiebreaker lets a cursor resume inside a run of equal timestamps
+        IndexModel([("lastUpdatedAt", DESCENDING), ("requestId", DESCENDING)]),
+        # Covers the /dashboard/stats status counts
+        IndexModel([("lastUpdatedAt", DESCENDING), ("status", ASCENDING)]),
+        # /dashboard/requests?user_id=... (with and without a status filter)
+        IndexModel([("userId", ASCENDING), ("lastUpdatedAt", DESCENDING), ("requestId", DESCENDING)]),
+        IndexModel([("userId", ASCENDING), ("status", ASCENDING), ("lastUpdatedAt", DESCENDING), ("requestId", DESCENDING)]),
+    ],
+    "priorAuthRequest": [
+        # Request lookups by ID from every router; trigger_n8n_workflow upserts on it,
+        # so a retried trigger rewrites the one header
+        IndexModel([("requestId", ASCENDING)], unique=True),
+        # /dashboard/payer-stats $match on createdAt, grouped by payerId
+        IndexModel([("createdAt", ASCENDING), ("payerId", ASCENDING)]),
+    ],
+    "priorAuthUserAction": [
+        # /dashboard/mark-action-completed and /tools/handle-user-action
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Request timelines and details, sorted by requestedAt
+        IndexModel([("requestId", ASCENDING), ("requestedAt", ASCENDING)]),
+        # /dashboard/user-actions pages, sorted by (requestedAt, id), without a user filter
+        IndexModel([("actionStatus", ASCENDING), ("requestedAt", DESCENDING), ("id", DESCENDING)]),
+        # /dashboard/user-actions?user_id=...
+        IndexModel([("actionStatus", ASCENDING), ("userId", ASCENDING), ("requestedAt", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "requestEvents": [
+        # Request timelines: one range read in seq order; also rejects duplicate seqs
+        IndexModel([("requestId", ASCENDING), ("seq", ASCENDING)], unique=True),
+    ],
+    "statusCounters": [
+        # /dashboard/payer-stats?days=0 reads every payer counter
+        IndexModel([("scope", ASCENDING), ("key", ASCENDING)]),
+    ],
+    "requestRollups": [
+        # /dashboard/trends: one series (granularity, payer) over a bucket range
+        IndexModel([("granularity", ASCENDING), ("payerId", ASCENDING), ("bucket", ASCENDING)]),
+    ],
+    "conversationHistory": [
+        IndexModel([("requestId", ASCENDING)]),
+    ],
+    "priorAuthPayers": [
+        # Payer lookup in /tools/check-payer
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "validationRules": [
+        # Latest version per payer; also guards concurrent publishes
+        IndexModel([("payerId", ASCENDING), ("version", DESCENDING)], unique=True),
+    ],
+    "codeTables": [
+        IndexModel([("name", ASCENDING), ("version", DESCENDING)], unique=True),
+    ],
+    # Archive collections (services/request_archiver.py): request-details lookups by requestId
+    "requestProgressArchive": [
+        IndexModel([("requestId", ASCENDING)], unique=True),
+    ],
+    "priorAuthRequestArchive": [
+        IndexModel([("requestId", ASCENDING)], unique=True),
+    ],
+    "priorAuthUserActionArchive": [
+        IndexModel([("requestId", ASCENDING), ("requestedAt", ASCENDING)]),
+    ],
+    "requestEventsArchive": [
+        IndexModel([("requestId", ASCENDING), ("seq", ASCENDING)], unique=True),
+    ],
+    "conversationHistoryArchive": [
+        IndexModel([("requestId", ASCENDING)]),
+    ],
+}
+
+
+def _normalize(index: Dict[str, Any]) -> Tuple[Tuple[Tuple[str, Any], ...], Dict[str, Any]]:
+    """(key pattern, compared options) of a declared or server-reported index"""
+    keys = tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in index["key"].items())
+    options = {option: index[option] for option in COMPARED_OPTIONS if index.get(option) not in (None, False)}
+    return keys, options
+
+
+async def duplicate_keys(db, collection: str, model: IndexModel, limit: int = 5) -> List[Dict[str, Any]]:
+    """Key values held by more than one document, which block a unique index on those keys"""
+    fields = list(model.document["key"])
+    pipeline = [
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [{**group["_id"], "count": group["count"]} async for group in db[collection].aggregate(pipeline)]
+
+
+async def _creation_error(db, collection: str, model: IndexModel, error: PyMongoError) -> str:
+    name = f"{collection}.{model.document['name']}"
+    if getattr(error, "code", None) != 11000:
+        return f"{name}: {error}"
+    try:
+        examples = await duplicate_keys(db, collection, model)
+    except PyMongoError:
+        examples = []
+    return (
+        f"{name}: unique index not created, {collection} already has documents sharing "
+        f"{', '.join(model.document['key'])}; remove the duplicates and restart to create it"
+        + (f" (e.g. {examples})" if examples else "")
+    )
+
+
+async def get_index_drift(db) -> Dict[str, Dict[str, Any]]:
+    """
+    Compare declared indexes with the server, per collection:
+    missing (declared, absent), conflicting (same name or keys, different
+    options) and extra (present but not declared, never dropped automatically)
+    """
+    drift = {}
+    for collection, models in INDEXES.items():
+        actual = {index["name"]: index async for index in db[collection].list_indexes()}
+        actual.pop("_id_", None)
+        by_keys = {_normalize(index)[0]: index for index in actual.values()}
+
+        missing, conflicting, matched = [], [], set()
+        for model in models:
+            declared = model.document
+            keys, options = _normalize(declared)
+            existing = actual.get(declared["name"]) or by_keys.get(keys)
+            if existing is None:
+                missing.append(declared["name"])
+                continue
+            matched.add(existing["name"])
+            if _normalize(existing) != (keys, options):
+                conflicting.append({
+                    "name": declared["name"],
+                    "declared": {"key": dict(keys), **options},
+                    "actual": {"name": existing["name"], "key": dict(_normalize(existing)[0]), **_normalize(existing)[1]}
+                })
+
+        extra = sorted(set(actual) - matched)
+        if missing or conflicting or extra:
+            drift[collection] = {"missing": missing, "conflicting": conflicting, "extra": extra}
+    return drift
+
+
+async def apply_indexes(db, mode: str = DB_INDEX_MODE) -> Dict[str, Any]:
+    """
+    Bring the database in line with INDEXES according to `mode` and return
+    the remaining drift plus any errors. Safe to run from every worker.
+    """
+    if mode == "off":
+        return {"mode": mode, "drift": {}, "errors": []}
+
+    errors = []
+    if mode in ("apply", "sync"):
+        try:
+            drift = await get_index_drift(db)
+        except PyMongoError as e:
+            print(f"Could not read indexes, skipping index management: {e}")
+            return {"mode": mode, "drift": {}, "errors": [str(e)]}
+        for collection, models in INDEXES.items():
+            report = drift.get(collection, {})
+            to_create = set(report.get("missing", []))
+            if mode == "sync":
+                for conflict in report.get("conflicting", []):
+                    try:
+                        await db[collection].drop_index(conflict["actual"]["name"])
+                        print(f"Dropped index {collection}.{conflict['actual']['name']} to rebuild it")
+                        to_create.add(conflict["name"])
+                    except PyMongoError as e:
+                        errors.append(f"{collection}.{conflict['actual']['name']}: {e}")
+            for model in models:
+                if model.document["name"] not in to_create:
+                    continue
+                try:
+                    await db[collection].create_indexes([model])
+                    print(f"Created index {collection}.{model.document['name']}")
+                except PyMongoError as e:
+                    # e.g. duplicate requestIds blocking a unique index, another worker racing us,
+                    # or the connection dropping mid-way
+                    errors.append(await _creation_error(db, collection, model, e))
+
+    try:
+        drift = await get_index_drift(db)
+    except PyMongoError as e:
+        errors.append(f"drift check: {e}")
+        drift = {}
+    for collection, report in drift.items():
+        if report["missing"] or report["conflicting"]:
+            print(f"Index drift on {collection}: {report}")
+    for error in errors:
+        print(f"Index management failed: {error}")
+    return {"mode": mode, "drift": drift, "errors": errors}
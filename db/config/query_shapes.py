@@ -0,0 +1,364 @@
+"""
+Registry of every query shape the API issues
+Each entry describes one (collection, operation) as used by one or more
+endpoint functions, as an explainable command. test_query_plans.py runs
+explain() on all of them against seeded data and fails on collection scans,
+in-memory sorts or poor keys-examined ratios; it also fails when a module in
+SCANNED_MODULES issues a query that isn't registered here.
+"""
+
+from typing import Any, Callable, Dict, List
+
+from pydantic import BaseModel, Field
+
+from db.models.dbmodels.requestProgress import RequestStatus
+from services.dashboard_stats import payer_status_counts_pipeline, status_counts_pipeline
+from services.pagination import REQUESTS_SORT, USER_ACTIONS_SORT, keyset_after
+from services.request_archiver import NOT_ARCHIVING
+from services.request_rollups import rollup_query
+
+# Modules whose database calls must all be covered by QUERY_SHAPES
+SCANNED_MODULES = [
+    "api/dashboard_api.py",
+    "api/agent_tools.py",
+    "api/n8n_callback_api.py",
+    "services/request_state.py",
+    "services/request_events.py",
+    "services/write_behind.py",
+]
+
+# Writes that never need an index to find their target
+UNCHECKED_OPERATIONS = {"insert_one", "insert_many"}
+
+
+class QueryShape(BaseModel):
+    name: str = Field(..., description="Unique name of the shape")
+    collection: str = Field(..., description="Collection the query runs against")
+    operation: str = Field(..., description="Motor method used at the call sites (find, find_one, update_one, ...)")
+    used_by: List[str] = Field(..., description="Call sites as 'module path:function name'")
+    command: Callable[[Dict[str, Any]], Dict[str, Any]] = Field(
+        ..., description="Builds the explainable database command from sample parameters"
+    )
+    max_keys_per_doc: float = Field(2.0, description="Allowed totalKeysExamined / max(nReturned, 1)")
+
+
+def find(collection: str, filter: Dict[str, Any], sort: Dict[str, int] = None, limit: int = 0) -> Dict[str, Any]:
+    command = {"find": collection, "filter": filter}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    return command
+
+
+def find_and_modify(collection: str, query: Dict[str, Any]) -> Dict[str, Any]:
+    return {"findAndModify": collection, "query": query, "update": {"$set": {"explainedAt": None}}, "new": True}
+
+
+def update(collection: str, filter: Dict[str, Any]) -> Dict[str, Any]:
+    return {"update": collection, "updates": [{"q": filter, "u": {"$set": {"explainedAt": None}}}]}
+
+
+def delete(collection: str, filter: Dict[str, Any]) -> Dict[str, Any]:
+    return {"delete": collection, "deletes": [{"q": filter, "limit": 1}]}
+
+
+def aggregate(collection: str, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+
+DASHBOARD = "api/dashboard_api.py"
+AGENT_TOOLS = "api/agent_tools.py"
+N8N = "api/n8n_callback_api.py"
+REQUEST_STATE = "services/request_state.py"
+REQUEST_EVENTS = "services/request_events.py"
+WRITE_BEHIND = "services/write_behind.py"
+
+QUERY_SHAPES: List[QueryShape] = [
+    # requestProgress
+    QueryShape(
+        name="progress_by_request_id",
+        collection="requestProgress",
+        operation="find_one",
+        used_by=[
+            f"{DASHBOARD}:get_request_details",
+            f"{AGENT_TOOLS}:get_request_status",
+            f"{N8N}:get_workflow_info",
+            f"{REQUEST_STATE}:transition",
+        ],
+        command=lambda p: find("requestProgress", {"requestId": p["request_id"]}, limit=1),
+    ),
+    QueryShape(
+        name="progress_not_archiving_by_request_id",
+        collection="requestProgress",
+        operation="find_one",
+        used_by=[f"{N8N}:insert_unarchived_action"],
+        command=lambda p: find("requestProgress", {"requestId": p["request_id"], **NOT_ARCHIVING}, limit=1),
+    ),
+    QueryShape(
+        # Every agent tool step and n8n callback goes through this one guarded update
+        name="progress_transition_by_request_id",
+        collection="requestProgress",
+        operation="find_one_and_update",
+        used_by=[f"{REQUEST_STATE}:transition"],
+        command=lambda p: find_and_modify("requestProgress", {
+            "requestId": p["request_id"],
+            "status": {"$in": [RequestStatus.IN_PROGRESS.value, RequestStatus.PROCESSING.value]},
+            **NOT_ARCHIVING
+        }),
+    ),
+    QueryShape(
+        name="progress_reserve_event_seq",
+        collection="requestProgress",
+        operation="find_one_and_update",
+        used_by=[f"{REQUEST_EVENTS}:record_events", f"{WRITE_BEHIND}:apply_progress"],
+        command=lambda p: find_and_modify("requestProgress", {"requestId": p["request_id"], **NOT_ARCHIVING}),
+    ),
+    QueryShape(
+        name="progress_deferred_update",
+        collection="requestProgress",
+        operation="find_one_and_update",
+        used_by=[f"{WRITE_BEHIND}:apply_progress"],
+        command=lambda p: find_and_modify("requestProgress", {
+            "requestId": p["request_id"],
+            "lastUpdatedAt": {"$lte": p["end_date"]},
+            **NOT_ARCHIVING
+        }),
+    ),
+    QueryShape(
+        name="progress_status_counts_in_range",
+        collection="requestProgress",
+        operation="aggregate",
+        used_by=[f"{DASHBOARD}:get_dashboard_stats"],
+        command=lambda p: aggregate("requestProgress", status_counts_pipeline(p["start_date"], p["end_date"])),
+    ),
+    QueryShape(
+        name="progress_status_counts_in_range_by_user",
+        collection="requestProgress",
+        operation="aggregate",
+        used_by=[f"{DASHBOARD}:get_dashboard_stats"],
+        command=lambda p: aggregate("requestProgress", status_counts_pipeline(p["start_date"], p["end_date"], p["user_id"])),
+    ),
+    QueryShape(
+        name="progress_recent",
+        collection="requestProgress",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_recent_requests"],
+        command=lambda p: find("requestProgress", {"createdAt": {"$ne": None}}, sort=dict(REQUESTS_SORT), limit=p["limit"] + 1),
+    ),
+    QueryShape(
+        name="progress_recent_by_status",
+        collection="requestProgress",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_recent_requests"],
+        command=lambda p: find(
+            "requestProgress",
+            {"createdAt": {"$ne": None}, "status": p["status"]},
+            sort=dict(REQUESTS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+    QueryShape(
+        name="progress_recent_by_user",
+        collection="requestProgress",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_recent_requests"],
+        command=lambda p: find(
+            "requestProgress",
+            {"createdAt": {"$ne": None}, "userId": p["user_id"]},
+            sort=dict(REQUESTS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+    QueryShape(
+        name="progress_recent_by_user_and_status",
+        collection="requestProgress",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_recent_requests"],
+        command=lambda p: find(
+            "requestProgress",
+            {"createdAt": {"$ne": None}, "userId": p["user_id"], "status": p["status"]},
+            sort=dict(REQUESTS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+    QueryShape(
+        # Any later page: same plan, the index scan starts at the cursor
+        name="progress_recent_after_cursor",
+        collection="requestProgress",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_recent_requests"],
+        command=lambda p: find(
+            "requestProgress",
+            {"createdAt": {"$ne": None}, **keyset_after(REQUESTS_SORT, [p["start_date"], p["request_id"]])},
+            sort=dict(REQUESTS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+
+    # priorAuthRequest
+    QueryShape(
+        name="request_by_request_id",
+        collection="priorAuthRequest",
+        operation="find_one",
+        used_by=[
+            f"{AGENT_TOOLS}:trigger_n8n_workflow",
+            f"{N8N}:save_screenshot",
+            f"{N8N}:complete_workflow",
+        ],
+        command=lambda p: find("priorAuthRequest", {"requestId": p["request_id"]}, limit=1),
+    ),
+    QueryShape(
+        name="request_upsert_by_request_id",
+        collection="priorAuthRequest",
+        operation="update_one",
+        used_by=[f"{AGENT_TOOLS}:trigger_n8n_workflow"],
+        command=lambda p: update("priorAuthRequest", {"requestId": p["request_id"]}),
+    ),
+    QueryShape(
+        name="requests_by_payer_in_range",
+        collection="priorAuthRequest",
+        operation="aggregate",
+        used_by=[f"{DASHBOARD}:get_payer_statistics"],
+        command=lambda p: aggregate("priorAuthRequest", payer_status_counts_pipeline(p["start_date"], p["end_date"])),
+    ),
+
+    # priorAuthUserAction
+    QueryShape(
+        name="actions_by_request_id",
+        collection="priorAuthUserAction",
+        operation="find",
+        used_by=[
+            f"{DASHBOARD}:get_request_details",
+            f"{N8N}:get_workflow_info",
+        ],
+        command=lambda p: find("priorAuthUserAction", {"requestId": p["request_id"]}, sort={"requestedAt": 1}),
+    ),
+    QueryShape(
+        name="pending_actions_recent",
+        collection="priorAuthUserAction",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_pending_user_actions"],
+        command=lambda p: find("priorAuthUserAction", {"actionStatus": "PENDING"}, sort=dict(USER_ACTIONS_SORT), limit=p["limit"] + 1),
+    ),
+    QueryShape(
+        name="pending_actions_recent_by_user",
+        collection="priorAuthUserAction",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_pending_user_actions"],
+        command=lambda p: find(
+            "priorAuthUserAction",
+            {"actionStatus": "PENDING", "userId": p["user_id"]},
+            sort=dict(USER_ACTIONS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+    QueryShape(
+        name="pending_actions_recent_after_cursor",
+        collection="priorAuthUserAction",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_pending_user_actions"],
+        command=lambda p: find(
+            "priorAuthUserAction",
+            {"actionStatus": "PENDING", **keyset_after(USER_ACTIONS_SORT, [p["start_date"], p["action_id"]])},
+            sort=dict(USER_ACTIONS_SORT),
+            limit=p["limit"] + 1
+        ),
+    ),
+    QueryShape(
+        name="action_delete_by_id",
+        collection="priorAuthUserAction",
+        operation="delete_one",
+        used_by=[f"{N8N}:insert_unarchived_action"],
+        command=lambda p: delete("priorAuthUserAction", {"id": p["action_id"]}),
+    ),
+    QueryShape(
+        name="action_update_by_id",
+        collection="priorAuthUserAction",
+        operation="find_one_and_update",
+        used_by=[f"{AGENT_TOOLS}:handle_user_action_response"],
+        command=lambda p: find_and_modify("priorAuthUserAction", {"id": p["action_id"], "requestId": p["request_id"]}),
+    ),
+    QueryShape(
+        name="action_complete_by_id",
+        collection="priorAuthUserAction",
+        operation="find_one_and_update",
+        used_by=[f"{DASHBOARD}:mark_user_action_completed"],
+        command=lambda p: find_and_modify("priorAuthUserAction", {"id": p["action_id"]}),
+    ),
+
+    # conversationHistory
+    QueryShape(
+        name="conversation_by_request_id",
+        collection="conversationHistory",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_request_details"],
+        command=lambda p: find("conversationHistory", {"requestId": p["request_id"]}),
+    ),
+
+    # requestEvents
+    QueryShape(
+        name="events_by_request_id",
+        collection="requestEvents",
+        operation="find",
+        used_by=[f"{REQUEST_EVENTS}:get_timeline"],
+        command=lambda p: find("requestEvents", {"requestId": p["request_id"]}, sort={"seq": 1}),
+    ),
+
+    # Archive collections (services/request_archiver.py), read by request details
+    QueryShape(
+        name="archived_progress_by_request_id",
+        collection="requestProgressArchive",
+        operation="find_one",
+        used_by=[f"{DASHBOARD}:get_request_details", f"{REQUEST_STATE}:transition"],
+        command=lambda p: find("requestProgressArchive", {"requestId": p["request_id"]}, limit=1),
+    ),
+    QueryShape(
+        name="archived_actions_by_request_id",
+        collection="priorAuthUserActionArchive",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_request_details"],
+        command=lambda p: find("priorAuthUserActionArchive", {"requestId": p["request_id"]}, sort={"requestedAt": 1}),
+    ),
+    QueryShape(
+        name="archived_conversation_by_request_id",
+        collection="conversationHistoryArchive",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_request_details"],
+        command=lambda p: find("conversationHistoryArchive", {"requestId": p["request_id"]}),
+    ),
+    QueryShape(
+        name="archived_events_by_request_id",
+        collection="requestEventsArchive",
+        operation="find",
+        used_by=[f"{REQUEST_EVENTS}:get_archived_timeline"],
+        command=lambda p: find("requestEventsArchive", {"requestId": p["request_id"]}, sort={"seq": 1}),
+    ),
+
+    # statusCounters (services/status_counters.py)
+    QueryShape(
+        name="status_counters_by_scope",
+        collection="statusCounters",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_payer_statistics"],
+        command=lambda p: find("statusCounters", {"scope": "payer"}, sort={"key": 1}),
+    ),
+
+    # requestRollups (services/request_rollups.py)
+    QueryShape(
+        name="rollups_series_since",
+        collection="requestRollups",
+        operation="find",
+        used_by=[f"{DASHBOARD}:get_request_trends"],
+        command=lambda p: find("requestRollups", rollup_query("day", p["payer_id"], p["start_date"]), sort={"bucket": 1}),
+    ),
+
+    # priorAuthPayers
+    QueryShape(
+        name="payer_by_id",
+        collection="priorAuthPayers",
+        operation="find_one",
+        used_by=[f"{AGENT_TOOLS}:check_payer_onboarding"],
+        command=lambda p: find("priorAuthPayers", {"id": p["payer_id"]}, limit=1),
+    ),
+]
@@ -0,0 +1,14 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+
+from db.models.dbmodels.validationRules import RuleStatus
+
+class CodeTable(BaseModel):
+    name: str = Field(..., description="Name payer schemas use in their `codeTable` keyword")
+    version: int = Field(..., description="Monotonically increasing version per table; the highest active version is used")
+    codes: List[str] = Field(..., description="Allowed codes")
+    status: RuleStatus = Field(RuleStatus.ACTIVE, description="Inactive versions are kept for history but never served")
+    createdBy: str = Field(..., description="User who published this version")
+    createdAt: datetime = Field(..., description="Timestamp when this version was published")
+    remarks: Optional[str] = Field(None, description="Change notes for this version")
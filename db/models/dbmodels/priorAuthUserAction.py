@@ -10,4 +10,5 @@ class priorAuthUserAction(BaseModel):
     actionStatus: str = Field(..., description="Status of the action performed by the user")
     requestedAt: datetime = Field(..., description="Timestamp when the action was requested")
     actionedAt: datetime = Field(..., description="Timestamp when the action was performed")
-    metadata: str = Field(None, description="url of the screenshot stored in the blob storages")
\ No newline at end of file
+    metadata: str = Field(None, description="url of the screenshot stored in the blob storages")
+    patientName: Optional[str] = Field(None, description="Patient name copied from the request, for action lists")
\ No newline at end of file
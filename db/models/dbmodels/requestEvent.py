@@ -0,0 +1,26 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+from datetime import datetime
+from enum import Enum
+
+from db.models.dbmodels.requestProgress import RequestStatus
+
+class RequestEventType(str, Enum):
+    """Enumeration for request timeline events."""
+    REQUEST_CREATED = "REQUEST_CREATED"
+    STATUS_UPDATE = "STATUS_UPDATE"
+    PROGRESS_UPDATE = "PROGRESS_UPDATE"
+    SCREENSHOT_CAPTURED = "SCREENSHOT_CAPTURED"
+    USER_ACTION_REQUESTED = "USER_ACTION_REQUESTED"
+    USER_ACTION_COMPLETED = "USER_ACTION_COMPLETED"
+
+class RequestEvent(BaseModel):
+    """One entry of a request's append-only history, unique per (requestId, seq)."""
+    requestId: str = Field(..., description="ID of the request this event belongs to")
+    seq: int = Field(..., description="Position in the request's history, allocated from requestProgress.eventSeq")
+    eventType: RequestEventType = Field(..., description="Kind of event")
+    timestamp: datetime = Field(..., description="Timestamp when the event happened")
+    status: Optional[RequestStatus] = Field(None, description="Request status right after the event")
+    description: str = Field(..., description="Human readable summary, usually the remarks written with it")
+    details: Dict[str, Any] = Field(default_factory=dict, description="Event payload, capped at REQUEST_EVENT_MAX_BYTES")
+    truncated: bool = Field(False, description="Whether details were cut to the size cap")
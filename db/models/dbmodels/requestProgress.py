@@ -19,7 +19,16 @@ class RequestProgress(BaseModel):
     requestId: str = Field(..., description="Unique identifier for the request")
     status: RequestStatus = Field(..., description="Current status of the request")
     lastUpdatedAt: datetime = Field(..., description="Timestamp when the request was last updated")
-    remarks: Optional[str] = Field(None, description="Remarks or comments related to the request")  
+    remarks: Optional[str] = Field(None, description="Remarks or comments related to the request")
+    statusEnteredAt: Optional[datetime] = Field(None, description="Timestamp when the request entered its current status")
+    eventSeq: int = Field(0, description="Last sequence number allocated in requestEvents for this request")
+    # Request header, copied from priorAuthRequest when the workflow is triggered
+    userId: Optional[str] = Field(None, description="ID of the user making the request")
+    patientId: Optional[str] = Field(None, description="ID of the patient for whom the request is made")
+    patientName: Optional[str] = Field(None, description="Name of the patient")
+    payerId: Optional[str] = Field(None, description="ID of the payer associated with the request")
+    createdAt: Optional[datetime] = Field(None, description="Timestamp when the prior auth request was created")
+    pendingActions: int = Field(0, description="Number of PENDING priorAuthUserAction records for this request")
     
     class Config:
         allow_population_by_field_name = True
@@ -9,5 +9,6 @@ class HttpResponseEnum(str, Enum):
     UNAUTHORIZED = "401 Unauthorized"
     FORBIDDEN = "403 Forbidden"
     NOT_FOUND = "404 Not Found"
+    CONFLICT = "409 Conflict"
     INTERNAL_SERVER_ERROR = "500 Internal Server Error"
     SERVICE_UNAVAILABLE = "503 Service Unavailable"
\ No newline at end of file
@@ -0,0 +1,18 @@
+from enum import Enum
+
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+from datetime import datetime
+
+class RuleStatus(str, Enum):
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+
+class ValidationRule(BaseModel):
+    payerId: str = Field(..., description="ID of the payer these rules apply to")
+    version: int = Field(..., description="Monotonically increasing version per payer; the highest active version is used")
+    rules: Dict[str, Any] = Field(..., description="JSON schema the payer's patient payloads are validated against")
+    status: RuleStatus = Field(RuleStatus.ACTIVE, description="Inactive versions are kept for history but never served")
+    createdBy: str = Field(..., description="User who published this version")
+    createdAt: datetime = Field(..., description="Timestamp when this version was published")
+    remarks: Optional[str] = Field(None, description="Change notes for this version")
@@ -0,0 +1,7 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+class JsonBatchValidatorRequest(BaseModel):
+    payloads: List[dict] = Field(..., description="The JSON dicts to be validated")
+    stream: Optional[bool] = Field(None, description="Stream results as NDJSON; defaults to streaming only for large batches")
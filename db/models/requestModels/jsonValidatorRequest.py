@@ -1,4 +1,13 @@
+from enum import Enum
+
 from pydantic import BaseModel, Field
 
+class ValidationMode(str, Enum):
+    """How the `response` array is validated."""
+    FULL = "full"
+    PER_ITEM = "per_item"
+    FAST_FAIL = "fast_fail"
+
 class JsonValidatorRequest(BaseModel):
-    json_data : dict = Field(..., description="The JSON dict to be validated")
\ No newline at end of file
+    json_data : dict = Field(..., description="The JSON dict to be validated")
+    mode: ValidationMode = Field(ValidationMode.FULL, description="full: whole-document validation; per_item: validate `response` items in parallel chunks and report every failing item; fast_fail: like per_item but stop at the first failure")
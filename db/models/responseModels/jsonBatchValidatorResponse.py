@@ -0,0 +1,14 @@
+from typing import List
+from pydantic import BaseModel, Field
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from db.models.responseModels.jsonValidatorResponse import JsonValidatorResponse
+
+class JsonBatchItemResult(JsonValidatorResponse):
+    index: int = Field(..., description="Position of the payload in the request")
+
+class JsonBatchValidatorResponse(BaseModel):
+    results: List[JsonBatchItemResult] = Field(..., description="Per-payload results in input order")
+    total: int = Field(..., description="Number of payloads validated")
+    valid_count: int = Field(..., description="Number of payloads that passed validation")
+    invalid_count: int = Field(..., description="Number of payloads that failed validation")
+    http_status: HttpResponseEnum = Field(..., description="The HTTP status of the response")
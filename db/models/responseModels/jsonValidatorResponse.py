@@ -1,8 +1,18 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
 
+class ItemValidationError(BaseModel):
+    index: int = Field(..., description="Index of the failing item in the `response` array")
+    path: str = Field(..., description="Path of the failing value inside the payload")
+    message: str = Field(..., description="Validation error message")
+    keyword: str = Field(..., description="Schema keyword that failed, e.g. required or pattern")
+
 class JsonValidatorResponse(BaseModel):
     is_valid: bool = Field(..., description="Indicates if the JSON data is valid")
     http_status: HttpResponseEnum = Field(..., description="The HTTP status of the response")
-    error_message: Optional[str] = Field(None, description="Error message if any")
\ No newline at end of file
+    error_message: Optional[str] = Field(None, description="Error message if any")
+    validation_errors: List[str] = Field(default=[], description="Every schema violation found, prefixed with its path")
+    missing_fields: List[str] = Field(default=[], description="Required fields missing from the payload")
+    item_errors: List[ItemValidationError] = Field(default=[], description="Failing `response` items, filled in per-item validation mode")
+    ruleset_version: Optional[str] = Field(None, description="Version of the payer rules the payload was validated against")
@@ -8,6 +8,9 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 import os
 
+from db.config.indexes import apply_indexes
+from services.ruleset_store import import_code_table_files, import_rules_file
+
 async def init_sample_data():
     """Initialize MongoDB with sample data"""
     print("🔄 Connecting to MongoDB...")
@@ -60,14 +63,21 @@ async def init_sample_data():
         await db.priorAuthPayers.insert_many(sample_payers)
         print(f"✅ Inserted {len(sample_payers)} payers")
         
-        # Sample validation rules (basic structure)
+        # Seed versioned validation rules from rulesets/all_rules.json
+        print("📝 Importing validation rules...")
+        imported = await import_rules_file(db)
+        print(f"✅ Imported rules for {len(imported)} payers")
+        
+        # Seed code tables from rulesets/code_tables
+        print("📝 Importing code tables...")
+        imported = await import_code_table_files(db)
+        print(f"✅ Imported {len(imported)} code tables")
+        
         print("📝 Creating indexes and sample data...")
         
-        # Create indexes for better performance
-        await db.requestProgress.create_index("requestId")
-        await db.priorAuthRequest.create_index("requestId")
-        await db.priorAuthUserAction.create_index("requestId")
-        await db.priorAuthPayers.create_index("id")
+        # Create the indexes declared in db/config/indexes.py
+        report = await apply_indexes(db, mode="sync")
+        print(f"✅ Indexes applied, drift: {report['drift'] or 'none'}")
         
         print("✅ Database initialization completed!")
         
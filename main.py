@@ -1,22 +1,65 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from pymongo.errors import PyMongoError
 from api.validate_json import router as validate_json_router
 from api.n8n_callback_api import router as n8n_callback_router
 from api.dashboard_api import router as dashboard_router
 from api.agent_tools import router as agent_tools_router
-from db.config.connection import init_db
+from api.validation_rules_api import router as validation_rules_router
+from db.config.connection import (
+    close_db, describe_read_sources, get_db, get_pool_stats, get_read_routing, init_db, read_sources, warm_up_db
+)
+from db.config.indexes import apply_indexes, get_index_drift
+from services.code_tables import get_code_table_registry
+from services.metadata_store import get_storage_stats
+from services.pagination import NEXT_CURSOR_HEADER
+from services.validator_registry import get_validator_registry
+from services.validation_executor import get_validation_executor
+from services.ruleset_store import get_ruleset_watcher
+from services.request_archiver import REQUEST_ARCHIVE_ENABLED, get_request_archiver
+from services.status_counters import STATUS_COUNTERS_RECONCILE_ENABLED, get_status_counter_reconciler
+from services.write_behind import WRITE_BEHIND_ENABLED, get_write_behind
 import os
+import time
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code to run on startup
     print("Starting up...")
     init_db()
+    if await warm_up_db():
+        try:
+            await apply_indexes(get_db())
+        except PyMongoError as e:
+            # Serve anyway; /health/db/indexes reports what is missing
+            print(f"Index management failed: {e}")
     print("Database initialized...")
+    if WRITE_BEHIND_ENABLED:
+        await get_write_behind().start()
+        print(f"Write-behind queue started ({get_write_behind().path})...")
+    get_validator_registry().get_snapshot()
+    get_code_table_registry().get_tables()
+    print("Validation rules compiled...")
+    if get_validator_registry().source == "mongo":
+        get_ruleset_watcher().start()
+        print("Validation rules watcher started...")
+    if REQUEST_ARCHIVE_ENABLED:
+        get_request_archiver().start()
+        print("Request archiver started...")
+    if STATUS_COUNTERS_RECONCILE_ENABLED:
+        get_status_counter_reconciler().start()
+        print("Status counter reconciler started...")
     yield
     # Code to run on shutdown
     print("Shutting down...")
+    await get_ruleset_watcher().stop()
+    await get_request_archiver().stop()
+    await get_status_counter_reconciler().stop()
+    await get_write_behind().stop()
+    get_validation_executor().shutdown()
+    close_db()
+    print("Database connections closed...")
 
 app = FastAPI(
     title="Preauth Agent APIs", 
@@ -32,19 +75,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browser dashboards read the page cursor from the response headers
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+@app.middleware("http")
+async def read_source_header(request: Request, call_next):
+    """Tell clients which servers answered the reads behind a response (X-Read-Source)"""
+    sources = set()
+    token = read_sources.set(sources)
+    try:
+        response = await call_next(request)
+    finally:
+        read_sources.reset(token)
+    if sources:
+        response.headers["X-Read-Source"] = ", ".join(describe_read_sources(sources))
+    return response
+
 # Include all API routers with /api prefix
 app.include_router(agent_tools_router, prefix="/api", tags=["Agent Tools"])
 app.include_router(n8n_callback_router, prefix="/api", tags=["N8N Callbacks"])
 app.include_router(dashboard_router, prefix="/api", tags=["Dashboard"])
 app.include_router(validate_json_router, prefix="/api", tags=["Validation"])
+app.include_router(validation_rules_router, prefix="/api", tags=["Validation"])
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "Preauth Agent APIs are running"}
 
+@app.get("/health/db")
+async def database_health_check():
+    """Database ping and live connection pool statistics"""
+    try:
+        start = time.perf_counter()
+        await get_db().command("ping")
+        status = {"status": "healthy", "ping_ms": round((time.perf_counter() - start) * 1000, 2)}
+    except Exception as e:
+        status = {"status": "unhealthy", "error": str(e)}
+    return {
+        **status,
+        "pool": get_pool_stats(),
+        "read_routing": get_read_routing(),
+        "write_behind": get_write_behind().get_stats()
+    }
+
+@app.get("/health/db/indexes")
+async def database_index_check():
+    """Drift between the declared indexes (db/config/indexes.py) and the database"""
+    try:
+        drift = await get_index_drift(get_db())
+        return {"status": "in_sync" if not drift else "drift", "drift": drift}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/health/db/storage")
+async def database_storage_check():
+    """Per collection sizes and the bytes metadata compression keeps out of the documents"""
+    try:
+        return {"collections": await get_storage_stats(get_db())}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -0,0 +1,34 @@
+"""
+Compress the oversized metadata fields (workflowData, completionData and
+metadata) of requests written before services/metadata_store.py, and report
+the bytes saved per collection. Safe to re-run; packed values are skipped.
+
+Usage: python migrate_compress_metadata.py [--batch-size 500] [--dry-run]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from db.config.connection import MONGO_DB_NAME, MONGO_URI
+from services.metadata_store import COMPRESS_BATCH_SIZE, compress_existing_metadata
+
+async def migrate(batch_size: int, dry_run: bool):
+    print(f"🔄 Connecting to MongoDB at {MONGO_URI}...")
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        report = await compress_existing_metadata(client[MONGO_DB_NAME], batch_size=batch_size, dry_run=dry_run)
+        for collection, stats in report.items():
+            saved = stats["originalBytes"] - stats["storedBytes"]
+            print(f"{'✅ Dry run: ' if dry_run else '✅ '}{collection}: {stats['documents']} documents, "
+                  f"{stats['originalBytes']} -> {stats['storedBytes']} bytes ({saved} saved)")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress large metadata fields of existing requests")
+    parser.add_argument("--batch-size", type=int, default=COMPRESS_BATCH_SIZE, help="Documents per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Report the savings without writing")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
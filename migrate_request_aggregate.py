@@ -0,0 +1,36 @@
+"""
+Backfill the request aggregate (header fields and pendingActions on
+requestProgress, patientName on priorAuthUserAction) from the existing
+collections. Safe to re-run; it also repairs drifted pendingActions counters.
+
+Usage: python migrate_request_aggregate.py [--batch-size 500] [--dry-run]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from db.config.connection import MONGO_DB_NAME, MONGO_URI
+from services.request_aggregate import BACKFILL_BATCH_SIZE, backfill_request_aggregate
+
+async def migrate(batch_size: int, dry_run: bool):
+    print(f"🔄 Connecting to MongoDB at {MONGO_URI}...")
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        stats = await backfill_request_aggregate(client[MONGO_DB_NAME], batch_size=batch_size, dry_run=dry_run)
+        if dry_run:
+            print(f"✅ Dry run: {stats['requests']} requests would be backfilled")
+        else:
+            print(f"✅ Backfilled {stats['requests']} requests: "
+                  f"{stats['aggregates_updated']} aggregates, {stats['actions_updated']} user actions, "
+                  f"{stats['counters_updated']} counters updated")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the request aggregate in requestProgress")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Requests per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Count the requests without writing")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
@@ -0,0 +1,40 @@
+"""
+Backfill the hourly/daily requestRollups buckets (services/request_rollups.py)
+from the request headers and the request event history, hot and archived.
+Created counts reach back to the first priorAuthRequest; status changes and
+step durations only to when the event log was introduced. Buckets before
+--before are rebuilt from scratch and replaced, so the script is safe to
+re-run; buckets from --before on are left to the live increments. Pass the
+day the rollups were deployed (the default, today, fits a first run on
+deploy day).
+
+Usage: python migrate_request_rollups.py [--before 2026-01-31] [--batch-size 500] [--dry-run]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from db.config.connection import MONGO_DB_NAME, MONGO_URI
+from services.request_rollups import ROLLUP_BACKFILL_BATCH_SIZE, backfill_rollups
+
+async def migrate(before: datetime, batch_size: int, dry_run: bool):
+    print(f"🔄 Connecting to MongoDB at {MONGO_URI}...")
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        stats = await backfill_rollups(client[MONGO_DB_NAME], before, batch_size=batch_size, dry_run=dry_run)
+        print(f"{'✅ Dry run: ' if dry_run else '✅ '}{stats['requests']} requests, "
+              f"{stats['created']} created, {stats['transitions']} transitions, {stats['buckets']} buckets before {before.date()}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill request rollups from the event history")
+    parser.add_argument("--before", type=datetime.fromisoformat, default=datetime.now(),
+                        help="Rebuild buckets before this day (ISO date, default today)")
+    parser.add_argument("--batch-size", type=int, default=ROLLUP_BACKFILL_BATCH_SIZE, help="Events per batch and buckets per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Count the buckets without writing")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.before, args.batch_size, args.dry_run))
@@ -0,0 +1,160 @@
+"""
+Code tables for enumerated rule fields
+Payer schemas reference a named list of allowed codes with the `codeTable`
+keyword instead of a huge regex alternation; each table is loaded once into
+a frozenset and reloaded on its own, without recompiling any schema
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, Optional
+
+# Directory of <name>.txt (one code per line, '#' comments) or <name>.json (list of codes) files
+CODE_TABLES_PATH = os.getenv(
+    "CODE_TABLES_PATH",
+    os.path.join(os.path.dirname(__file__), '..', 'rulesets', 'code_tables')
+)
+# Minimum seconds between checks of the code table files
+CODE_TABLES_RELOAD_INTERVAL = float(os.getenv("CODE_TABLES_RELOAD_INTERVAL", "1.0"))
+# Code tables always come from the same place as the payer rules
+CODE_TABLES_SOURCE = os.getenv("VALIDATION_RULES_SOURCE", "file").lower()
+
+CODE_TABLE_EXTENSIONS = (".txt", ".json")
+
+
+def normalize_codes(codes: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(code.strip() for code in codes if code.strip())
+
+
+def read_code_table_file(path: str) -> FrozenSet[str]:
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        if path.endswith(".json"):
+            codes = json.load(file)
+            if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+                raise ValueError(f"{path} must contain a JSON list of strings")
+            return normalize_codes(codes)
+        return normalize_codes(line for line in file if not line.lstrip().startswith("#"))
+
+
+class CodeTables:
+    """Immutable view of one loaded set of code tables"""
+
+    def __init__(self, tables: Dict[str, FrozenSet[str]], source: str, versions: Dict[str, str]):
+        self.tables = tables
+        self.source = source
+        self.versions = versions
+        self.loaded_at = time.time()
+        fingerprint = json.dumps(sorted(versions.items())).encode()
+        self.token = hashlib.sha1(fingerprint).hexdigest()[:16]
+
+    def get_codes(self, name: str) -> Optional[FrozenSet[str]]:
+        return self.tables.get(name)
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            name: {"codes": len(codes), "version": self.versions.get(name)}
+            for name, codes in self.tables.items()
+        }
+
+
+class CodeTableRegistry:
+    """
+    Process-wide holder of the current CodeTables, mirroring ValidatorRegistry.
+    File source: reloaded when any table file changes.
+    Mongo source: pushed in by the ruleset watcher; a worker process that sees
+    a token it doesn't have yet pulls the tables itself.
+    """
+
+    def __init__(
+        self,
+        path: str = CODE_TABLES_PATH,
+        reload_interval: float = CODE_TABLES_RELOAD_INTERVAL,
+        source: str = CODE_TABLES_SOURCE
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.source = source
+        self._tables: Optional[CodeTables] = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """(name, path, mtime) of every table file; also serves as the change fingerprint"""
+        if not os.path.isdir(self.path):
+            return ()
+        entries = []
+        for entry in os.scandir(self.path):
+            name, extension = os.path.splitext(entry.name)
+            if entry.is_file() and extension in CODE_TABLE_EXTENSIONS:
+                stat = entry.stat()
+                entries.append((name, entry.path, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def _load(self, files) -> CodeTables:
+        tables = {}
+        versions = {}
+        for name, path, mtime_ns, _ in files:
+            tables[name] = read_code_table_file(path)
+            versions[name] = f"file-{mtime_ns}"
+        return CodeTables(tables, "file", versions)
+
+    def install(self, tables: CodeTables):
+        """Swap in tables built elsewhere (e.g. from MongoDB)"""
+        self._tables = tables
+
+    def get_tables(self, token: Optional[str] = None) -> CodeTables:
+        tables = self._tables
+        if self.source == "mongo":
+            if token is not None and (tables is None or tables.token != token):
+                from services.ruleset_store import load_code_tables_sync
+                with self._lock:
+                    if self._tables is None or self._tables.token != token:
+                        loaded = load_code_tables_sync()
+                        if loaded is not None:
+                            self._tables = loaded
+                tables = self._tables
+            if tables is not None and tables.source == "mongo":
+                return tables
+
+        now = time.monotonic()
+        if tables is not None and now - self._last_check < self.reload_interval:
+            return tables
+
+        with self._lock:
+            tables = self._tables
+            if tables is not None and now - self._last_check < self.reload_interval:
+                return tables
+            self._last_check = now
+            try:
+                files = self._scan()
+                if tables is None or files != self._fingerprint:
+                    tables = self._load(files)
+                    self._tables = tables
+                    self._fingerprint = files
+                    print(f"Code tables loaded: {tables.versions}")
+            except Exception as e:
+                if tables is None:
+                    raise
+                # Keep serving the last good tables if a file is mid-write or broken
+                print(f"Code tables reload failed, keeping previous tables: {e}")
+            return tables
+
+    def lookup(self, name: str) -> Optional[FrozenSet[str]]:
+        """Codes of a table as currently loaded, without a reload check (hot path)"""
+        tables = self._tables or self.get_tables()
+        return tables.get_codes(name)
+
+    def codes(self, name: str) -> FrozenSet[str]:
+        """Like lookup, but an unknown table is treated as empty"""
+        return self.lookup(name) or frozenset()
+
+
+code_table_registry = CodeTableRegistry()
+
+
+def get_code_table_registry() -> CodeTableRegistry:
+    return code_table_registry
@@ -0,0 +1,77 @@
+"""
+Dashboard status buckets
+The dashboard reports four buckets over the stored (lowercase) RequestStatus
+values. Counting happens in MongoDB: callers $group by status and pass the
+per-status counts to bucket_counts, so only a handful of numbers ever reach
+the API process.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from db.models.dbmodels.requestProgress import RequestStatus
+
+# Stored status values counted in each dashboard bucket
+STATUS_BUCKETS: Dict[str, List[str]] = {
+    "pending": [
+        RequestStatus.CREATED.value,
+        RequestStatus.VALIDATED.value,
+        RequestStatus.PROCESSING.value,
+        RequestStatus.IN_PROGRESS.value,
+    ],
+    "completed": [RequestStatus.COMPLETED.value, RequestStatus.SUCCEEDED.value],
+    "failed": [RequestStatus.FAILED.value],
+    "user_action_required": [RequestStatus.USER_ACTION_REQUIRED.value, RequestStatus.ACTION_NEEDED.value],
+}
+
+
+def status_counts_pipeline(start_date: datetime, end_date: datetime, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Requests per status updated in the window; covered by the
+    (lastUpdatedAt, status) index, or read through (userId, lastUpdatedAt)
+    for one user
+    """
+    match: Dict[str, Any] = {"lastUpdatedAt": {"$gte": start_date, "$lte": end_date}}
+    if user_id:
+        match["userId"] = user_id
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]
+
+
+def payer_status_counts_pipeline(start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+    """
+    Requests created in the window per (payerId, status): the window comes
+    from the (createdAt, payerId) index on priorAuthRequest and each request's
+    status is joined from requestProgress on its unique requestId index, all
+    in one round trip. The join projects only the status, so the metadata
+    blobs never leave the server's lookup stage. Requests without progress
+    group under status None.
+    """
+    return [
+        {"$match": {"createdAt": {"$gte": start_date, "$lte": end_date}}},
+        {"$project": {"_id": 0, "requestId": 1, "payerId": 1}},
+        {"$lookup": {
+            "from": "requestProgress",
+            "localField": "requestId",
+            "foreignField": "requestId",
+            "pipeline": [{"$project": {"_id": 0, "status": 1}}],
+            "as": "progress"
+        }},
+        {"$group": {
+            "_id": {"payerId": "$payerId", "status": {"$arrayElemAt": ["$progress.status", 0]}},
+            "count": {"$sum": 1}
+        }},
+    ]
+
+
+def bucket_counts(status_counts: Dict[str, int]) -> Dict[str, Any]:
+    """total, the four buckets and success_rate (completed / total, as a percentage)"""
+    total = sum(status_counts.values())
+    buckets = {
+        bucket: sum(status_counts.get(status, 0) for status in statuses)
+        for bucket, statuses in STATUS_BUCKETS.items()
+    }
+    success_rate = (buckets["completed"] / total * 100) if total > 0 else 0.0
+    return {"total": total, **buckets, "success_rate": round(success_rate, 2)}
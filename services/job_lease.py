@@ -0,0 +1,35 @@
+"""
+Leases for background jobs that should run in one worker at a time
+A lease is a jobLeases document naming its owner and an expiry; a worker
+runs the job only while it holds an unexpired lease, so a crashed owner is
+replaced after at most one TTL.
+"""
+
+from datetime import datetime, timedelta
+import os
+import socket
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lease(db, name: str, ttl_seconds: float, owner: str = WORKER_ID) -> bool:
+    """Take or renew the lease `name`; False if another worker holds an unexpired one"""
+    now = datetime.now()
+    try:
+        await db["jobLeases"].find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expiresAt": {"$lt": now}}]},
+            {"$set": {"owner": owner, "acquiredAt": now, "expiresAt": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and is held by someone else, so the upsert collided on _id
+        return False
+
+
+async def release_lease(db, name: str, owner: str = WORKER_ID):
+    await db["jobLeases"].delete_one({"_id": name, "owner": owner})
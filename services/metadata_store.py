@@ -0,0 +1,293 @@
+"""
+Compressed storage for large metadata blobs
+n8n workflow data, completion payloads and user action metadata can dwarf
+the rest of a document. Values whose JSON is larger than
+METADATA_COMPRESSION_THRESHOLD bytes are stored zlib-compressed in place;
+values larger than METADATA_GRIDFS_THRESHOLD are compressed into GridFS and
+only a reference stays in the document. Packed values are only decoded by
+endpoints that return them (unpack_document); list endpoints project them out.
+GridFS revisions are tracked per write (BlobRevisions): the file a document
+still points at is only deleted once the write replacing it has gone through.
+compress_existing_metadata packs documents written before this existed (see
+migrate_compress_metadata.py).
+"""
+
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import zlib
+
+from bson import Binary
+from gridfs.errors import NoFile
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from db.config.connection import get_db
+
+METADATA_COMPRESSION_THRESHOLD = int(os.getenv("METADATA_COMPRESSION_THRESHOLD", "4096"))
+# 0 disables GridFS; larger values are then only compressed (still bounded by the 16 MB document limit)
+METADATA_GRIDFS_THRESHOLD = int(os.getenv("METADATA_GRIDFS_THRESHOLD", "1048576"))
+METADATA_COMPRESSION_LEVEL = int(os.getenv("METADATA_COMPRESSION_LEVEL", "6"))
+METADATA_GRIDFS_BUCKET = "metadataBlobs"
+
+# Fields that may hold packed values, per collection (archives keep the stored form)
+PACKED_FIELDS: Dict[str, List[str]] = {
+    "requestProgress": ["metadata", "workflowData", "completionData"],
+    "priorAuthUserAction": ["metadata"],
+    "requestProgressArchive": ["metadata", "workflowData", "completionData"],
+    "priorAuthUserActionArchive": ["metadata"],
+}
+
+# Don't keep a compressed copy that saves less than this fraction
+MIN_SAVING = 0.1
+COMPRESS_BATCH_SIZE = 500
+
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("_packed") in ("zlib", "gridfs")
+
+
+def _encode(value: Any) -> bytes:
+    return (value if isinstance(value, str) else json.dumps(value, default=str)).encode("utf-8")
+
+
+def _bucket(db) -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=METADATA_GRIDFS_BUCKET)
+
+
+class BlobRevisions:
+    """
+    GridFS files uploaded and superseded by pack() for one document write.
+    Used as `async with BlobRevisions(db) as revisions:` around the pack and
+    the write: superseded revisions are deleted when the block completes,
+    the new uploads if it raises. Call discard() when the write was rejected
+    without an exception (e.g. the document doesn't exist). Cleanup is best
+    effort; it never fails the write it follows.
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.uploaded: List[Any] = []
+        self.superseded: List[Any] = []
+
+    async def _delete(self, file_ids: List[Any]):
+        if not file_ids:
+            return
+        bucket = _bucket(self.db if self.db is not None else get_db())
+        for file_id in file_ids:
+            try:
+                await bucket.delete(file_id)
+            except NoFile:
+                pass
+            except Exception as e:
+                print(f"Could not delete metadata blob {file_id}: {e}")
+
+    async def commit(self):
+        """The write went through: drop the revisions it replaced"""
+        superseded, self.uploaded, self.superseded = self.superseded, [], []
+        await self._delete(superseded)
+
+    async def discard(self):
+        """The write didn't happen: drop what was uploaded for it, keep the old revisions"""
+        uploaded, self.uploaded, self.superseded = self.uploaded, [], []
+        await self._delete(uploaded)
+
+    def to_payload(self) -> Dict[str, List[Any]]:
+        """For a write that is queued instead of applied now (services/write_behind.py)"""
+        return {"uploaded": list(self.uploaded), "superseded": list(self.superseded)}
+
+    @classmethod
+    def from_payload(cls, payload: Optional[Dict[str, List[Any]]], db=None) -> "BlobRevisions":
+        revisions = cls(db)
+        revisions.uploaded = list((payload or {}).get("uploaded", []))
+        revisions.superseded = list((payload or {}).get("superseded", []))
+        return revisions
+
+    async def __aenter__(self) -> "BlobRevisions":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.discard()
+        return False
+
+
+async def pack(value: Any, key: str, db=None, revisions: Optional[BlobRevisions] = None) -> Any:
+    """
+    Stored form of a metadata value: unchanged when small, otherwise a
+    {"_packed": ...} envelope. `key` names the GridFS file (e.g.
+    "requestProgress/<requestId>/workflowData"). A spilled value's upload and
+    the older revisions of the same key are recorded on `revisions`, which
+    deletes one or the other once the write is known to have happened or
+    not; without `revisions` older revisions are left in place.
+    """
+    if value is None or is_packed(value):
+        return value
+    encoded = _encode(value)
+    size = len(encoded)
+    if size <= METADATA_COMPRESSION_THRESHOLD:
+        return value
+
+    spill = METADATA_GRIDFS_THRESHOLD and size > METADATA_GRIDFS_THRESHOLD
+    if spill:
+        compressed = await asyncio.to_thread(zlib.compress, encoded, METADATA_COMPRESSION_LEVEL)
+    else:
+        compressed = zlib.compress(encoded, METADATA_COMPRESSION_LEVEL)
+    if not spill and len(compressed) > size * (1 - MIN_SAVING):
+        return value
+
+    envelope = {
+        "_packed": "zlib",
+        "type": "str" if isinstance(value, str) else "json",
+        "size": size,
+        "storedSize": len(compressed)
+    }
+    if not spill:
+        return {**envelope, "data": Binary(compressed)}
+
+    db = db if db is not None else get_db()
+    bucket = _bucket(db)
+    # Listed before the upload, so only revisions older than this one are ever superseded
+    previous = [file._id async for file in bucket.find({"filename": key})]
+    file_id = await bucket.upload_from_stream(key, compressed, metadata={"size": size})
+    if revisions is not None:
+        revisions.uploaded.append(file_id)
+        revisions.superseded.extend(previous)
+    return {**envelope, "_packed": "gridfs", "fileId": file_id, "storedSize": 0, "gridfsSize": len(compressed)}
+
+
+async def unpack(value: Any, db=None) -> Any:
+    """The original value of a stored metadata field"""
+    if not is_packed(value):
+        return value
+    if value["_packed"] == "gridfs":
+        db = db if db is not None else get_db()
+        stream = await _bucket(db).open_download_stream(value["fileId"])
+        compressed = await stream.read()
+        encoded = await asyncio.to_thread(zlib.decompress, compressed)
+    else:
+        encoded = zlib.decompress(value["data"])
+    text = encoded.decode("utf-8")
+    return text if value.get("type") == "str" else json.loads(text)
+
+
+async def pack_document(document: Dict[str, Any], collection: str, document_id: str, db=None,
+                        revisions: Optional[BlobRevisions] = None) -> Dict[str, Any]:
+    """Pack the metadata fields of a document (or of a $set) about to be written to `collection`"""
+    for field in PACKED_FIELDS.get(collection, []):
+        if document.get(field) is not None:
+            document[field] = await pack(document[field], f"{collection}/{document_id}/{field}", db, revisions)
+    return document
+
+
+async def unpack_document(document: Optional[Dict[str, Any]], collection: str, db=None) -> Optional[Dict[str, Any]]:
+    """Decode the packed fields of a document in place, for endpoints that return them"""
+    if document:
+        for field in PACKED_FIELDS.get(collection, []):
+            if is_packed(document.get(field)):
+                document[field] = await unpack(document[field], db)
+    return document
+
+
+def without_packed_fields(collection: str) -> Dict[str, int]:
+    """Projection for reads that never return the packed fields"""
+    return {field: 0 for field in PACKED_FIELDS.get(collection, [])}
+
+
+async def get_storage_stats(db=None) -> Dict[str, Any]:
+    """
+    Per collection: server-side size figures plus how many bytes the packed
+    fields would take uncompressed vs what stays in the documents, i.e. what
+    compression and GridFS keep out of the working set. Scans the packed
+    documents, so it is meant for occasional admin use.
+    """
+    db = db if db is not None else get_db()
+    existing = set(await db.list_collection_names())
+    report = {}
+    for collection, fields in PACKED_FIELDS.items():
+        if collection not in existing:
+            continue
+        stats = await db.command("collStats", collection)
+        packed = {}
+        for field in fields:
+            groups = await db[collection].aggregate([
+                {"$match": {f"{field}._packed": {"$exists": True}}},
+                {"$group": {
+                    "_id": f"${field}._packed",
+                    "count": {"$sum": 1},
+                    "originalBytes": {"$sum": f"${field}.size"},
+                    "storedBytes": {"$sum": f"${field}.storedSize"},
+                    "gridfsBytes": {"$sum": {"$ifNull": [f"${field}.gridfsSize", 0]}}
+                }}
+            ]).to_list(None)
+            if groups:
+                packed[field] = {group["_id"]: {k: v for k, v in group.items() if k != "_id"} for group in groups}
+        saved = sum(
+            group["originalBytes"] - group["storedBytes"]
+            for by_kind in packed.values() for group in by_kind.values()
+        )
+        report[collection] = {
+            "documents": stats.get("count", 0),
+            "dataSize": stats.get("size", 0),
+            "storageSize": stats.get("storageSize", 0),
+            "avgObjSize": stats.get("avgObjSize", 0),
+            "packedFields": packed,
+            "bytesKeptOutOfDocuments": saved
+        }
+    return report
+
+
+async def compress_existing_metadata(db, batch_size: int = COMPRESS_BATCH_SIZE, dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Pack the oversized metadata fields of existing documents in the hot
+    collections, one bulk write per batch. Idempotent: packed values are
+    skipped. Returns per collection the documents packed and the field bytes
+    before and after.
+    """
+    report = {}
+    for collection in ("requestProgress", "priorAuthUserAction"):
+        fields = PACKED_FIELDS[collection]
+        id_field = "requestId" if collection == "requestProgress" else "id"
+        stats = {"documents": 0, "originalBytes": 0, "storedBytes": 0}
+        updates = []
+        # Superseded revisions go once their batch is written; a failed batch keeps them
+        revisions = BlobRevisions(db)
+        cursor = db[collection].find(
+            {"$or": [{field: {"$exists": True}} for field in fields]},
+            {id_field: 1, **{field: 1 for field in fields}}
+        )
+        async for document in cursor:
+            packed_fields = {}
+            for field in fields:
+                value = document.get(field)
+                if value is None or is_packed(value):
+                    continue
+                if dry_run:
+                    # Estimate with in-place compression only, so nothing is written to GridFS
+                    encoded = _encode(value)
+                    stored = value
+                    if len(encoded) > METADATA_COMPRESSION_THRESHOLD:
+                        stored = {"_packed": "zlib", "size": len(encoded),
+                                  "storedSize": len(zlib.compress(encoded, METADATA_COMPRESSION_LEVEL))}
+                else:
+                    stored = await pack(value, f"{collection}/{document[id_field]}/{field}", db, revisions)
+                if is_packed(stored):
+                    packed_fields[field] = stored
+                    stats["originalBytes"] += stored["size"]
+                    stats["storedBytes"] += stored["storedSize"]
+            if packed_fields:
+                stats["documents"] += 1
+                updates.append(UpdateOne({"_id": document["_id"]}, {"$set": packed_fields}))
+            if len(updates) >= batch_size:
+                if not dry_run:
+                    await db[collection].bulk_write(updates, ordered=False)
+                    await revisions.commit()
+                updates = []
+        if updates and not dry_run:
+            await db[collection].bulk_write(updates, ordered=False)
+            await revisions.commit()
+        report[collection] = stats
+    return report
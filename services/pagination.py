@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination for the dashboard lists
+A page is sorted on a timestamp plus a unique tiebreaker, both descending,
+and the cursor is the sort key of the last row returned, as an opaque
+URL-safe token. The next page asks the index for rows strictly after that
+key, so it starts with an index seek instead of skipping rows: deep pages
+cost the same as the first one, and rows inserted meanwhile with newer
+timestamps don't shift the pages being walked.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+
+from bson import json_util
+
+# Response header carrying the cursor of the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Largest page a list endpoint serves
+MAX_PAGE_SIZE = 200
+# Types a sort key may hold; anything else in a cursor (e.g. an operator document) is rejected
+CURSOR_VALUE_TYPES = (datetime, str, int, float)
+
+# Orderings of the paginated lists; each has matching indexes in db/config/indexes.py
+REQUESTS_SORT = [("lastUpdatedAt", -1), ("requestId", -1)]
+USER_ACTIONS_SORT = [("requestedAt", -1), ("id", -1)]
+
+
+class InvalidCursorError(ValueError):
+    """The cursor token is malformed or belongs to a different list"""
+
+
+def encode_cursor(document: Dict[str, Any], sort: List[Tuple[str, int]]) -> str:
+    values = [document.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort: List[Tuple[str, int]]) -> List[Any]:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception as e:
+        # Anything from bad base64 to a mangled extended JSON value
+        raise InvalidCursorError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise InvalidCursorError("Invalid cursor: doesn't match this list's ordering")
+    if not all(isinstance(value, CURSOR_VALUE_TYPES) for value in values):
+        raise InvalidCursorError("Invalid cursor: unexpected value")
+    return values
+
+
+def keyset_after(sort: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """
+    Filter for the rows after `values` in a (field desc, tiebreaker desc)
+    order. The plain range on the leading field bounds the index scan; the
+    $or only drops the rows tied with the cursor that were already returned.
+    """
+    (field, _), (tiebreaker, _) = sort
+    at, last_id = values
+    return {
+        field: {"$lte": at},
+        "$or": [{field: {"$lt": at}}, {tiebreaker: {"$lt": last_id}}]
+    }
+
+
+def after_cursor(token: Optional[str], sort: List[Tuple[str, int]]) -> Dict[str, Any]:
+    """Filter resuming after a cursor token; empty for the first page"""
+    if not token:
+        return {}
+    return keyset_after(sort, decode_cursor(token, sort))
+
+
+def paginate(documents: List[Dict[str, Any]], limit: int, sort: List[Tuple[str, int]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Split a query run with limit + 1 into the page and the cursor of the
+    next one (None on the last page), so an exactly full last page doesn't
+    hand out a cursor to an empty one
+    """
+    if len(documents) <= limit:
+        return documents, None
+    page = documents[:limit]
+    return page, encode_cursor(page[-1], sort) if page else None
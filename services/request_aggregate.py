@@ -0,0 +1,96 @@
+"""
+Request aggregate
+requestProgress doubles as the denormalized request aggregate: next to the
+current status it embeds the request header (copied from priorAuthRequest
+when the workflow is triggered) and a pendingActions counter, all written by
+the single find_one_and_update in services/request_state.py. List and
+detail endpoints read it instead of joining priorAuthRequest and counting
+priorAuthUserAction per request.
+backfill_request_aggregate fills it in for requests written before the
+aggregate existed (see migrate_request_aggregate.py).
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateMany, UpdateOne
+
+HEADER_FIELDS = ("userId", "patientId", "patientName", "payerId", "createdAt")
+BACKFILL_BATCH_SIZE = 500
+
+
+def header_fields(prior_auth_request: Dict[str, Any]) -> Dict[str, Any]:
+    """The priorAuthRequest fields embedded in the aggregate"""
+    return {field: prior_auth_request.get(field) for field in HEADER_FIELDS}
+
+
+def request_header(progress: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The embedded request header, or None if the workflow was never triggered"""
+    if not progress or progress.get("createdAt") is None:
+        return None
+    return {"requestId": progress["requestId"], **header_fields(progress)}
+
+
+async def _write_batch(db, requests: List[Dict[str, Any]], pending: Dict[str, int], stats: Dict[str, int], dry_run: bool):
+    aggregate_updates, action_updates = [], []
+    for request in requests:
+        request_id = request["requestId"]
+        aggregate_updates.append(UpdateOne(
+            {"requestId": request_id},
+            {"$set": {**header_fields(request), "pendingActions": pending.pop(request_id, 0)}}
+        ))
+        action_updates.append(UpdateMany(
+            {"requestId": request_id, "patientName": None},
+            {"$set": {"patientName": request.get("patientName")}}
+        ))
+    stats["requests"] += len(requests)
+    if dry_run:
+        return
+    result = await db["requestProgress"].bulk_write(aggregate_updates, ordered=False)
+    stats["aggregates_updated"] += result.modified_count
+    result = await db["priorAuthUserAction"].bulk_write(action_updates, ordered=False)
+    stats["actions_updated"] += result.modified_count
+
+
+async def backfill_request_aggregate(db, batch_size: int = BACKFILL_BATCH_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Copy request headers into requestProgress, recount pendingActions and copy
+    patient names onto user actions, in batches of bulk writes. Idempotent;
+    re-running it also repairs counters that drifted (the action update and
+    the counter update are two documents and can't be written atomically).
+    """
+    stats = {"requests": 0, "aggregates_updated": 0, "actions_updated": 0, "counters_updated": 0}
+
+    # Pending actions per request, in one pass
+    pending = {
+        group["_id"]: group["count"]
+        async for group in db["priorAuthUserAction"].aggregate([
+            {"$match": {"actionStatus": "PENDING"}},
+            {"$group": {"_id": "$requestId", "count": {"$sum": 1}}}
+        ])
+    }
+
+    batch = []
+    projection = {"_id": 0, "requestId": 1, **{field: 1 for field in HEADER_FIELDS}}
+    async for request in db["priorAuthRequest"].find({}, projection):
+        batch.append(request)
+        if len(batch) >= batch_size:
+            await _write_batch(db, batch, pending, stats, dry_run)
+            batch = []
+    if batch:
+        await _write_batch(db, batch, pending, stats, dry_run)
+
+    # Requests whose workflow was never triggered have no header, only counters
+    counter_updates = [
+        UpdateOne({"requestId": request_id}, {"$set": {"pendingActions": count}})
+        for request_id, count in pending.items()
+    ]
+    if not dry_run:
+        for start in range(0, len(counter_updates), batch_size):
+            result = await db["requestProgress"].bulk_write(counter_updates[start:start + batch_size], ordered=False)
+            stats["counters_updated"] += result.modified_count
+        result = await db["requestProgress"].update_many(
+            {"pendingActions": {"$exists": False}},
+            {"$set": {"pendingActions": 0}}
+        )
+        stats["counters_updated"] += result.modified_count
+    return stats
@@ -0,0 +1,180 @@
+"""
+Hot/cold tiering for requests
+Requests in a terminal status that haven't changed for REQUEST_ARCHIVE_AFTER_DAYS
+are moved, with everything recorded for them, from the hot collections the
+agent tools and dashboard query into *Archive collections. Failed requests
+may still be retried (services/request_state.py), so they are only archived
+after the much longer REQUEST_ARCHIVE_FAILED_AFTER_DAYS. A batch is first
+claimed by stamping archivingAt on its requestProgress documents, still
+under the archive filter; from then on every write path refuses them
+(NOT_ARCHIVING), so nothing can be added to a request while its history
+is being moved. Each collection is then copied with one bulk write and
+deleted from the hot side; requestProgress goes last, so a pass interrupted
+half way leaves the request visible (and claimed) and the next pass
+finishes it. Archived requests are read-only and still served by
+/dashboard/request-details.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import os
+
+from pymongo import ReplaceOne
+
+from db.config.connection import get_db
+from db.models.dbmodels.requestProgress import RequestStatus
+from services.job_lease import acquire_lease
+
+REQUEST_ARCHIVE_ENABLED = os.getenv("REQUEST_ARCHIVE_ENABLED", "false").lower() == "true"
+REQUEST_ARCHIVE_AFTER_DAYS = float(os.getenv("REQUEST_ARCHIVE_AFTER_DAYS", "30"))
+# Failed requests stay retryable in the hot collections this long
+REQUEST_ARCHIVE_FAILED_AFTER_DAYS = float(os.getenv("REQUEST_ARCHIVE_FAILED_AFTER_DAYS", "180"))
+REQUEST_ARCHIVE_BATCH_SIZE = int(os.getenv("REQUEST_ARCHIVE_BATCH_SIZE", "500"))
+# Seconds between passes; each pass moves at most REQUEST_ARCHIVE_MAX_BATCHES batches
+REQUEST_ARCHIVE_INTERVAL = float(os.getenv("REQUEST_ARCHIVE_INTERVAL", "3600"))
+REQUEST_ARCHIVE_MAX_BATCHES = int(os.getenv("REQUEST_ARCHIVE_MAX_BATCHES", "20"))
+
+# Statuses a request can never leave; FAILED has its own retention
+TERMINAL_STATUSES = [RequestStatus.COMPLETED.value, RequestStatus.SUCCEEDED.value]
+
+# Hot collection -> archive collection, in the order they are moved
+ARCHIVE_COLLECTIONS = {
+    "priorAuthUserAction": "priorAuthUserActionArchive",
+    "requestEvents": "requestEventsArchive",
+    "conversationHistory": "conversationHistoryArchive",
+    "priorAuthRequest": "priorAuthRequestArchive",
+    "requestProgress": "requestProgressArchive",
+}
+
+
+# Added to the filter of every requestProgress write: a claimed request only leaves the hot side
+NOT_ARCHIVING = {"archivingAt": {"$exists": False}}
+
+
+def archive_filter(cutoff: datetime, failed_cutoff: Optional[datetime] = None) -> Dict:
+    """Terminal requests untouched since `cutoff`, and failed ones since `failed_cutoff` (if given)"""
+    terminal = {"status": {"$in": TERMINAL_STATUSES}, "lastUpdatedAt": {"$lt": cutoff}}
+    if failed_cutoff is None:
+        return terminal
+    return {"$or": [terminal, {"status": RequestStatus.FAILED.value, "lastUpdatedAt": {"$lt": failed_cutoff}}]}
+
+
+async def archive_batch(
+    db,
+    cutoff: datetime,
+    batch_size: int = REQUEST_ARCHIVE_BATCH_SIZE,
+    failed_cutoff: Optional[datetime] = None
+) -> Dict[str, int]:
+    """Move one batch of archivable requests; returns documents moved per hot collection"""
+    # Candidates include requests claimed by a pass that was interrupted
+    candidates = await db["requestProgress"].find(
+        archive_filter(cutoff, failed_cutoff), {"requestId": 1}
+    ).limit(batch_size).to_list(None)
+    request_ids = [doc["requestId"] for doc in candidates]
+    moved = {}
+    if not request_ids:
+        return moved
+
+    # Claim under the archive filter, so a request retried since it was selected stays hot
+    await db["requestProgress"].update_many(
+        {"requestId": {"$in": request_ids}, **archive_filter(cutoff, failed_cutoff), **NOT_ARCHIVING},
+        {"$set": {"archivingAt": datetime.now()}}
+    )
+    claimed = await db["requestProgress"].find(
+        {"requestId": {"$in": request_ids}, "archivingAt": {"$exists": True}}, {"requestId": 1}
+    ).to_list(None)
+    request_ids = [doc["requestId"] for doc in claimed]
+    if not request_ids:
+        return moved
+
+    for hot, archive in ARCHIVE_COLLECTIONS.items():
+        documents = await db[hot].find({"requestId": {"$in": request_ids}}).to_list(None)
+        if not documents:
+            continue
+        if hot == "requestProgress":
+            for doc in documents:
+                doc.pop("archivingAt", None)
+        # Upserts by _id make a repeated pass after a crash harmless
+        await db[archive].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents],
+            ordered=False
+        )
+        # Delete exactly what was copied, never documents written since the read
+        result = await db[hot].delete_many({"_id": {"$in": [doc["_id"] for doc in documents]}})
+        moved[hot] = result.deleted_count
+    return moved
+
+
+async def archive_terminal_requests(
+    db,
+    older_than_days: float = REQUEST_ARCHIVE_AFTER_DAYS,
+    batch_size: int = REQUEST_ARCHIVE_BATCH_SIZE,
+    max_batches: int = REQUEST_ARCHIVE_MAX_BATCHES,
+    failed_older_than_days: float = REQUEST_ARCHIVE_FAILED_AFTER_DAYS
+) -> Dict[str, int]:
+    """One archiving pass, batch by batch until nothing is left or max_batches is reached"""
+    now = datetime.now()
+    cutoff = now - timedelta(days=older_than_days)
+    failed_cutoff = now - timedelta(days=max(failed_older_than_days, older_than_days))
+    totals: Dict[str, int] = {}
+    for _ in range(max_batches):
+        moved = await archive_batch(db, cutoff, batch_size, failed_cutoff)
+        for collection, count in moved.items():
+            totals[collection] = totals.get(collection, 0) + count
+        if moved.get("requestProgress", 0) < batch_size:
+            break
+    return totals
+
+
+class RequestArchiver:
+    """
+    Runs archive passes every REQUEST_ARCHIVE_INTERVAL seconds in the worker
+    holding the "requestArchiver" lease; other workers skip their turn.
+    """
+
+    def __init__(self, interval: float = REQUEST_ARCHIVE_INTERVAL):
+        self.interval = interval
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[str, int]:
+        db = get_db()
+        # The lease outlives one interval so the holder renews it before anyone else can take it
+        if not await acquire_lease(db, "requestArchiver", ttl_seconds=self.interval * 2):
+            return {}
+        self.last_result = await archive_terminal_requests(db)
+        self.last_run = datetime.now()
+        if self.last_result:
+            print(f"Archived terminal requests: {self.last_result}")
+        return self.last_result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                # Whatever failed, the claimed batch is resumed on the next pass
+                print(f"Request archiving failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+request_archiver = RequestArchiver()
+
+
+def get_request_archiver() -> RequestArchiver:
+    return request_archiver
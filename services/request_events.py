@@ -0,0 +1,121 @@
+"""
+Append-only request event log (requestEvents)
+Every status change, n8n callback, screenshot and user action is appended
+as one document keyed by (requestId, seq). Sequence numbers come from
+requestProgress.eventSeq, incremented in the same update as the status
+change (see services/request_state.py), so ordering costs no extra round
+trip and the timeline is one indexed range read.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import json
+import os
+
+from pymongo import ReturnDocument
+
+from db.config.connection import get_db
+from db.models.dbmodels.requestEvent import RequestEvent, RequestEventType
+from services.request_archiver import NOT_ARCHIVING
+from services.write_behind import EVENTS, get_write_behind
+
+# Serialized size above which an event's details are replaced by a truncated preview
+REQUEST_EVENT_MAX_BYTES = int(os.getenv("REQUEST_EVENT_MAX_BYTES", "4096"))
+REQUEST_EVENT_MAX_DESCRIPTION = 500
+
+
+def cap_details(details: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Details as stored: unchanged when small enough, otherwise a preview of the serialized payload"""
+    details = details or {}
+    encoded = json.dumps(details, default=str)
+    size = len(encoded.encode("utf-8"))
+    if size <= REQUEST_EVENT_MAX_BYTES:
+        return {"details": details, "truncated": False}
+    preview = encoded.encode("utf-8")[:REQUEST_EVENT_MAX_BYTES].decode("utf-8", errors="ignore")
+    return {"details": {"preview": preview, "originalBytes": size}, "truncated": True}
+
+
+def build_event(
+    event_type: RequestEventType,
+    description: str,
+    details: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """An event without its requestId/seq/status, which are filled in when it is appended"""
+    return {
+        "eventType": event_type,
+        "timestamp": datetime.now(),
+        "description": description[:REQUEST_EVENT_MAX_DESCRIPTION],
+        **cap_details(details)
+    }
+
+
+async def append_events(db, request_id: str, last_seq: int, status: Any, events: List[Dict[str, Any]]):
+    """
+    Insert events whose sequence numbers were already reserved, ending at
+    last_seq. Best effort: a failed history write never fails the step it
+    records, it only leaves a gap in the sequence. With the write-behind
+    queue running the insert is queued instead (see services/write_behind.py).
+    """
+    if not events:
+        return
+    first_seq = last_seq - len(events) + 1
+    try:
+        documents = [
+            RequestEvent(requestId=request_id, seq=first_seq + offset, status=status, **event).model_dump()
+            for offset, event in enumerate(events)
+        ]
+        if get_write_behind().enqueue(EVENTS, request_id, {"documents": documents}):
+            return
+        await db["requestEvents"].insert_many(documents, ordered=False)
+    except Exception as e:
+        print(f"Could not record {len(events)} events for request {request_id}: {e}")
+
+
+async def record_events(
+    request_id: str,
+    events: List[Dict[str, Any]],
+    db=None,
+    counters: Optional[Dict[str, int]] = None
+) -> bool:
+    """
+    Append events that don't come with a status change (e.g. a user action
+    completed from the dashboard), adjusting `counters` in the same update.
+    Returns False if the request doesn't exist.
+    """
+    db = db if db is not None else get_db()
+    progress = await db["requestProgress"].find_one_and_update(
+        {"requestId": request_id, **NOT_ARCHIVING},
+        {"$inc": {"eventSeq": len(events), **(counters or {})}},
+        projection={"status": 1, "eventSeq": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if progress is None:
+        return False
+    await append_events(db, request_id, progress["eventSeq"], progress.get("status"), events)
+    return True
+
+
+def timeline_entry(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "seq": event["seq"],
+        "timestamp": event["timestamp"],
+        "event": event["eventType"],
+        "description": event.get("description", ""),
+        "status": event.get("status"),
+        "details": event.get("details", {}),
+        "truncated": event.get("truncated", False)
+    }
+
+
+async def get_timeline(request_id: str, db=None) -> List[Dict[str, Any]]:
+    """A request's full history in order, from one range read on (requestId, seq)"""
+    db = db if db is not None else get_db()
+    events = await db["requestEvents"].find({"requestId": request_id}, {"_id": 0}).sort([("seq", 1)]).to_list(None)
+    return [timeline_entry(event) for event in events]
+
+
+async def get_archived_timeline(request_id: str, db=None) -> List[Dict[str, Any]]:
+    """History of a request moved to requestEventsArchive by services/request_archiver.py"""
+    db = db if db is not None else get_db()
+    events = await db["requestEventsArchive"].find({"requestId": request_id}, {"_id": 0}).sort([("seq", 1)]).to_list(None)
+    return [timeline_entry(event) for event in events]
@@ -0,0 +1,249 @@
+"""
+Time-bucketed request rollups (requestRollups)
+Hourly and daily buckets per payer, plus an all-payers ("*") series, of:
+- created: requests submitted in the bucket, i.e. whose priorAuthRequest
+  header was written (by the n8n trigger), by its createdAt, the same count
+  /dashboard/payer-stats takes from priorAuthRequest
+- entered.<status>: transitions into each status (outcomes are entries into
+  completed/succeeded and failed)
+- durations.<status>.{count,totalMs}: time requests spent in a status before
+  the transition that left it, i.e. per workflow step
+Every transition $inc's its hour and day buckets (services/request_state.py),
+so a trend over any window sums at most a few hundred small documents. Like
+the status counters, and in the same fan-out, this is a best-effort second
+write; backfill_rollups rebuilds past buckets (see migrate_request_rollups.py).
+
+A step counts under the payer the request had once the step was applied.
+A step whose details name a payer (check-payer, validate-json, the trigger)
+sets requestProgress.payerId (services/request_state.transition), and the
+backfill replays the same rule from the event details, so rebuilt and live
+buckets agree. Steps before any payer was named count under "-".
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+
+from db.models.dbmodels.requestEvent import RequestEventType
+from services.dashboard_stats import STATUS_BUCKETS
+
+ALL_PAYERS = "*"
+UNKNOWN_PAYER = "-"
+ROLLUP_BACKFILL_BATCH_SIZE = 500
+# Windows up to this many days are served from hourly buckets, longer ones from daily
+HOURLY_MAX_DAYS = 2
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_id(granularity: str, bucket: datetime, payer_id: str) -> str:
+    return f"{granularity}:{bucket.isoformat()}:{payer_id}"
+
+
+def _status(value: Any) -> str:
+    return getattr(value, "value", value)
+
+
+def transition_increments(
+    before: Optional[Dict[str, Any]],
+    after: Dict[str, Any],
+    at: datetime
+) -> Dict[str, int]:
+    """Rollup $inc for one status change (none for a newly created request or a progress update)"""
+    if before is None or _status(before.get("status")) == _status(after.get("status")):
+        return {}
+    increments = {f"entered.{_status(after['status'])}": 1}
+    entered_at = before.get("statusEnteredAt") or before.get("lastUpdatedAt")
+    if entered_at is not None:
+        previous = _status(before.get("status"))
+        increments[f"durations.{previous}.count"] = 1
+        increments[f"durations.{previous}.totalMs"] = max(int((at - entered_at).total_seconds() * 1000), 0)
+    return increments
+
+
+def rollup_buckets(payer_id: Optional[str], at: datetime) -> List[Dict[str, Any]]:
+    """The hour and day buckets of `at`, for the payer and for all payers"""
+    keys = []
+    for granularity in ("hour", "day"):
+        bucket = bucket_start(at, granularity)
+        for payer in (payer_id or UNKNOWN_PAYER, ALL_PAYERS):
+            keys.append({"_id": rollup_id(granularity, bucket, payer), "granularity": granularity, "bucket": bucket, "payerId": payer})
+    return keys
+
+
+def _bucket_increments(payer_id: Optional[str], at: datetime, increments: Dict[str, int]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "collection": "requestRollups",
+            "_id": key["_id"],
+            "$inc": increments,
+            "$setOnInsert": {field: key[field] for field in ("granularity", "bucket", "payerId")}
+        }
+        for key in rollup_buckets(payer_id, at)
+    ]
+
+
+def rollup_increments(before: Optional[Dict[str, Any]], after: Dict[str, Any], at: datetime) -> List[Dict[str, Any]]:
+    """
+    The bucket changes of one step as increments (see
+    services/write_behind.apply_increments): its status change, and the
+    request's creation once the step embeds the header (a retried trigger
+    keeps the original createdAt and isn't counted again)
+    """
+    result = []
+    increments = transition_increments(before, after, at)
+    if increments:
+        result.extend(_bucket_increments(after.get("payerId"), at, increments))
+    if after.get("createdAt") is not None and (before or {}).get("createdAt") is None:
+        result.extend(_bucket_increments(after.get("payerId"), after["createdAt"], {"created": 1}))
+    return result
+
+
+# ============================================================================
+# Backfill
+# ============================================================================
+
+def _replay(events: Iterable[Dict[str, Any]]) -> Iterable[Tuple[datetime, Optional[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    (timestamp, before, after) for every status change in one request's
+    seq-ordered history. Every event carries the status the request was left
+    in, so a change is any event whose status differs from the last one. The
+    payer is picked up from every step whose details name one, as
+    services/request_state.transition does live.
+    """
+    state: Optional[Dict[str, Any]] = None
+    payer_id = None
+    for event in events:
+        payer_id = (event.get("details") or {}).get("payer_id") or payer_id
+        status = _status(event.get("status"))
+        if state is None or _status(event.get("eventType")) == RequestEventType.REQUEST_CREATED.value:
+            previous = None
+        elif status is not None and status != state["status"]:
+            previous = state
+        else:
+            continue
+        state = {"status": status, "statusEnteredAt": event["timestamp"], "payerId": payer_id}
+        yield event["timestamp"], previous, state
+
+
+async def backfill_rollups(db, before: datetime, batch_size: int = ROLLUP_BACKFILL_BATCH_SIZE,
+                           dry_run: bool = False) -> Dict[str, int]:
+    """
+    Rebuild every bucket that ends before `before` (rounded down to a day),
+    replacing what is there: created counts from the priorAuthRequest headers
+    (hot and archived), which predate the event log, and status changes and
+    step durations from requestEvents and requestEventsArchive, which only
+    cover requests since the event log was introduced. Pass a day boundary
+    at or before the time live rollups started, so no bucket mixes both
+    sources; live increments maintain the buckets from `before` on.
+    """
+    before = bucket_start(before, "day")
+    buckets: Dict[str, Dict[str, Any]] = {}
+    stats = {"requests": 0, "created": 0, "transitions": 0, "buckets": 0}
+
+    for collection in ("priorAuthRequest", "priorAuthRequestArchive"):
+        cursor = db[collection].find(
+            {"createdAt": {"$lt": before}},
+            {"_id": 0, "payerId": 1, "createdAt": 1}
+        ).batch_size(batch_size)
+        async for request in cursor:
+            stats["created"] += 1
+            for key in rollup_buckets(request.get("payerId"), request["createdAt"]):
+                _accumulate(buckets.setdefault(key["_id"], dict(key)), {"created": 1})
+
+    for collection in ("requestEvents", "requestEventsArchive"):
+        # One pass in (requestId, seq) index order, one request's history at a time
+        cursor = db[collection].find(
+            {"timestamp": {"$lt": before}},
+            {"_id": 0, "requestId": 1, "eventType": 1, "status": 1, "timestamp": 1, "details.payer_id": 1}
+        ).sort([("requestId", 1), ("seq", 1)]).batch_size(batch_size)
+        history: List[Dict[str, Any]] = []
+        async for event in cursor:
+            if history and event["requestId"] != history[0]["requestId"]:
+                _replay_into(history, buckets, stats)
+                history = []
+            history.append(event)
+        if history:
+            _replay_into(history, buckets, stats)
+
+    stats["buckets"] = len(buckets)
+    if not dry_run:
+        documents = list(buckets.values())
+        for start in range(0, len(documents), batch_size):
+            await db["requestRollups"].bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents[start:start + batch_size]],
+                ordered=False
+            )
+    return stats
+
+
+def _replay_into(history: List[Dict[str, Any]], buckets: Dict[str, Dict[str, Any]], stats: Dict[str, int]):
+    stats["requests"] += 1
+    for at, previous, after in _replay(history):
+        increments = transition_increments(previous, after, at)
+        if not increments:
+            continue
+        stats["transitions"] += 1
+        for key in rollup_buckets(after["payerId"], at):
+            _accumulate(buckets.setdefault(key["_id"], dict(key)), increments)
+
+
+def _accumulate(document: Dict[str, Any], increments: Dict[str, int]):
+    """Apply an $inc with dotted paths to an in-memory bucket"""
+    for path, amount in increments.items():
+        target = document
+        *parents, leaf = path.split(".")
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = target.get(leaf, 0) + amount
+
+
+# ============================================================================
+# Reads
+# ============================================================================
+
+def trend_granularity(days: int) -> str:
+    return "hour" if days <= HOURLY_MAX_DAYS else "day"
+
+
+def rollup_query(granularity: str, payer_id: str, start: datetime) -> Dict[str, Any]:
+    """Buckets of one series from `start` on; one range on the (granularity, payerId, bucket) index"""
+    return {"granularity": granularity, "payerId": payer_id, "bucket": {"$gte": bucket_start(start, granularity)}}
+
+
+def _summarize(entered: Dict[str, int], created: int, durations: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    return {
+        "created": created,
+        "completed": sum(entered.get(status, 0) for status in STATUS_BUCKETS["completed"]),
+        "failed": sum(entered.get(status, 0) for status in STATUS_BUCKETS["failed"]),
+        "entered": entered,
+        "avg_step_ms": {
+            status: round(duration["totalMs"] / duration["count"])
+            for status, duration in durations.items() if duration.get("count")
+        }
+    }
+
+
+def summarize_rollups(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-bucket points and window totals; outcomes use the dashboard's completed/failed buckets"""
+    entered: Dict[str, int] = {}
+    durations: Dict[str, Dict[str, int]] = {}
+    series = []
+    for document in documents:
+        for status, count in document.get("entered", {}).items():
+            entered[status] = entered.get(status, 0) + count
+        for status, duration in document.get("durations", {}).items():
+            total = durations.setdefault(status, {"count": 0, "totalMs": 0})
+            total["count"] += duration.get("count", 0)
+            total["totalMs"] += duration.get("totalMs", 0)
+        series.append({
+            "bucket": document["bucket"],
+            **_summarize(document.get("entered", {}), document.get("created", 0), document.get("durations", {}))
+        })
+    totals = _summarize(entered, sum(point["created"] for point in series), durations)
+    return {"series": series, "totals": totals}
@@ -0,0 +1,229 @@
+"""
+Request state machine for requestProgress
+Every status change is checked against ALLOWED_TRANSITIONS and applied as a
+single atomic find_one_and_update that returns the updated document, so one
+tool step costs one round trip. The check happens in the update filter, so
+two concurrent writers can't both move a request out of the same state.
+Each transition also reserves sequence numbers for its requestEvents entries
+($add on eventSeq) and adjusts the aggregate's counters (pendingActions) in
+that same update. The update returns the previous document, so the
+statusCounters change (services/status_counters.py) and the requestRollups
+increments (services/request_rollups.py) are known without another read;
+record_step sends them and the events in one concurrent fan-out, or queues
+them on the write-behind queue, so a step costs two round trips at most.
+
+The update is a pipeline so statusEnteredAt only moves when the status
+actually changes; every $set value is wrapped in $literal so stored data is
+never read as an expression.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+
+from pymongo import ReturnDocument
+
+from db.config.connection import get_db
+from db.models.dbmodels.requestEvent import RequestEventType
+from db.models.dbmodels.requestProgress import RequestStatus
+from services.metadata_store import BlobRevisions
+from services.request_archiver import NOT_ARCHIVING
+from services.request_events import append_events, build_event
+from services.request_rollups import rollup_increments
+from services.status_counters import counter_increments
+from services.write_behind import INCREMENTS, PROGRESS, apply_increments, get_write_behind
+
+ACTIVE_TARGETS = {
+    RequestStatus.PROCESSING,
+    RequestStatus.IN_PROGRESS,
+    RequestStatus.ACTION_NEEDED,
+    RequestStatus.USER_ACTION_REQUIRED,
+    RequestStatus.COMPLETED,
+    RequestStatus.FAILED,
+}
+
+# Status a request may move to from each status; staying in the same status
+# (a progress update) is always allowed
+ALLOWED_TRANSITIONS: Dict[RequestStatus, set] = {
+    RequestStatus.CREATED: {RequestStatus.VALIDATED, RequestStatus.PROCESSING, RequestStatus.IN_PROGRESS, RequestStatus.FAILED},
+    RequestStatus.VALIDATED: {RequestStatus.PROCESSING, RequestStatus.IN_PROGRESS, RequestStatus.FAILED},
+    RequestStatus.PROCESSING: ACTIVE_TARGETS | {RequestStatus.VALIDATED},
+    RequestStatus.IN_PROGRESS: ACTIVE_TARGETS | {RequestStatus.SUCCEEDED},
+    RequestStatus.ACTION_NEEDED: ACTIVE_TARGETS,
+    RequestStatus.USER_ACTION_REQUIRED: ACTIVE_TARGETS,
+    # The agent may retry a failed request from the start of the workflow
+    RequestStatus.FAILED: {RequestStatus.PROCESSING, RequestStatus.IN_PROGRESS},
+    RequestStatus.COMPLETED: set(),
+    RequestStatus.SUCCEEDED: set(),
+}
+
+
+class InvalidTransitionError(Exception):
+    """The request exists but its current status doesn't allow the requested one"""
+
+    def __init__(self, request_id: str, current: Any, target: RequestStatus, message: Optional[str] = None):
+        self.request_id = request_id
+        self.current = getattr(current, "value", current)
+        self.target = target
+        super().__init__(message or f"Request {request_id} cannot move from '{self.current}' to '{target.value}'")
+
+
+class RequestArchivedError(InvalidTransitionError):
+    """The request is archived, or claimed for archiving, and can no longer change"""
+
+    def __init__(self, request_id: str, current: Any, target: RequestStatus):
+        super().__init__(request_id, current, target, f"Request {request_id} is archived and can no longer change")
+
+
+def can_transition(current: RequestStatus, target: RequestStatus) -> bool:
+    return current == target or target in ALLOWED_TRANSITIONS.get(current, set())
+
+
+def allowed_sources(target: RequestStatus) -> List[str]:
+    """Stored status values a request may be in to move to `target`"""
+    return [status.value for status in RequestStatus if can_transition(status, target)]
+
+
+async def transition(
+    request_id: str,
+    status: Optional[RequestStatus],
+    remarks: Optional[str] = None,
+    fields: Optional[Dict[str, Any]] = None,
+    db=None,
+    event_type: Optional[RequestEventType] = None,
+    details: Optional[Dict[str, Any]] = None,
+    events: Optional[List[Dict[str, Any]]] = None,
+    counters: Optional[Dict[str, int]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Apply one step to a request and return the updated document.
+    status=None records progress (remarks/fields) without changing status.
+    The step is appended to requestEvents as `event_type` (STATUS_UPDATE or
+    PROGRESS_UPDATE by default) with `details`, followed by any `events`;
+    `counters` are $inc'ed alongside (e.g. {"pendingActions": 1}).
+    Returns None if the request doesn't exist; raises InvalidTransitionError
+    if it exists in a status that can't move to `status`.
+    """
+    db = db if db is not None else get_db()
+    if event_type is None:
+        event_type = RequestEventType.STATUS_UPDATE if status is not None else RequestEventType.PROGRESS_UPDATE
+    description = remarks or (f"Status changed to {status.value}" if status is not None else "Progress updated")
+    step_events = [build_event(event_type, description, details)] + list(events or [])
+
+    now = datetime.now()
+    update = {"lastUpdatedAt": now, **(fields or {})}
+    # A step naming the payer attributes the request to it from here on, before
+    # the trigger embeds the header (the backfill in request_rollups.py replays this)
+    if (details or {}).get("payer_id") and "payerId" not in update:
+        update["payerId"] = details["payer_id"]
+    if remarks is not None:
+        update["remarks"] = remarks
+    # An archived request is read-only from the moment it is claimed for archiving
+    query: Dict[str, Any] = {"requestId": request_id, **NOT_ARCHIVING}
+    stage: Dict[str, Any] = {}
+    if status is not None:
+        update["status"] = status
+        query["status"] = {"$in": allowed_sources(status)}
+        stage["statusEnteredAt"] = {"$cond": [{"$eq": ["$status", status.value]}, "$statusEnteredAt", now]}
+
+    increments = {"eventSeq": len(step_events), **(counters or {})}
+    stage.update({field: {"$literal": value} for field, value in update.items()})
+    stage.update({field: {"$add": [{"$ifNull": [f"${field}", 0]}, step]} for field, step in increments.items()})
+    previous = await db["requestProgress"].find_one_and_update(
+        query,
+        [{"$set": stage}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        if status is not None:
+            # Only on the rejected path: tell "missing" and "archived" apart from "not allowed"
+            current = await db["requestProgress"].find_one({"requestId": request_id}, {"status": 1, "archivingAt": 1})
+            if current is not None and "archivingAt" in current:
+                raise RequestArchivedError(request_id, current.get("status"), status)
+            if current is not None:
+                raise InvalidTransitionError(request_id, current.get("status"), status)
+            archived = await db["requestProgressArchive"].find_one({"requestId": request_id}, {"status": 1})
+            if archived is not None:
+                raise RequestArchivedError(request_id, archived.get("status"), status)
+        return None
+    document = {**previous, **update}
+    for field, step in increments.items():
+        document[field] = previous.get(field, 0) + step
+    if status is not None and previous.get("status") != status.value:
+        document["statusEnteredAt"] = now
+    await record_step(db, previous, document, step_events, now)
+    return document
+
+
+async def record_step(
+    db,
+    previous: Optional[Dict[str, Any]],
+    document: Dict[str, Any],
+    events: List[Dict[str, Any]],
+    at: datetime
+):
+    """
+    Everything written after a requestProgress change (previous=None for a
+    new request): the statusCounters and requestRollups increments and the
+    step's events, whose seqs end at document["eventSeq"]. Queued when the
+    write-behind queue is running; otherwise the increments go out as one
+    bulk write per collection, concurrently with the event insert. Best
+    effort, never raises.
+    """
+    increments = counter_increments(previous, document, at) + rollup_increments(previous, document, at)
+    if increments and get_write_behind().enqueue(INCREMENTS, document["requestId"], {"increments": increments}):
+        increments = []
+    await asyncio.gather(
+        _apply_increments(db, document["requestId"], increments),
+        append_events(db, document["requestId"], document["eventSeq"], document.get("status"), events)
+    )
+
+
+async def _apply_increments(db, request_id: str, increments: List[Dict[str, Any]]):
+    if not increments:
+        return
+    try:
+        await apply_increments(db, increments)
+    except Exception as e:
+        # Counters are reconciled and rollups can be backfilled; never fail the step
+        print(f"Could not update counters and rollups for {request_id}: {e}")
+
+
+async def record_progress(
+    request_id: str,
+    remarks: Optional[str] = None,
+    fields: Optional[Dict[str, Any]] = None,
+    db=None,
+    event_type: RequestEventType = RequestEventType.PROGRESS_UPDATE,
+    details: Optional[Dict[str, Any]] = None,
+    revisions: Optional[BlobRevisions] = None
+) -> bool:
+    """
+    A progress update nobody waits on (remarks/fields, no status change).
+    Queued on the write-behind queue when it is running, otherwise applied
+    right away with transition(). Returns False only when applied right away
+    to a request that doesn't exist; queued updates for a missing request
+    are dropped when they are replayed. GridFS `revisions` packed into
+    `fields` are settled once the update is applied (or dropped).
+    """
+    event = build_event(event_type, remarks or "Progress updated", details)
+    payload = {"requestId": request_id, "at": event["timestamp"], "remarks": remarks, "fields": fields or {}, "event": event}
+    if revisions is not None:
+        payload["blobs"] = revisions.to_payload()
+    if get_write_behind().enqueue(PROGRESS, request_id, payload):
+        return True
+    revisions = revisions or BlobRevisions(db)
+    async with revisions:
+        document = await transition(request_id, None, remarks, fields, db=db, event_type=event_type, details=details)
+        if document is None:
+            await revisions.discard()
+    return document is not None
+
+
+async def fail_request(request_id: str, remarks: str, db=None) -> Optional[Dict[str, Any]]:
+    """Best-effort move to FAILED for error paths; never raises over the original error"""
+    try:
+        return await transition(request_id, RequestStatus.FAILED, remarks, db=db)
+    except Exception as e:
+        print(f"Could not mark request {request_id} as failed: {e}")
+        return None
@@ -0,0 +1,335 @@
+"""
+Versioned payer rulesets and code tables stored in MongoDB
+Each worker keeps the compiled rules (services.validator_registry) and code
+tables (services.code_tables) in memory and only goes back to the database
+when a change stream, or the polling fallback, reports that one changed
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from jsonschema.exceptions import SchemaError
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from db.config.connection import MONGO_DB_NAME, MONGO_URI, get_db, get_pool_options
+from db.models.dbmodels.codeTable import CodeTable
+from db.models.dbmodels.validationRules import RuleStatus, ValidationRule
+from services.code_tables import (
+    CODE_TABLE_EXTENSIONS,
+    CODE_TABLES_PATH,
+    CodeTableRegistry,
+    CodeTables,
+    get_code_table_registry,
+    normalize_codes,
+    read_code_table_file
+)
+from services.validator_registry import RULES_PATH, RulesetSnapshot, ValidatorRegistry, get_validator_registry
+
+VALIDATION_RULES_COLLECTION = "validationRules"
+CODE_TABLES_COLLECTION = "codeTables"
+# Seconds between checks when change streams aren't available (standalone mongod)
+RULES_POLL_INTERVAL = float(os.getenv("VALIDATION_RULES_POLL_INTERVAL", "5"))
+
+# Latest active version of every payer's rules
+ACTIVE_RULES_PIPELINE = [
+    {"$match": {"status": RuleStatus.ACTIVE.value}},
+    {"$sort": {"payerId": ASCENDING, "version": DESCENDING}},
+    {"$group": {"_id": "$payerId", "version": {"$first": "$version"}, "rules": {"$first": "$rules"}}}
+]
+
+# Same selection without the schemas, used to detect changes cheaply when polling
+ACTIVE_VERSIONS_PIPELINE = [
+    {"$match": {"status": RuleStatus.ACTIVE.value}},
+    {"$group": {"_id": "$payerId", "version": {"$max": "$version"}}}
+]
+
+# Latest active version of every code table
+ACTIVE_CODE_TABLES_PIPELINE = [
+    {"$match": {"status": RuleStatus.ACTIVE.value}},
+    {"$sort": {"name": ASCENDING, "version": DESCENDING}},
+    {"$group": {"_id": "$name", "version": {"$first": "$version"}, "codes": {"$first": "$codes"}}}
+]
+
+ACTIVE_CODE_TABLE_VERSIONS_PIPELINE = [
+    {"$match": {"status": RuleStatus.ACTIVE.value}},
+    {"$group": {"_id": "$name", "version": {"$max": "$version"}}}
+]
+
+_sync_client: Optional[MongoClient] = None
+
+
+def build_snapshot(docs: List[Dict[str, Any]]) -> Optional[RulesetSnapshot]:
+    """Compile the output of ACTIVE_RULES_PIPELINE; None if there are no rules yet"""
+    if not docs:
+        return None
+    rules = {doc["_id"]: doc["rules"] for doc in docs}
+    versions = {doc["_id"]: f"v{doc['version']}" for doc in docs}
+    return RulesetSnapshot(rules, "mongo", versions=versions)
+
+
+def build_code_tables(docs: List[Dict[str, Any]]) -> Optional[CodeTables]:
+    """Load the output of ACTIVE_CODE_TABLES_PIPELINE into sets; None if there are no tables yet"""
+    if not docs:
+        return None
+    tables = {doc["_id"]: normalize_codes(doc["codes"]) for doc in docs}
+    versions = {doc["_id"]: f"v{doc['version']}" for doc in docs}
+    return CodeTables(tables, "mongo", versions)
+
+
+def get_sync_db():
+    global _sync_client
+    if _sync_client is None:
+        # Only used for the occasional reload in pool workers, so no idle connections
+        _sync_client = MongoClient(MONGO_URI, **dict(get_pool_options(), minPoolSize=0))
+    return _sync_client[MONGO_DB_NAME]
+
+
+def load_snapshot_sync() -> Optional[RulesetSnapshot]:
+    """
+    Blocking load for process-pool workers, which don't run the watcher.
+    Only called when the worker sees a ruleset token it hasn't loaded yet.
+    """
+    collection = get_sync_db()[VALIDATION_RULES_COLLECTION]
+    return build_snapshot(list(collection.aggregate(ACTIVE_RULES_PIPELINE)))
+
+
+def load_code_tables_sync() -> Optional[CodeTables]:
+    """Blocking code table load for process-pool workers, see load_snapshot_sync"""
+    collection = get_sync_db()[CODE_TABLES_COLLECTION]
+    return build_code_tables(list(collection.aggregate(ACTIVE_CODE_TABLES_PIPELINE)))
+
+
+def compile_ruleset(payer_id: str, rules: Dict[str, Any]) -> RulesetSnapshot:
+    """
+    Build everything a watcher will build from these rules (the whole schema,
+    its envelope and item parts, patterns and codegen), so rules that would
+    fail to load are rejected before they are stored
+    """
+    try:
+        return RulesetSnapshot({payer_id: rules}, "mongo", versions={payer_id: "candidate"})
+    except SchemaError:
+        raise
+    except Exception as e:
+        raise SchemaError(f"Rules can't be compiled: {e}") from e
+
+
+async def publish_ruleset(
+    db,
+    payer_id: str,
+    rules: Dict[str, Any],
+    created_by: str,
+    remarks: Optional[str] = None
+) -> ValidationRule:
+    """Store a new version of a payer's rules; watchers pick it up without a restart"""
+    await asyncio.to_thread(compile_ruleset, payer_id, rules)
+    collection = db[VALIDATION_RULES_COLLECTION]
+
+    for _ in range(3):
+        latest = await collection.find_one(
+            {"payerId": payer_id},
+            sort=[("version", DESCENDING)],
+            projection={"version": 1}
+        )
+        rule = ValidationRule(
+            payerId=payer_id,
+            version=(latest["version"] + 1) if latest else 1,
+            rules=rules,
+            status=RuleStatus.ACTIVE,
+            createdBy=created_by,
+            createdAt=datetime.now(),
+            remarks=remarks
+        )
+        try:
+            await collection.insert_one(rule.model_dump())
+            return rule
+        except DuplicateKeyError:
+            # Another writer published the same version first; try the next one
+            continue
+    raise RuntimeError(f"Could not publish rules for payer {payer_id}: too many concurrent updates")
+
+
+async def import_rules_file(db, path: str = RULES_PATH, created_by: str = "system") -> List[str]:
+    """Seed the collection from rulesets/all_rules.json for payers that have no versions yet"""
+    with open(path, 'r') as file:
+        all_rules = json.load(file)
+
+    imported = []
+    for payer_id, rules in all_rules.items():
+        if await db[VALIDATION_RULES_COLLECTION].count_documents({"payerId": payer_id}, limit=1):
+            continue
+        await publish_ruleset(db, payer_id, rules, created_by, remarks=f"Imported from {os.path.basename(path)}")
+        imported.append(payer_id)
+    return imported
+
+
+async def publish_code_table(
+    db,
+    name: str,
+    codes: List[str],
+    created_by: str,
+    remarks: Optional[str] = None
+) -> CodeTable:
+    """Store a new version of a code table; schemas using it are not recompiled"""
+    if not all(isinstance(code, str) for code in codes):
+        raise ValueError("Codes must be strings")
+    collection = db[CODE_TABLES_COLLECTION]
+
+    for _ in range(3):
+        latest = await collection.find_one(
+            {"name": name},
+            sort=[("version", DESCENDING)],
+            projection={"version": 1}
+        )
+        table = CodeTable(
+            name=name,
+            version=(latest["version"] + 1) if latest else 1,
+            codes=sorted(normalize_codes(codes)),
+            status=RuleStatus.ACTIVE,
+            createdBy=created_by,
+            createdAt=datetime.now(),
+            remarks=remarks
+        )
+        try:
+            await collection.insert_one(table.model_dump())
+            return table
+        except DuplicateKeyError:
+            continue
+    raise RuntimeError(f"Could not publish code table {name}: too many concurrent updates")
+
+
+async def import_code_table_files(db, path: str = CODE_TABLES_PATH, created_by: str = "system") -> List[str]:
+    """Seed the collection from rulesets/code_tables for tables that have no versions yet"""
+    if not os.path.isdir(path):
+        return []
+
+    imported = []
+    for filename in sorted(os.listdir(path)):
+        name, extension = os.path.splitext(filename)
+        if extension not in CODE_TABLE_EXTENSIONS:
+            continue
+        if await db[CODE_TABLES_COLLECTION].count_documents({"name": name}, limit=1):
+            continue
+        codes = read_code_table_file(os.path.join(path, filename))
+        await publish_code_table(db, name, list(codes), created_by, remarks=f"Imported from {filename}")
+        imported.append(name)
+    return imported
+
+
+class RulesetWatcher:
+    """
+    Keeps the in-memory registries in sync with the validationRules and
+    codeTables collections; a change to one never reloads the other.
+    Uses a change stream when the server supports it (replica set) and falls
+    back to polling the active versions otherwise.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[ValidatorRegistry] = None,
+        code_tables: Optional[CodeTableRegistry] = None,
+        poll_interval: float = RULES_POLL_INTERVAL
+    ):
+        self.registry = registry or get_validator_registry()
+        self.code_tables = code_tables or get_code_table_registry()
+        self.poll_interval = poll_interval
+        self.mode: Optional[str] = None
+        self._versions: Optional[Dict[str, int]] = None
+        self._table_versions: Optional[Dict[str, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def reload(self):
+        """
+        Load and install the active rules. Only MongoDB errors propagate; rules
+        that fail to build are logged and the previous snapshot keeps serving.
+        """
+        db = get_db()
+        docs = await db[VALIDATION_RULES_COLLECTION].aggregate(ACTIVE_RULES_PIPELINE).to_list(None)
+        # Recorded even if the build fails, so polling retries on the next publish, not every interval
+        self._versions = {doc["_id"]: doc["version"] for doc in docs}
+        try:
+            snapshot = await asyncio.to_thread(build_snapshot, docs)
+        except Exception as e:
+            print(f"Failed to build validation rules {self._versions}, keeping previous version: {e}")
+            return
+        if snapshot is not None:
+            self.registry.install(snapshot)
+            print(f"Validation rules loaded from MongoDB: {snapshot.versions}")
+
+    async def reload_code_tables(self):
+        db = get_db()
+        docs = await db[CODE_TABLES_COLLECTION].aggregate(ACTIVE_CODE_TABLES_PIPELINE).to_list(None)
+        self._table_versions = {doc["_id"]: doc["version"] for doc in docs}
+        try:
+            tables = await asyncio.to_thread(build_code_tables, docs)
+        except Exception as e:
+            print(f"Failed to load code tables {self._table_versions}, keeping previous version: {e}")
+            return
+        if tables is not None:
+            self.code_tables.install(tables)
+            print(f"Code tables loaded from MongoDB: {tables.versions}")
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": [VALIDATION_RULES_COLLECTION, CODE_TABLES_COLLECTION]}}}]
+        async with get_db().watch(pipeline) as stream:
+            self.mode = "change_stream"
+            async for change in stream:
+                if change["ns"]["coll"] == CODE_TABLES_COLLECTION:
+                    await self.reload_code_tables()
+                else:
+                    await self.reload()
+
+    async def _poll(self):
+        self.mode = "polling"
+        db = get_db()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                docs = await db[VALIDATION_RULES_COLLECTION].aggregate(ACTIVE_VERSIONS_PIPELINE).to_list(None)
+                versions = {doc["_id"]: doc["version"] for doc in docs}
+                if versions != self._versions:
+                    await self.reload()
+                docs = await db[CODE_TABLES_COLLECTION].aggregate(ACTIVE_CODE_TABLE_VERSIONS_PIPELINE).to_list(None)
+                versions = {doc["_id"]: doc["version"] for doc in docs}
+                if versions != self._table_versions:
+                    await self.reload_code_tables()
+            except Exception as e:
+                # Keep polling whatever went wrong; the current snapshot stays in place
+                print(f"Validation rules poll failed: {e!r}")
+
+    async def _run(self):
+        try:
+            await self.reload()
+            await self.reload_code_tables()
+        except Exception as e:
+            print(f"Initial validation rules load failed, serving file rules: {e!r}")
+        try:
+            await self._watch()
+        except PyMongoError as e:
+            print(f"Change streams unavailable ({e}), polling validation rules every {self.poll_interval}s")
+        except Exception as e:
+            print(f"Validation rules change stream failed ({e!r}), polling every {self.poll_interval}s")
+        await self._poll()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ruleset_watcher = RulesetWatcher()
+
+
+def get_ruleset_watcher() -> RulesetWatcher:
+    return ruleset_watcher
@@ -0,0 +1,246 @@
+"""
+Code-generated validators for payer schemas
+Compiles the simple keyword set our payer rules use into a plain Python
+function; anything it doesn't understand falls back to jsonschema
+"""
+
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from services.code_tables import get_code_table_registry
+
+# Keywords that don't affect validation and can be ignored by the compiler
+ANNOTATION_KEYWORDS = {"$schema", "$id", "$comment", "title", "description", "default", "examples"}
+
+SUPPORTED_KEYWORDS = {
+    "type", "const", "enum", "minLength", "maxLength", "pattern",
+    "required", "properties", "additionalProperties", "items", "minItems", "maxItems",
+    "codeTable"
+} | ANNOTATION_KEYWORDS
+
+# Type checks with jsonschema's semantics (bools are not numbers, 1.0 is an integer)
+TYPE_CHECKS = {
+    "string": "isinstance({x}, str)",
+    "object": "isinstance({x}, dict)",
+    "array": "isinstance({x}, list)",
+    "boolean": "isinstance({x}, bool)",
+    "null": "{x} is None",
+    "number": "(isinstance({x}, (int, float)) and not isinstance({x}, bool))",
+    "integer": "((isinstance({x}, int) and not isinstance({x}, bool)) or (isinstance({x}, float) and {x}.is_integer()))"
+}
+
+
+# Types whose guard can be dropped or skipped once `type` fixes a single one of them
+GUARD_TYPES = {"string", "object", "array", "boolean", "null"}
+
+# Drafts whose semantics TYPE_CHECKS matches (draft 4 and earlier treat 1.0 differently)
+SUPPORTED_DRAFTS = (
+    "https://json-schema.org/draft/2020-12/schema",
+    "https://json-schema.org/draft/2019-09/schema",
+    "http://json-schema.org/draft-07/schema",
+    "http://json-schema.org/draft-06/schema",
+)
+
+
+class UnsupportedSchema(Exception):
+    """The schema uses something the code generator can't reproduce exactly"""
+
+
+def is_count(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+class SchemaCodeGenerator:
+    """Turns one schema into Python source for a `check(instance) -> bool` function"""
+
+    def __init__(self, patterns: Dict[str, "re.Pattern"]):
+        self.patterns = patterns
+        self.constants: Dict[str, Any] = {}
+        self.functions: List[str] = []
+
+    def constant(self, value: Any) -> str:
+        name = f"_c{len(self.constants)}"
+        self.constants[name] = value
+        return name
+
+    def compile(self, schema: Any) -> str:
+        """Emit a function for `schema` and return its name"""
+        name = f"_v{len(self.functions)}"
+        self.functions.append("")
+        self.functions[int(name[2:])] = self.function_source(name, schema)
+        return name
+
+    def function_source(self, name: str, schema: Any) -> str:
+        if schema is True or schema == {}:
+            return f"def {name}(x):\n    return True\n"
+        if schema is False:
+            return f"def {name}(x):\n    return False\n"
+        if not isinstance(schema, dict):
+            raise UnsupportedSchema(f"schema must be an object or boolean, got {type(schema).__name__}")
+
+        unsupported = set(schema) - SUPPORTED_KEYWORDS
+        if unsupported:
+            raise UnsupportedSchema(f"unsupported keywords: {sorted(unsupported)}")
+
+        lines = [f"def {name}(x):"]
+        known_type = None
+
+        if "type" in schema:
+            types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+            if not types or any(t not in TYPE_CHECKS for t in types):
+                raise UnsupportedSchema(f"unsupported type: {schema['type']}")
+            condition = " or ".join(TYPE_CHECKS[t].format(x="x") for t in types)
+            lines.append(f"    if not ({condition}):\n        return False")
+            if len(types) == 1:
+                known_type = types[0]
+
+        def guard(json_type: str, check: str) -> Optional[str]:
+            """Prefix a keyword check with its type guard, dropping it when `type` already decided"""
+            if known_type == json_type:
+                return f"    if {check}:\n        return False"
+            if known_type in GUARD_TYPES:
+                return None
+            return f"    if {TYPE_CHECKS[json_type].format(x='x')} and {check}:\n        return False"
+
+        def add(line: Optional[str]):
+            if line is not None:
+                lines.append(line)
+
+        if "const" in schema:
+            value = schema["const"]
+            if isinstance(value, str):
+                lines.append(f"    if not (isinstance(x, str) and x == {self.constant(value)}):\n        return False")
+            elif value is None:
+                lines.append("    if x is not None:\n        return False")
+            else:
+                raise UnsupportedSchema("only string and null const values are compiled")
+
+        if "enum" in schema:
+            values = schema["enum"]
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise UnsupportedSchema("only string enums are compiled")
+            lines.append(f"    if not (isinstance(x, str) and x in {self.constant(frozenset(values))}):\n        return False")
+
+        for keyword, op in (("minLength", "<"), ("maxLength", ">")):
+            if keyword in schema:
+                if not is_count(schema[keyword]):
+                    raise UnsupportedSchema(f"invalid {keyword}")
+                add(guard("string", f"len(x) {op} {schema[keyword]}"))
+
+        if "pattern" in schema:
+            pattern = schema["pattern"]
+            if not isinstance(pattern, str):
+                raise UnsupportedSchema("pattern must be a string")
+            regex = self.patterns.get(pattern)
+            if regex is None:
+                regex = self.patterns.setdefault(pattern, re.compile(pattern))
+            add(guard("string", f"{self.constant(regex)}.search(x) is None"))
+
+        if "codeTable" in schema:
+            name = schema["codeTable"]
+            if not isinstance(name, str):
+                raise UnsupportedSchema("codeTable must be a string")
+            # Looked up on every call so reloaded tables apply without recompiling
+            codes = self.constant(get_code_table_registry().codes)
+            add(guard("string", f"x not in {codes}({self.constant(name)})"))
+
+        if "required" in schema:
+            required = schema["required"]
+            if not isinstance(required, list) or not all(isinstance(k, str) for k in required):
+                raise UnsupportedSchema("required must be a list of strings")
+            if required:
+                condition = " and ".join(f"{self.constant(k)} in x" for k in required)
+                add(guard("object", f"not ({condition})"))
+
+        properties = schema.get("properties")
+        if properties is not None:
+            if not isinstance(properties, dict):
+                raise UnsupportedSchema("properties must be an object")
+            checks = []
+            for key, subschema in properties.items():
+                if subschema is True or subschema == {}:
+                    continue
+                function = self.compile(subschema)
+                key_name = self.constant(key)
+                checks.append(
+                    f"        if {key_name} in x and not {function}(x[{key_name}]):\n            return False"
+                )
+            if checks and known_type == "object":
+                lines.extend(check.replace("\n    ", "\n")[4:] for check in checks)
+            elif checks and known_type not in GUARD_TYPES:
+                lines.append("    if isinstance(x, dict):")
+                lines.extend(checks)
+
+        if "additionalProperties" in schema:
+            additional = schema["additionalProperties"]
+            if additional is False:
+                allowed = self.constant(frozenset(properties or {}))
+                add(guard("object", f"not {allowed}.issuperset(x)"))
+            elif additional is not True and additional != {}:
+                raise UnsupportedSchema("only boolean additionalProperties is compiled")
+
+        if "items" in schema:
+            items = schema["items"]
+            if isinstance(items, list):
+                raise UnsupportedSchema("tuple-style items are not compiled")
+            if items is not True and items != {}:
+                function = self.compile(items)
+                loop = f"for v in x:\n        if not {function}(v):\n            return False"
+                if known_type == "array":
+                    lines.append(f"    {loop}")
+                elif known_type not in GUARD_TYPES:
+                    lines.append(f"    if isinstance(x, list):\n        {loop.replace(chr(10), chr(10) + '    ')}")
+
+        for keyword, op in (("minItems", "<"), ("maxItems", ">")):
+            if keyword in schema:
+                if not is_count(schema[keyword]):
+                    raise UnsupportedSchema(f"invalid {keyword}")
+                add(guard("array", f"len(x) {op} {schema[keyword]}"))
+
+        lines.append("    return True")
+        return "\n".join(lines) + "\n"
+
+    def build(self, schema: Any) -> Callable[[Any], bool]:
+        if isinstance(schema, dict) and "$schema" in schema:
+            if str(schema["$schema"]).rstrip("#") not in SUPPORTED_DRAFTS:
+                raise UnsupportedSchema(f"unsupported draft: {schema['$schema']}")
+        entry = self.compile(schema)
+        source = "\n".join(self.functions)
+        namespace: Dict[str, Any] = dict(self.constants)
+        exec(compile(source, "<payer-schema>", "exec"), namespace)
+        check = namespace[entry]
+        check.source = source
+        return check
+
+
+def compile_check(schema: Any, patterns: Optional[Dict[str, "re.Pattern"]] = None) -> Optional[Callable[[Any], bool]]:
+    """Compile a schema to a `check(instance) -> bool` function, or None if it isn't supported"""
+    try:
+        return SchemaCodeGenerator(patterns if patterns is not None else {}).build(schema)
+    except UnsupportedSchema:
+        return None
+
+
+class CompiledValidator:
+    """
+    Drop-in for a jsonschema validator.
+    Valid instances are decided by the generated function alone; invalid ones
+    are re-run through jsonschema so error messages and paths stay identical.
+    """
+
+    def __init__(self, check: Callable[[Any], bool], fallback):
+        self.check = check
+        self.fallback = fallback
+        self.schema = fallback.schema
+
+    def is_valid(self, instance: Any) -> bool:
+        return self.check(instance)
+
+    def iter_errors(self, instance: Any):
+        if self.check(instance):
+            return iter(())
+        return self.fallback.iter_errors(instance)
+
+    def validate(self, instance: Any):
+        if not self.check(instance):
+            self.fallback.validate(instance)
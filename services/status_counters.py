@@ -0,0 +1,172 @@
+"""
+Incrementally maintained request status counters (statusCounters)
+One small document per scope: "global", "payer:<payerId>" and
+"user:<userId>", each holding the number of requests currently in every
+status. Every status transition $inc's the old status down and the new one up
+in the scopes the request belongs to (services/request_state.py), so the
+dashboard reads current totals with one indexed lookup instead of scanning
+requestProgress. Archived requests keep counting; archiving doesn't change a
+request's status.
+
+The counter update is a second write after the transition, sent together
+with the rollup increments (services/request_state.record_step), and is best
+effort, so counters can drift (a crash in between, a failed write).
+StatusCounterReconciler periodically recomputes them from requestProgress and
+requestProgressArchive and replaces whatever differs.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+
+from pymongo import DeleteOne, ReplaceOne
+
+from db.config.connection import get_db
+from services.job_lease import acquire_lease
+
+STATUS_COUNTERS_RECONCILE_ENABLED = os.getenv("STATUS_COUNTERS_RECONCILE_ENABLED", "true").lower() == "true"
+# Seconds between reconciliation passes
+STATUS_COUNTERS_RECONCILE_INTERVAL = float(os.getenv("STATUS_COUNTERS_RECONCILE_INTERVAL", "900"))
+
+GLOBAL_SCOPE = "global"
+
+
+def scope_ids(progress: Optional[Dict[str, Any]]) -> List[str]:
+    """Counter documents a requestProgress document counts towards"""
+    if not progress:
+        return []
+    scopes = [GLOBAL_SCOPE]
+    if progress.get("payerId"):
+        scopes.append(f"payer:{progress['payerId']}")
+    if progress.get("userId"):
+        scopes.append(f"user:{progress['userId']}")
+    return scopes
+
+
+def _status(progress: Dict[str, Any]) -> str:
+    status = progress.get("status")
+    return getattr(status, "value", status)
+
+
+def counter_deltas(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """Per scope, the status count changes that turn `before` into `after` (either may be None)"""
+    deltas: Dict[str, Dict[str, int]] = {}
+    for progress, step in ((before, -1), (after, 1)):
+        for scope in scope_ids(progress):
+            key = f"statuses.{_status(progress)}"
+            deltas.setdefault(scope, {})
+            deltas[scope][key] = deltas[scope].get(key, 0) + step
+    # Drop the no-ops (same status, same scope)
+    deltas = {scope: {key: n for key, n in inc.items() if n} for scope, inc in deltas.items()}
+    return {scope: inc for scope, inc in deltas.items() if inc}
+
+
+def counter_increments(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]], at: datetime) -> List[Dict[str, Any]]:
+    """The counter changes of one transition as increments (see services/write_behind.apply_increments)"""
+    return [
+        {
+            "collection": "statusCounters",
+            "_id": scope,
+            "$inc": inc,
+            "$set": {"updatedAt": at},
+            "$setOnInsert": {"scope": scope.split(":", 1)[0], "key": scope.split(":", 1)[-1]}
+        }
+        for scope, inc in counter_deltas(before, after).items()
+    ]
+
+
+async def compute_status_counters(db) -> Dict[str, Dict[str, Any]]:
+    """Counter documents as they should be, from the hot and archived requestProgress"""
+    pipeline = [
+        {"$project": {"status": 1, "payerId": 1, "userId": 1}},
+        {"$unionWith": {"coll": "requestProgressArchive", "pipeline": [{"$project": {"status": 1, "payerId": 1, "userId": 1}}]}},
+        {"$group": {"_id": {"status": "$status", "payerId": "$payerId", "userId": "$userId"}, "count": {"$sum": 1}}},
+    ]
+    counters: Dict[str, Dict[str, Any]] = {}
+    async for group in db["requestProgress"].aggregate(pipeline):
+        for scope in scope_ids(group["_id"]):
+            counter = counters.setdefault(scope, {
+                "_id": scope,
+                "scope": scope.split(":", 1)[0],
+                "key": scope.split(":", 1)[-1],
+                "statuses": {}
+            })
+            status = _status(group["_id"])
+            counter["statuses"][status] = counter["statuses"].get(status, 0) + group["count"]
+    return counters
+
+
+async def reconcile_status_counters(db) -> Dict[str, int]:
+    """
+    Replace counter documents that drifted and delete ones for scopes with no
+    requests left. Transitions racing with the pass can leave a small error
+    that the next pass corrects.
+    """
+    expected = await compute_status_counters(db)
+    current = {doc["_id"]: doc async for doc in db["statusCounters"].find({})}
+    now = datetime.now()
+    operations = []
+    for scope, counter in expected.items():
+        existing = current.get(scope, {}).get("statuses", {})
+        if {k: v for k, v in existing.items() if v} != counter["statuses"]:
+            operations.append(ReplaceOne({"_id": scope}, {**counter, "updatedAt": now}, upsert=True))
+    stale = [scope for scope in current if scope not in expected]
+    operations.extend(DeleteOne({"_id": scope}) for scope in stale)
+    if operations:
+        await db["statusCounters"].bulk_write(operations, ordered=False)
+    return {"scopes": len(expected), "repaired": len(operations) - len(stale), "removed": len(stale)}
+
+
+async def get_status_counts(db, scope: str = GLOBAL_SCOPE) -> Dict[str, int]:
+    counter = await db["statusCounters"].find_one({"_id": scope}, {"statuses": 1})
+    return {status: count for status, count in (counter or {}).get("statuses", {}).items() if count > 0}
+
+
+class StatusCounterReconciler:
+    """Reconciles statusCounters every interval in the worker holding the lease"""
+
+    def __init__(self, interval: float = STATUS_COUNTERS_RECONCILE_INTERVAL):
+        self.interval = interval
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[str, int]:
+        db = get_db()
+        if not await acquire_lease(db, "statusCounterReconciler", ttl_seconds=self.interval * 2):
+            return {}
+        self.last_result = await reconcile_status_counters(db)
+        self.last_run = datetime.now()
+        if self.last_result.get("repaired") or self.last_result.get("removed"):
+            print(f"Reconciled status counters: {self.last_result}")
+        return self.last_result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                # Keep reconciling on the next interval, whatever went wrong
+                print(f"Status counter reconciliation failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+status_counter_reconciler = StatusCounterReconciler()
+
+
+def get_status_counter_reconciler() -> StatusCounterReconciler:
+    return status_counter_reconciler
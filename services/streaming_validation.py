@@ -0,0 +1,333 @@
+"""
+Streaming validation for very large patient payloads
+The request body is parsed incrementally and every `response` item is
+validated as soon as it is complete, so memory is bounded by item size
+rather than payload size
+"""
+
+import asyncio
+import codecs
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from db.models.responseModels.jsonValidatorResponse import JsonValidatorResponse
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.validation_service import (
+    build_item_mode_response,
+    check_with_validator,
+    internal_error_response,
+    validate_item_chunk
+)
+from services.code_tables import get_code_table_registry
+from services.validation_executor import QueueFullError, queue_full_response
+from services.validator_registry import get_validator_registry
+
+# Largest single top-level value or `response` item accepted in streaming mode
+VALIDATION_STREAM_MAX_ITEM_BYTES = int(os.getenv("VALIDATION_STREAM_MAX_ITEM_BYTES", str(1024 * 1024)))
+
+WHITESPACE = " \t\r\n"
+DECODER = json.JSONDecoder()
+# Characters the incremental scan stops at, inside and outside strings
+STRING_SPECIAL = re.compile(r'["\\]')
+STRUCTURAL = re.compile(r'[\[\]{}"]')
+SCALAR_END = re.compile(r'[\s,\]}]')
+
+
+class StreamingJsonError(ValueError):
+    """Raised for malformed or oversized streamed bodies"""
+
+
+class StreamingPayloadParser:
+    """
+    Incremental parser for `{"response": [item, ...], "other": value, ...}`.
+    Yields ("item", index, item) for every `response` element and
+    ("field", key, value) for every other top-level member.
+    Only the value currently being read is held in memory.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], max_item_bytes: int = VALIDATION_STREAM_MAX_ITEM_BYTES):
+        self._chunks = chunks.__aiter__()
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        # Incremental scan state of the value being read (see _scan)
+        self._scan_pos = 0
+        self._depth = 0
+        self._in_string = False
+        self.max_item_bytes = max_item_bytes
+
+    async def _fill(self) -> bool:
+        if self._eof:
+            return False
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", final=True)
+            return False
+        self._buf += self._decoder.decode(chunk)
+        return True
+
+    def _release(self):
+        """Drop everything already consumed"""
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+
+    async def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            self._release()
+            if not await self._fill():
+                raise StreamingJsonError("Unexpected end of JSON body")
+
+    async def _expect(self, char: str):
+        found = await self._peek()
+        if found != char:
+            raise StreamingJsonError(f"Expected '{char}' but found '{found}'")
+        self._pos += 1
+
+    def _scan(self) -> Optional[int]:
+        """
+        Advance the structural scan of the value at self._pos over the data
+        received so far; returns its end once complete, else None. Only new
+        data is looked at on each call (string and nesting state is kept),
+        so a value arriving in many chunks is scanned once and decoded once.
+        """
+        buf = self._buf
+        if buf[self._pos] not in '{["':
+            # Number or literal: runs until a delimiter, or the end of the body
+            match = SCALAR_END.search(buf, self._scan_pos)
+            if match is not None:
+                return match.start()
+            if self._eof:
+                return len(buf)
+            self._scan_pos = len(buf)
+            return None
+        i = self._scan_pos
+        while True:
+            if self._in_string:
+                match = STRING_SPECIAL.search(buf, i)
+                if match is None:
+                    i = len(buf)
+                    break
+                i = match.start()
+                if buf[i] == "\\":
+                    if i + 1 >= len(buf):
+                        # Resume at the backslash once the escaped character arrives
+                        break
+                    i += 2
+                    continue
+                self._in_string = False
+                i += 1
+                if self._depth == 0:
+                    return i
+            else:
+                match = STRUCTURAL.search(buf, i)
+                if match is None:
+                    i = len(buf)
+                    break
+                i = match.start()
+                char = buf[i]
+                i += 1
+                if char == '"':
+                    self._in_string = True
+                elif char in "[{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return i
+        self._scan_pos = i
+        return None
+
+    async def _read_value(self) -> Any:
+        """
+        Read one complete JSON value starting at the current position.
+        Its extent is found by the incremental scan first, so a value that
+        straddles network chunks isn't re-parsed on every chunk, and a
+        complete value that doesn't decode is malformed right away.
+        """
+        await self._peek()
+        self._scan_pos = self._pos
+        self._depth = 0
+        self._in_string = False
+        while True:
+            end = self._scan()
+            if end is not None:
+                break
+            if len(self._buf) - self._pos > self.max_item_bytes:
+                raise StreamingJsonError(f"A single value exceeds {self.max_item_bytes} bytes")
+            if not await self._fill():
+                raise StreamingJsonError("Unexpected end of JSON body")
+        if end - self._pos > self.max_item_bytes:
+            raise StreamingJsonError(f"A single value exceeds {self.max_item_bytes} bytes")
+        try:
+            value, decoded_end = DECODER.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError as e:
+            raise StreamingJsonError(f"Malformed JSON: {e.msg}")
+        if decoded_end != end:
+            raise StreamingJsonError(f"Malformed JSON: unexpected data at position {decoded_end - self._pos} of a value")
+        self._pos = end
+        self._release()
+        return value
+
+    async def events(self) -> AsyncIterator[Tuple[str, Any, Any]]:
+        await self._expect("{")
+        if await self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = await self._read_value()
+            if not isinstance(key, str):
+                raise StreamingJsonError("Object keys must be strings")
+            await self._expect(":")
+
+            if key == "response" and await self._peek() == "[":
+                self._pos += 1
+                index = 0
+                if await self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield "item", index, await self._read_value()
+                        index += 1
+                        separator = await self._peek()
+                        self._pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise StreamingJsonError(f"Expected ',' or ']' but found '{separator}'")
+                yield "field", key, []
+            else:
+                yield "field", key, await self._read_value()
+
+            separator = await self._peek()
+            self._pos += 1
+            if separator == "}":
+                break
+            if separator != ",":
+                raise StreamingJsonError(f"Expected ',' or '}}' but found '{separator}'")
+
+
+async def validate_stream(executor, chunks: AsyncIterator[bytes], fast_fail: bool = False) -> JsonValidatorResponse:
+    """
+    Validate a streamed patient payload item by item.
+    Full chunks of items are handed to the validation pool while parsing
+    continues; with fast_fail the first failing chunk ends the request.
+    """
+    parser = StreamingPayloadParser(chunks)
+    envelope: Dict[str, Any] = {}
+    pending_items: List[Any] = []
+    pending_start = 0
+    item_errors = []
+    missing_fields: List[str] = []
+    tasks: List[asyncio.Task] = []
+    semaphore = asyncio.Semaphore(executor.workers)
+    rules = None
+    tables_token = None
+    payer_id: Optional[str] = None
+    fallback_items: Optional[List[Any]] = None
+
+    def collect(result) -> Optional[JsonValidatorResponse]:
+        """Record a chunk's errors; a response means the whole request fails with it"""
+        if isinstance(result, JsonValidatorResponse):
+            return result
+        chunk_errors, chunk_missing = result
+        item_errors.extend(chunk_errors)
+        missing_fields.extend(f for f in chunk_missing if f not in missing_fields)
+        return None
+
+    async def run_chunk(start: int, items: List[Any]):
+        try:
+            return await executor.run(validate_item_chunk, payer_id, start, items, fast_fail, rules.token, tables_token)
+        finally:
+            semaphore.release()
+
+    async def flush():
+        nonlocal pending_items, pending_start
+        if not pending_items:
+            return
+        # Backpressure: stop reading the body while every worker is busy
+        await semaphore.acquire()
+        tasks.append(asyncio.ensure_future(run_chunk(pending_start, pending_items)))
+        pending_start += len(pending_items)
+        pending_items = []
+
+    def collect_done() -> Optional[JsonValidatorResponse]:
+        for task in [t for t in tasks if t.done()]:
+            tasks.remove(task)
+            failed = collect(task.result())
+            if failed is not None:
+                return failed
+        return None
+
+    try:
+        rules = get_validator_registry().get_snapshot()
+        tables_token = get_code_table_registry().get_tables().token
+        async for kind, key, value in parser.events():
+            if kind == "field":
+                envelope[key] = value
+                continue
+
+            if key == 0:
+                payer_id = value.get("payerid") if isinstance(value, dict) else None
+                if not payer_id or not rules.has_payer(payer_id):
+                    return check_with_validator({"response": [value]}, payer_id, None)
+                if rules.get_item_validator(payer_id) is None:
+                    # Schema can't be split per item; fall back to buffering the payload
+                    fallback_items = []
+
+            if fallback_items is not None:
+                fallback_items.append(value)
+                continue
+
+            pending_items.append(value)
+            if len(pending_items) >= executor.item_chunk_size:
+                await flush()
+                failed = collect_done()
+                if failed is not None:
+                    return failed
+                if fast_fail and item_errors:
+                    break
+
+        if fallback_items is not None:
+            envelope["response"] = fallback_items
+            return check_with_validator(envelope, payer_id, rules.get_validator(payer_id), rules.get_version(payer_id))
+
+        if not (fast_fail and item_errors):
+            await flush()
+            for task in asyncio.as_completed(tasks):
+                failed = collect(await task)
+                if failed is not None:
+                    return failed
+                if fast_fail and item_errors:
+                    break
+
+    except StreamingJsonError as e:
+        return JsonValidatorResponse(
+            is_valid=False,
+            http_status=HttpResponseEnum.BAD_REQUEST,
+            error_message=f"Invalid JSON body: {str(e)}"
+        )
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return internal_error_response(e)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if payer_id is None:
+        return check_with_validator(envelope, None, None)
+
+    envelope_errors = list(rules.get_envelope_validator(payer_id).iter_errors(envelope))
+    if fast_fail and item_errors:
+        item_errors = [min(item_errors, key=lambda e: e.index)]
+    return build_item_mode_response(envelope_errors, item_errors, missing_fields, rules.get_version(payer_id))
@@ -0,0 +1,136 @@
+"""
+Memoized validation results
+Keyed by a canonical hash of the payload plus the payer's ruleset and code
+table versions, so re-validating the same patient JSON after a retry or resume is a dict lookup
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from db.models.responseModels.jsonValidatorResponse import JsonValidatorResponse
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.code_tables import get_code_table_registry
+from services.validation_service import get_payer_id_from_json
+from services.validator_registry import get_validator_registry
+
+# Maximum cached results (0 disables the cache)
+VALIDATION_CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", "1024"))
+# Seconds a cached result stays valid
+VALIDATION_CACHE_TTL = float(os.getenv("VALIDATION_CACHE_TTL", "600"))
+
+# Results that say nothing about the payload itself and must be recomputed
+UNCACHEABLE_STATUSES = {HttpResponseEnum.INTERNAL_SERVER_ERROR, HttpResponseEnum.SERVICE_UNAVAILABLE}
+
+CacheKey = Tuple[Optional[str], Optional[str], Optional[str], str, str]
+
+
+def content_hash(json_data: Any) -> str:
+    """Hash that is stable across key order and whitespace"""
+    canonical = json.dumps(json_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ValidationCache:
+    """Bounded LRU cache with a TTL, invalidated when a payer's ruleset or the code tables change"""
+
+    def __init__(self, max_size: int = VALIDATION_CACHE_SIZE, ttl: float = VALIDATION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, JsonValidatorResponse]]" = OrderedDict()
+        self._token: Optional[str] = None
+        self._tables_token: Optional[str] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _sync_ruleset(self, snapshot, tables):
+        """Drop entries whose payer rules or code tables changed since they were stored"""
+        if snapshot.token == self._token and tables.token == self._tables_token:
+            return
+        stale = [
+            key for key in self._entries
+            if snapshot.get_version(key[0]) != key[1] or tables.token != key[2]
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+        self._token = snapshot.token
+        self._tables_token = tables.token
+
+    def make_key(self, json_data: Dict[str, Any], mode: str) -> Optional[CacheKey]:
+        if not self.enabled:
+            return None
+        try:
+            snapshot = get_validator_registry().get_snapshot()
+            tables = get_code_table_registry().get_tables()
+            payer_id = get_payer_id_from_json(json_data)
+            with self._lock:
+                self._sync_ruleset(snapshot, tables)
+            return (payer_id, snapshot.get_version(payer_id), tables.token, mode, content_hash(json_data))
+        except Exception:
+            return None
+
+    def get(self, key: Optional[CacheKey]) -> Optional[JsonValidatorResponse]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result.model_copy()
+
+    def put(self, key: Optional[CacheKey], result: JsonValidatorResponse):
+        if key is None or result.http_status in UNCACHEABLE_STATUSES:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+
+validation_cache = ValidationCache()
+
+
+def get_validation_cache() -> ValidationCache:
+    return validation_cache
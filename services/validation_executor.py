@@ -0,0 +1,289 @@
+"""
+Worker pool for CPU-bound schema validation
+Small payloads are validated inline; larger ones run in a thread or process
+pool so they don't stall other requests on the event loop
+"""
+
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from db.models.responseModels.jsonValidatorResponse import JsonValidatorResponse
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.validation_service import (
+    build_item_mode_response,
+    get_payer_id_from_json,
+    internal_error_response,
+    validate_item_chunk,
+    validate_json_data,
+    validate_payer_group
+)
+from services.code_tables import get_code_table_registry
+from services.validator_registry import get_validator_registry
+from services.validation_cache import ValidationCache, get_validation_cache
+
+# "thread" or "process"
+VALIDATION_EXECUTOR = os.getenv("VALIDATION_EXECUTOR", "thread").lower()
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Payloads with at most this many fields are validated on the event loop
+VALIDATION_INLINE_MAX_FIELDS = int(os.getenv("VALIDATION_INLINE_MAX_FIELDS", "200"))
+# Offloaded validations allowed to be running or waiting before new ones are rejected
+VALIDATION_MAX_QUEUED = int(os.getenv("VALIDATION_MAX_QUEUED", "64"))
+# Payloads per work unit when a batch is split across the pool
+VALIDATION_BATCH_CHUNK_SIZE = int(os.getenv("VALIDATION_BATCH_CHUNK_SIZE", "50"))
+# `response` items per work unit in per-item validation mode
+VALIDATION_ITEM_CHUNK_SIZE = int(os.getenv("VALIDATION_ITEM_CHUNK_SIZE", "250"))
+
+
+class QueueFullError(Exception):
+    """Raised by ValidationExecutor.run when max_queued offloaded validations are already pending"""
+
+    def __init__(self):
+        super().__init__("Validation queue is full, please retry")
+
+
+def queue_full_response(error: QueueFullError) -> JsonValidatorResponse:
+    return JsonValidatorResponse(
+        is_valid=False,
+        http_status=HttpResponseEnum.SERVICE_UNAVAILABLE,
+        error_message=str(error)
+    )
+
+
+def current_tokens() -> Tuple[Optional[str], Optional[str]]:
+    """(ruleset token, code tables token) this process is serving, used to pin process-pool workers"""
+    try:
+        return get_validator_registry().get_snapshot().token, get_code_table_registry().get_tables().token
+    except Exception:
+        return None, None
+
+
+def estimate_payload_fields(json_data: Any) -> int:
+    """
+    Cheap size estimate used to pick inline vs. offloaded validation.
+    Assumes `response` items share the shape of the first one.
+    """
+    if not isinstance(json_data, dict):
+        return 0
+    items = json_data.get("response")
+    if not isinstance(items, list) or not items:
+        return len(json_data)
+    first = items[0]
+    per_item = len(first) if isinstance(first, dict) else 1
+    return len(json_data) + len(items) * per_item
+
+
+class ValidationExecutor:
+    """Runs validate_json_data inline or on a bounded worker pool"""
+
+    def __init__(
+        self,
+        mode: str = VALIDATION_EXECUTOR,
+        workers: int = VALIDATION_WORKERS,
+        inline_max_fields: int = VALIDATION_INLINE_MAX_FIELDS,
+        max_queued: int = VALIDATION_MAX_QUEUED,
+        batch_chunk_size: int = VALIDATION_BATCH_CHUNK_SIZE,
+        item_chunk_size: int = VALIDATION_ITEM_CHUNK_SIZE,
+        cache: Optional[ValidationCache] = None
+    ):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.inline_max_fields = inline_max_fields
+        self.max_queued = max_queued
+        self.batch_chunk_size = max(1, batch_chunk_size)
+        self.item_chunk_size = max(1, item_chunk_size)
+        self.cache = cache if cache is not None else get_validation_cache()
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self.inline_count = 0
+        self.offloaded_count = 0
+        self.rejected_count = 0
+
+    def get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="validation")
+        return self._pool
+
+    def should_offload(self, json_data: Any) -> bool:
+        return estimate_payload_fields(json_data) > self.inline_max_fields
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool, refusing work once max_queued is reached
+        (QueueFullError).
+        """
+        if self._pending >= self.max_queued:
+            self.rejected_count += 1
+            raise QueueFullError()
+        self._pending += 1
+        self.offloaded_count += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.get_pool(), fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def validate(self, json_data: Dict[str, Any]) -> JsonValidatorResponse:
+        """Whole-document validation, served from the result cache when possible"""
+        key = self.cache.make_key(json_data, "full")
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = await self._validate(json_data)
+        self.cache.put(key, result)
+        return result
+
+    async def _validate(self, json_data: Dict[str, Any]) -> JsonValidatorResponse:
+        if not self.should_offload(json_data):
+            self.inline_count += 1
+            return validate_json_data(json_data)
+
+        try:
+            return await self.run(validate_json_data, json_data, None, *current_tokens())
+        except QueueFullError as e:
+            return queue_full_response(e)
+
+    async def validate_items(self, json_data: Dict[str, Any], fast_fail: bool = False) -> JsonValidatorResponse:
+        mode = "fast_fail" if fast_fail else "per_item"
+        key = self.cache.make_key(json_data, mode)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = await self._validate_items(json_data, fast_fail)
+        self.cache.put(key, result)
+        return result
+
+    async def _validate_items(self, json_data: Dict[str, Any], fast_fail: bool = False) -> JsonValidatorResponse:
+        """
+        Validate `response` items independently in chunks across the pool and
+        report every failing item. With fast_fail the first failing chunk
+        cancels the chunks that haven't started yet.
+        Falls back to whole-document validation if the payer schema has no item rules.
+        """
+        try:
+            rules = get_validator_registry().get_snapshot()
+            tables_token = get_code_table_registry().get_tables().token
+            payer_id = get_payer_id_from_json(json_data)
+            envelope_validator = rules.get_envelope_validator(payer_id) if payer_id else None
+            if envelope_validator is None:
+                return await self._validate(json_data)
+            envelope_errors = list(envelope_validator.iter_errors(json_data))
+        except Exception as e:
+            return internal_error_response(e)
+
+        items = json_data.get("response")
+        if (fast_fail and envelope_errors) or not isinstance(items, list):
+            return build_item_mode_response(envelope_errors, [], [], rules.get_version(payer_id))
+
+        inline = not self.should_offload(json_data)
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def run_chunk(start):
+            chunk = items[start:start + self.item_chunk_size]
+            if inline:
+                self.inline_count += 1
+                return validate_item_chunk(payer_id, start, chunk, fast_fail, rules.token, tables_token)
+            async with semaphore:
+                return await self.run(validate_item_chunk, payer_id, start, chunk, fast_fail, rules.token, tables_token)
+
+        tasks = [
+            asyncio.ensure_future(run_chunk(start))
+            for start in range(0, len(items), self.item_chunk_size)
+        ]
+        item_errors = []
+        missing_fields = []
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                if isinstance(result, JsonValidatorResponse):
+                    return result
+                chunk_errors, chunk_missing = result
+                item_errors.extend(chunk_errors)
+                missing_fields.extend(f for f in chunk_missing if f not in missing_fields)
+                if fast_fail and chunk_errors:
+                    break
+        except QueueFullError as e:
+            return queue_full_response(e)
+        except Exception as e:
+            return internal_error_response(e)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if fast_fail and item_errors:
+            item_errors = [min(item_errors, key=lambda e: e.index)]
+        return build_item_mode_response(envelope_errors, item_errors, missing_fields, rules.get_version(payer_id))
+
+    async def validate_batch(self, payloads: List[Dict[str, Any]]) -> AsyncIterator[Tuple[int, JsonValidatorResponse]]:
+        """
+        Validate many payloads, yielding (index, result) in input order.
+        Payloads are grouped by payer ID and each group is split into chunks that
+        share one compiled validator; chunks run concurrently on the pool.
+        """
+        groups: Dict[Optional[str], List[int]] = {}
+        for index, payload in enumerate(payloads):
+            groups.setdefault(get_payer_id_from_json(payload), []).append(index)
+
+        chunks = []
+        for payer_id, indices in groups.items():
+            for start in range(0, len(indices), self.batch_chunk_size):
+                chunks.append((payer_id, indices[start:start + self.batch_chunk_size]))
+
+        inline = sum(estimate_payload_fields(p) for p in payloads) <= self.inline_max_fields
+        semaphore = asyncio.Semaphore(self.workers)
+        tokens = current_tokens()
+
+        async def run_chunk(payer_id, indices):
+            items = [payloads[i] for i in indices]
+            if inline:
+                self.inline_count += 1
+                return indices, validate_payer_group(payer_id, items, *tokens)
+            try:
+                async with semaphore:
+                    results = await self.run(validate_payer_group, payer_id, items, *tokens)
+            except QueueFullError as e:
+                results = [queue_full_response(e) for _ in items]
+            return indices, results
+
+        tasks = [asyncio.ensure_future(run_chunk(payer_id, indices)) for payer_id, indices in chunks]
+        finished: Dict[int, JsonValidatorResponse] = {}
+        next_index = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                indices, results = await future
+                finished.update(zip(indices, results))
+                # Emit everything that is now contiguous from the front
+                while next_index in finished:
+                    yield next_index, finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_queued": self.max_queued,
+            "inline": self.inline_count,
+            "offloaded": self.offloaded_count,
+            "rejected": self.rejected_count,
+            "cache": self.cache.stats()
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+validation_executor = ValidationExecutor()
+
+
+def get_validation_executor() -> ValidationExecutor:
+    return validation_executor
@@ -0,0 +1,221 @@
+"""
+Payer JSON validation service
+Shared by the /validate-json route and the validate-json agent tool so the
+tool no longer has to call back into its own server over HTTP
+"""
+
+from typing import Any, Dict, List, Optional
+
+from jsonschema.exceptions import best_match
+
+from db.models.responseModels.jsonValidatorResponse import ItemValidationError, JsonValidatorResponse
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.code_tables import get_code_table_registry
+from services.validator_registry import RulesetSnapshot, get_validator_registry
+
+
+def get_payer_id_from_json(json_data):
+    """Extract payer ID from JSON data"""
+    try:
+        if isinstance(json_data, dict) and 'response' in json_data:
+            if isinstance(json_data['response'], list) and len(json_data['response']) > 0:
+                return json_data['response'][0].get('payerid')
+    except Exception:
+        pass
+    return None
+
+
+def format_validation_error(error) -> str:
+    """Render a ValidationError with its location inside the payload"""
+    path = "/".join(str(part) for part in error.absolute_path)
+    return f"{path}: {error.message}" if path else error.message
+
+
+def get_missing_fields(errors) -> List[str]:
+    """Collect the property names reported by `required` failures"""
+    missing = []
+    for error in errors:
+        if error.validator == "required" and isinstance(error.instance, dict):
+            for field in error.validator_value:
+                if field not in error.instance and field not in missing:
+                    missing.append(field)
+    return missing
+
+
+def unknown_payer_response(payer_id: str) -> JsonValidatorResponse:
+    return JsonValidatorResponse(
+        is_valid=False,
+        http_status=HttpResponseEnum.BAD_REQUEST,
+        error_message=f"No validation rules found for payer ID: {payer_id}"
+    )
+
+
+def check_with_validator(
+    json_data: Dict[str, Any],
+    payer_id: Optional[str],
+    validator,
+    ruleset_version: Optional[str] = None
+) -> JsonValidatorResponse:
+    """Validate one payload with an already resolved payer validator"""
+    if not payer_id:
+        return JsonValidatorResponse(
+            is_valid=False,
+            http_status=HttpResponseEnum.BAD_REQUEST,
+            error_message="Unable to extract payer ID from JSON data"
+        )
+
+    # Check if we have validation rules for this payer
+    if validator is None:
+        return unknown_payer_response(payer_id)
+
+    # Validate the JSON data with the payer's cached validator
+    errors = list(validator.iter_errors(json_data))
+    if not errors:
+        return JsonValidatorResponse(
+            is_valid=True,
+            http_status=HttpResponseEnum.OK,
+            error_message=None,
+            ruleset_version=ruleset_version
+        )
+
+    ve = best_match(errors)
+    return JsonValidatorResponse(
+        is_valid=False,
+        http_status=HttpResponseEnum.BAD_REQUEST,
+        error_message=f"JSON validation failed: {ve.message}",
+        validation_errors=[format_validation_error(e) for e in errors],
+        missing_fields=get_missing_fields(errors),
+        ruleset_version=ruleset_version
+    )
+
+
+def internal_error_response(e: Exception) -> JsonValidatorResponse:
+    return JsonValidatorResponse(
+        is_valid=False,
+        http_status=HttpResponseEnum.INTERNAL_SERVER_ERROR,
+        error_message=f"Internal server error during validation: {str(e)}"
+    )
+
+
+def validate_json_data(
+    json_data: Dict[str, Any],
+    rules: Optional[RulesetSnapshot] = None,
+    ruleset_token: Optional[str] = None,
+    code_tables_token: Optional[str] = None
+) -> JsonValidatorResponse:
+    """
+    Validate a patient JSON payload against the rules of the payer it names.
+    Never raises; failures are reported through the returned response.
+    ruleset_token and code_tables_token pin the versions a process-pool worker must use.
+    """
+    try:
+        # Load compiled validation rules
+        if rules is None:
+            rules = get_validator_registry().get_snapshot(ruleset_token)
+        get_code_table_registry().get_tables(code_tables_token)
+
+        # Extract payer ID from the JSON data
+        payer_id = get_payer_id_from_json(json_data)
+        validator = rules.get_validator(payer_id) if payer_id else None
+        return check_with_validator(json_data, payer_id, validator, rules.get_version(payer_id))
+
+    except Exception as e:
+        # Handle any other exceptions
+        return internal_error_response(e)
+
+
+def validate_payer_group(
+    payer_id: Optional[str],
+    payloads: List[Dict[str, Any]],
+    ruleset_token: Optional[str] = None,
+    code_tables_token: Optional[str] = None
+) -> List[JsonValidatorResponse]:
+    """
+    Validate payloads that all belong to one payer with a single shared validator.
+    Module-level so it can be shipped to a process pool.
+    """
+    try:
+        rules = get_validator_registry().get_snapshot(ruleset_token)
+        get_code_table_registry().get_tables(code_tables_token)
+        validator = rules.get_validator(payer_id) if payer_id else None
+        version = rules.get_version(payer_id)
+    except Exception as e:
+        return [internal_error_response(e) for _ in payloads]
+
+    results = []
+    for json_data in payloads:
+        try:
+            results.append(check_with_validator(json_data, payer_id, validator, version))
+        except Exception as e:
+            results.append(internal_error_response(e))
+    return results
+
+
+def validate_item_chunk(
+    payer_id: str,
+    start: int,
+    items: List[Any],
+    fast_fail: bool = False,
+    ruleset_token: Optional[str] = None,
+    code_tables_token: Optional[str] = None
+):
+    """
+    Validate a slice of the `response` array item by item.
+    Returns (item errors, missing fields); with fast_fail it stops at the first error.
+    If the pinned ruleset has no item rules for the payer, returns the unknown
+    payer response instead.
+    Module-level so it can be shipped to a process pool.
+    """
+    validator = get_validator_registry().get_snapshot(ruleset_token).get_item_validator(payer_id)
+    if validator is None:
+        return unknown_payer_response(payer_id)
+    get_code_table_registry().get_tables(code_tables_token)
+    item_errors = []
+    missing_fields = []
+    for offset, item in enumerate(items):
+        index = start + offset
+        for error in validator.iter_errors(item):
+            path = "/".join(["response", str(index)] + [str(part) for part in error.absolute_path])
+            item_errors.append(ItemValidationError(
+                index=index,
+                path=path,
+                message=error.message,
+                keyword=str(error.validator)
+            ))
+            for field in get_missing_fields([error]):
+                if field not in missing_fields:
+                    missing_fields.append(field)
+            if fast_fail:
+                return item_errors, missing_fields
+    return item_errors, missing_fields
+
+
+def build_item_mode_response(
+    envelope_errors,
+    item_errors: List[ItemValidationError],
+    missing_fields: List[str],
+    ruleset_version: Optional[str] = None
+) -> JsonValidatorResponse:
+    """Combine envelope and per-item errors into one response"""
+    if not envelope_errors and not item_errors:
+        return JsonValidatorResponse(
+            is_valid=True,
+            http_status=HttpResponseEnum.OK,
+            error_message=None,
+            ruleset_version=ruleset_version
+        )
+
+    item_errors = sorted(item_errors, key=lambda e: e.index)
+    for field in get_missing_fields(envelope_errors):
+        if field not in missing_fields:
+            missing_fields.append(field)
+    first_message = best_match(envelope_errors).message if envelope_errors else item_errors[0].message
+    return JsonValidatorResponse(
+        is_valid=False,
+        http_status=HttpResponseEnum.BAD_REQUEST,
+        error_message=f"JSON validation failed: {first_message}",
+        validation_errors=[format_validation_error(e) for e in envelope_errors] + [f"{e.path}: {e.message}" for e in item_errors],
+        missing_fields=missing_fields,
+        item_errors=item_errors,
+        ruleset_version=ruleset_version
+    )
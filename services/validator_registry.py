@@ -0,0 +1,238 @@
+"""
+Compiled payer validator registry
+Loads the ruleset once, keeps one compiled validator per payer ID and
+swaps in a rebuilt registry when the rules change (file mtime, or a
+MongoDB update pushed in by services.ruleset_store)
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from jsonschema import ValidationError
+from jsonschema.validators import extend, validator_for
+
+from services.code_tables import get_code_table_registry
+from services.schema_compiler import CompiledValidator, compile_check
+
+RULES_PATH = os.getenv(
+    "VALIDATION_RULES_PATH",
+    os.path.join(os.path.dirname(__file__), '..', 'rulesets', 'all_rules.json')
+)
+# Seconds between mtime checks of the rules file (0 = check on every request)
+RULES_RELOAD_INTERVAL = float(os.getenv("VALIDATION_RULES_RELOAD_INTERVAL", "1.0"))
+# "file" (rulesets/all_rules.json) or "mongo" (versioned validationRules collection)
+RULES_SOURCE = os.getenv("VALIDATION_RULES_SOURCE", "file").lower()
+# "jsonschema" (generic interpreter) or "codegen" (services.schema_compiler, falls back per schema)
+VALIDATION_ENGINE = os.getenv("VALIDATION_ENGINE", "jsonschema").lower()
+
+
+def collect_patterns(schema: Any, patterns: Dict[str, "re.Pattern"]) -> Dict[str, "re.Pattern"]:
+    """Walk a schema and precompile every `pattern` regex it contains"""
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key == "pattern" and isinstance(value, str):
+                if value not in patterns:
+                    patterns[value] = re.compile(value)
+            else:
+                collect_patterns(value, patterns)
+    elif isinstance(schema, list):
+        for value in schema:
+            collect_patterns(value, patterns)
+    return patterns
+
+
+def build_validator(schema: Dict[str, Any], patterns: Dict[str, "re.Pattern"], engine: str = VALIDATION_ENGINE):
+    """
+    Check a payer schema once and build a reusable validator for it.
+    The `pattern` keyword is swapped for one that uses the precompiled regexes,
+    and `codeTable` checks membership in a named code table.
+    With the codegen engine the schema is also compiled to a Python function
+    when it only uses supported keywords.
+    """
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+
+    def pattern(validator, patrn, instance, schema):
+        if not validator.is_type(instance, "string"):
+            return
+        regex = patterns.get(patrn)
+        if regex is None:
+            regex = patterns.setdefault(patrn, re.compile(patrn))
+        if not regex.search(instance):
+            yield ValidationError(f"{instance!r} does not match {patrn!r}")
+
+    def code_table(validator, name, instance, schema):
+        if not validator.is_type(instance, "string"):
+            return
+        codes = get_code_table_registry().lookup(name)
+        if codes is None:
+            yield ValidationError(f"Unknown code table {name!r}")
+        elif instance not in codes:
+            yield ValidationError(f"{instance!r} is not a valid code in {name!r}")
+
+    compiled_cls = extend(cls, {"pattern": pattern, "codeTable": code_table})
+    validator = compiled_cls(schema)
+
+    if engine == "codegen":
+        check = compile_check(schema, patterns)
+        if check is not None:
+            return CompiledValidator(check, validator)
+    return validator
+
+
+def split_item_schema(schema: Dict[str, Any]):
+    """
+    Split a payer schema into (envelope schema, `response` item schema) so items
+    can be validated independently. Returns None if the schema has no item rules.
+    """
+    try:
+        item_schema = schema["properties"]["response"]["items"]
+    except (KeyError, TypeError):
+        return None
+    if not isinstance(item_schema, dict):
+        return None
+    envelope = copy.deepcopy(schema)
+    del envelope["properties"]["response"]["items"]
+    return envelope, item_schema
+
+
+class RulesetSnapshot:
+    """Immutable view of one loaded ruleset and its compiled validators"""
+
+    def __init__(
+        self,
+        rules: Dict[str, Any],
+        source: str,
+        versions: Optional[Dict[str, str]] = None,
+        mtime_ns: Optional[int] = None
+    ):
+        self.rules = rules
+        self.source = source
+        self.mtime_ns = mtime_ns
+        self.loaded_at = time.time()
+        if versions is None:
+            versions = {payer_id: f"file-{mtime_ns}" for payer_id in rules}
+        self.versions = versions
+        # Identifies this exact set of payer versions across processes
+        fingerprint = json.dumps(sorted(versions.items())).encode()
+        self.token = hashlib.sha1(fingerprint).hexdigest()[:16]
+        self.patterns = {}
+        self.validators = {}
+        self.envelope_validators = {}
+        self.item_validators = {}
+        for payer_id, schema in rules.items():
+            collect_patterns(schema, self.patterns)
+            self.validators[payer_id] = build_validator(schema, self.patterns)
+            parts = split_item_schema(schema)
+            if parts is not None:
+                self.envelope_validators[payer_id] = build_validator(parts[0], self.patterns)
+                self.item_validators[payer_id] = build_validator(parts[1], self.patterns)
+
+    def get_version(self, payer_id: str) -> Optional[str]:
+        """Version of the rules used for this payer"""
+        return self.versions.get(payer_id)
+
+    def get_validator(self, payer_id: str):
+        return self.validators.get(payer_id)
+
+    def get_item_validator(self, payer_id: str):
+        """Validator for a single `response` item, or None if the schema can't be split"""
+        return self.item_validators.get(payer_id)
+
+    def get_envelope_validator(self, payer_id: str):
+        """Validator for everything except the `response` items"""
+        return self.envelope_validators.get(payer_id)
+
+    def has_payer(self, payer_id: str) -> bool:
+        return payer_id in self.validators
+
+
+class ValidatorRegistry:
+    """
+    Process-wide holder of the current RulesetSnapshot.
+    Readers always get a fully built snapshot; a rebuild happens off to the side
+    and is swapped in with a single reference assignment.
+    """
+
+    def __init__(
+        self,
+        rules_path: str = RULES_PATH,
+        reload_interval: float = RULES_RELOAD_INTERVAL,
+        source: str = RULES_SOURCE
+    ):
+        self.rules_path = rules_path
+        self.reload_interval = reload_interval
+        self.source = source
+        self._snapshot: Optional[RulesetSnapshot] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, mtime_ns: int) -> RulesetSnapshot:
+        with open(self.rules_path, 'r') as file:
+            rules = json.load(file)
+        return RulesetSnapshot(rules, "file", mtime_ns=mtime_ns)
+
+    def install(self, snapshot: RulesetSnapshot):
+        """Swap in a snapshot built elsewhere (e.g. from MongoDB)"""
+        self._snapshot = snapshot
+
+    def get_snapshot(self, token: Optional[str] = None) -> RulesetSnapshot:
+        """
+        Return the current snapshot.
+        File source: rebuild it if the rules file changed.
+        Mongo source: the snapshot is pushed in by the ruleset watcher; a worker
+        process that sees a token it doesn't have yet pulls the rules itself.
+        Until the first Mongo load the rules file is used as a bootstrap.
+        """
+        snapshot = self._snapshot
+        if self.source == "mongo":
+            if token is not None and (snapshot is None or snapshot.token != token):
+                from services.ruleset_store import load_snapshot_sync
+                with self._lock:
+                    if self._snapshot is None or self._snapshot.token != token:
+                        loaded = load_snapshot_sync()
+                        if loaded is not None:
+                            self._snapshot = loaded
+                snapshot = self._snapshot
+            if snapshot is not None and snapshot.source == "mongo":
+                return snapshot
+
+        now = time.monotonic()
+        if snapshot is not None and now - self._last_check < self.reload_interval:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            self._last_check = now
+            try:
+                mtime_ns = os.stat(self.rules_path).st_mtime_ns
+            except OSError:
+                if snapshot is not None:
+                    return snapshot
+                raise
+
+            if snapshot is not None and snapshot.mtime_ns == mtime_ns:
+                return snapshot
+
+            try:
+                self._snapshot = self._load(mtime_ns)
+            except Exception as e:
+                # Keep serving the previous ruleset if the new file is broken
+                if snapshot is None:
+                    raise
+                print(f"Failed to reload validation rules, keeping previous version: {e}")
+                return snapshot
+            return self._snapshot
+
+
+validator_registry = ValidatorRegistry()
+
+
+def get_validator_registry() -> ValidatorRegistry:
+    return validator_registry
@@ -0,0 +1,479 @@
+"""
+Write-behind queue for non-critical request writes
+With WRITE_BEHIND_ENABLED=true, request history (requestEvents inserts),
+progress-only updates (remarks/fields without a status change, see
+services/request_state.record_progress) and the statusCounters and
+requestRollups increments of every step (services/request_state.record_step)
+are appended to a local SQLite queue and flushed to MongoDB in the
+background, so a slow or briefly unavailable primary doesn't hold up the
+agent tools and n8n callbacks on writes nobody reads synchronously. Status transitions stay synchronous: they are validated
+against the current status and their result is returned to the caller.
+
+Replay is in enqueue order. A progress row is rewritten in place into an
+events row once its update is applied, so a retried batch never applies it
+twice; event inserts are idempotent on the unique (requestId, seq) index.
+Increments are merged per document across the batch and deleted from the
+queue as soon as they are applied; only a bulk write failing part way (or a
+crash right after it) can apply some of them twice, which the status
+counters reconciler repairs.
+Each worker process owns one queue file, locked while it runs; files left by
+a worker that died are adopted and replayed at startup. A row that can never
+be written (it fails with something other than a MongoDB error) is moved to
+the file's quarantine table instead of blocking the rows behind it.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import glob
+import os
+import sqlite3
+import time
+
+import bson
+from bson.errors import InvalidDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from db.config.connection import get_db
+from db.models.dbmodels.requestEvent import RequestEvent
+from services.metadata_store import BlobRevisions
+from services.request_archiver import NOT_ARCHIVING
+
+try:
+    import fcntl
+except ImportError:  # Windows: no orphan adoption, each file is replayed only by its own process
+    fcntl = None
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "./data/write_behind")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+# Seconds between flushes when the queue isn't being filled faster than that
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.2"))
+# Above this many queued writes, new writes go to MongoDB synchronously again
+WRITE_BEHIND_MAX_DEPTH = int(os.getenv("WRITE_BEHIND_MAX_DEPTH", "100000"))
+WRITE_BEHIND_MAX_BACKOFF = 30.0
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BEHIND_SHUTDOWN_TIMEOUT", "5"))
+
+PROGRESS = "progress"
+EVENTS = "events"
+INCREMENTS = "increments"
+
+# Update operators an increment may carry, and how repeated ones for the same document combine
+INCREMENT_OPERATORS = ("$inc", "$set", "$setOnInsert")
+
+
+async def apply_progress(db, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Apply one deferred progress update and return its event document (with
+    the reserved seq). An update older than the request's lastUpdatedAt
+    doesn't overwrite the newer state, but its event is still recorded.
+    GridFS revisions packed into the update are settled here: the ones it
+    replaced are deleted once it is applied, its own uploads if it isn't.
+    """
+    revisions = BlobRevisions.from_payload(payload.get("blobs"), db)
+    at = payload["at"]
+    update = {"lastUpdatedAt": at, **payload["fields"]}
+    if payload.get("remarks") is not None:
+        update["remarks"] = payload["remarks"]
+    projection = {"status": 1, "eventSeq": 1}
+    progress = await db["requestProgress"].find_one_and_update(
+        {"requestId": payload["requestId"], "lastUpdatedAt": {"$lte": at}, **NOT_ARCHIVING},
+        {"$set": update, "$inc": {"eventSeq": 1}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if progress is not None:
+        await revisions.commit()
+    else:
+        await revisions.discard()
+        progress = await db["requestProgress"].find_one_and_update(
+            {"requestId": payload["requestId"], **NOT_ARCHIVING},
+            {"$inc": {"eventSeq": 1}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER
+        )
+    if progress is None:
+        # The request is gone (or never existed); nothing to record
+        return []
+    event = RequestEvent(
+        requestId=payload["requestId"], seq=progress["eventSeq"], status=progress.get("status"), **payload["event"]
+    )
+    return [event.model_dump()]
+
+
+async def insert_events(db, documents: List[Dict[str, Any]]):
+    """Insert event documents, ignoring ones already written by an earlier attempt"""
+    if not documents:
+        return
+    try:
+        await db["requestEvents"].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if errors:
+            raise
+
+
+def merge_increments(increments: List[Dict[str, Any]]) -> Dict[str, Dict[Any, Dict[str, Dict[str, Any]]]]:
+    """
+    Fold increments ({"collection", "_id", "$inc", "$set", "$setOnInsert"})
+    into one update per document: $inc amounts add up, the last $set wins
+    and the first $setOnInsert is kept
+    """
+    merged: Dict[str, Dict[Any, Dict[str, Dict[str, Any]]]] = {}
+    for increment in increments:
+        update = merged.setdefault(increment["collection"], {}).setdefault(
+            increment["_id"], {operator: {} for operator in INCREMENT_OPERATORS}
+        )
+        for path, amount in increment.get("$inc", {}).items():
+            update["$inc"][path] = update["$inc"].get(path, 0) + amount
+        update["$set"].update(increment.get("$set", {}))
+        for field, value in increment.get("$setOnInsert", {}).items():
+            update["$setOnInsert"].setdefault(field, value)
+    return merged
+
+
+async def apply_increments(db, increments: List[Dict[str, Any]]):
+    """Apply increments as upserts, one unordered bulk write per collection, concurrently"""
+    merged = merge_increments(increments)
+    await asyncio.gather(*(
+        db[collection].bulk_write([
+            UpdateOne({"_id": _id}, {operator: fields for operator, fields in update.items() if fields}, upsert=True)
+            for _id, update in updates.items()
+        ], ordered=False)
+        for collection, updates in merged.items()
+    ))
+
+
+class WriteBehindQueue:
+    """
+    One worker's SQLite-backed queue and its flusher. Enqueueing is a local
+    WAL append on the event loop; flushing runs as a background task.
+    """
+
+    def __init__(self, directory: str = WRITE_BEHIND_DIR, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 interval: float = WRITE_BEHIND_FLUSH_INTERVAL, max_depth: int = WRITE_BEHIND_MAX_DEPTH):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_depth = max_depth
+        self.path: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._depth = 0
+        self.stats = {
+            "enqueued": 0,
+            "flushed": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "quarantined": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+            "last_error": None,
+            "last_flush_at": None
+        }
+
+    @property
+    def running(self) -> bool:
+        """Accepting writes: open and with a live flusher (otherwise callers write synchronously)"""
+        return self._conn is not None and self._task is not None and not self._task.done()
+
+    # ------------------------------------------------------------------
+    # Local storage
+    # ------------------------------------------------------------------
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, isolation_level=None)
+        # WAL + NORMAL: an append survives a process crash without an fsync per write
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS writes ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, request_id TEXT, "
+            "payload BLOB NOT NULL, enqueued_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quarantine ("
+            "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, request_id TEXT, payload BLOB NOT NULL, "
+            "enqueued_at REAL NOT NULL, error TEXT, quarantined_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _lock(self, path: str, blocking: bool):
+        """Exclusive lock on `path`.lock, or None if another live process holds it"""
+        lock_file = open(f"{path}.lock", "w")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return lock_file
+        except OSError:
+            lock_file.close()
+            return None
+
+    def _read_batch(self, conn: sqlite3.Connection) -> List[Tuple[int, str, bytes]]:
+        return conn.execute(
+            "SELECT id, kind, payload FROM writes ORDER BY id LIMIT ?", (self.batch_size,)
+        ).fetchall()
+
+    def _quarantine(self, conn: sqlite3.Connection, row_id: int, error: Exception):
+        """Set a write that can't be replayed aside, keeping it for inspection"""
+        conn.execute(
+            "INSERT OR REPLACE INTO quarantine (id, kind, request_id, payload, enqueued_at, error, quarantined_at) "
+            "SELECT id, kind, request_id, payload, enqueued_at, ?, ? FROM writes WHERE id = ?",
+            (repr(error), time.time(), row_id)
+        )
+        conn.execute("DELETE FROM writes WHERE id = ?", (row_id,))
+        self.stats["quarantined"] += 1
+        print(f"Write-behind quarantined write {row_id}: {error!r}")
+
+    def _quarantined(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+
+    def enqueue(self, kind: str, request_id: str, payload: Dict[str, Any]) -> bool:
+        """
+        Queue a write; False when the queue isn't running, is full or the local
+        write fails, in which case the caller writes to MongoDB itself.
+        """
+        if not self.running:
+            return False
+        if self._depth >= self.max_depth:
+            self.stats["rejected"] += 1
+            return False
+        try:
+            self._conn.execute(
+                "INSERT INTO writes (kind, request_id, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+                (kind, request_id, bson.encode(payload), time.time())
+            )
+        except (sqlite3.Error, InvalidDocument) as e:
+            print(f"Write-behind enqueue failed, writing synchronously: {e}")
+            self.stats["rejected"] += 1
+            return False
+        self._depth += 1
+        self.stats["enqueued"] += 1
+        if self._depth >= self.batch_size:
+            self._wake.set()
+        return True
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    async def _flush_batch(self, db, conn: sqlite3.Connection) -> int:
+        """
+        Replay the oldest batch of `conn`; returns the number of writes taken
+        off the queue. MongoDB errors propagate and the batch is retried as
+        is; any other error is specific to a row, which is quarantined.
+        """
+        rows = self._read_batch(conn)
+        if not rows:
+            return 0
+        batches: List[Tuple[int, List[Dict[str, Any]]]] = []
+        increments: List[Tuple[int, List[Dict[str, Any]]]] = []
+        for row_id, kind, encoded in rows:
+            try:
+                payload = bson.decode(encoded)
+                if kind == INCREMENTS:
+                    increments.append((row_id, payload["increments"]))
+                    continue
+                if kind == PROGRESS:
+                    events = await apply_progress(db, payload)
+                    # From here on this row is only its (idempotent) event insert
+                    conn.execute(
+                        "UPDATE writes SET kind = ?, payload = ? WHERE id = ?",
+                        (EVENTS, bson.encode({"documents": events}), row_id)
+                    )
+                else:
+                    events = payload["documents"]
+            except PyMongoError:
+                raise
+            except Exception as e:
+                self._quarantine(conn, row_id, e)
+                continue
+            batches.append((row_id, events))
+        if increments:
+            await self._apply_increments(db, conn, increments)
+        try:
+            await insert_events(db, [document for _, documents in batches for document in documents])
+        except PyMongoError:
+            raise
+        except Exception:
+            # Something in the batch can't be encoded; insert row by row to find it
+            for row_id, documents in batches:
+                try:
+                    await insert_events(db, documents)
+                except PyMongoError:
+                    raise
+                except Exception as e:
+                    self._quarantine(conn, row_id, e)
+        conn.execute("DELETE FROM writes WHERE id <= ?", (rows[-1][0],))
+        return len(rows)
+
+    async def _apply_increments(self, db, conn: sqlite3.Connection, rows: List[Tuple[int, List[Dict[str, Any]]]]):
+        """Apply the batch's increments merged, then drop their rows at once so a retry can't repeat them"""
+        try:
+            await apply_increments(db, [increment for _, increments in rows for increment in increments])
+        except PyMongoError:
+            raise
+        except Exception:
+            for row_id, increments in rows:
+                try:
+                    await apply_increments(db, increments)
+                except PyMongoError:
+                    raise
+                except Exception as e:
+                    self._quarantine(conn, row_id, e)
+        conn.executemany("DELETE FROM writes WHERE id = ?", [(row_id,) for row_id, _ in rows])
+
+    async def flush(self, db=None) -> int:
+        """Flush until the queue is empty; raises on the first MongoDB error"""
+        db = db if db is not None else get_db()
+        total = 0
+        while self._conn is not None:
+            start = time.perf_counter()
+            try:
+                flushed = await self._flush_batch(db, self._conn)
+            finally:
+                # Counted rather than subtracted: a failed batch may still have quarantined
+                # rows or applied its increments
+                self._depth = self._conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+            if not flushed:
+                break
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stats["flushed"] += flushed
+            self.stats["flushes"] += 1
+            self.stats["last_flush_ms"] = round(elapsed, 2)
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], round(elapsed, 2))
+            self.stats["last_flush_at"] = datetime.now()
+            total += flushed
+        return total
+
+    async def _run(self):
+        backoff = self.interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                self.stats["last_error"] = None
+                backoff = self.interval
+            except Exception as e:
+                # MongoDB unavailable, or the local file failing: keep the rows
+                # and retry the same batch later, in order
+                self.stats["failed_flushes"] += 1
+                self.stats["last_error"] = str(e)
+                backoff = min(backoff * 2, WRITE_BEHIND_MAX_BACKOFF)
+                print(f"Write-behind flush failed, retrying in {backoff:.1f}s: {e!r}")
+
+    def _flusher_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            # running is now False, so new writes go to MongoDB synchronously
+            self.stats["last_error"] = str(task.exception())
+            print(f"Write-behind flusher stopped, writing synchronously from now on: {task.exception()!r}")
+
+    async def adopt_orphans(self, db=None) -> int:
+        """Replay and remove queue files left behind by workers that are no longer running"""
+        if fcntl is None:
+            return 0
+        db = db if db is not None else get_db()
+        adopted = 0
+        for path in glob.glob(os.path.join(self.directory, "queue-*.sqlite3")):
+            if path == self.path:
+                continue
+            lock_file = self._lock(path, blocking=False)
+            if lock_file is None:
+                continue
+            try:
+                conn = self._open(path)
+                try:
+                    while True:
+                        flushed = await self._flush_batch(db, conn)
+                        if not flushed:
+                            break
+                        adopted += flushed
+                    quarantined = self._quarantined(conn)
+                finally:
+                    conn.close()
+                # Only an emptied queue is removed (a failed replay is retried on the next
+                # start); one holding quarantined writes is kept for inspection
+                if not quarantined:
+                    for suffix in ("", "-wal", "-shm", ".lock"):
+                        if os.path.exists(path + suffix):
+                            os.remove(path + suffix)
+            finally:
+                lock_file.close()
+        if adopted:
+            print(f"Write-behind replayed {adopted} writes from stopped workers")
+        return adopted
+
+    # ------------------------------------------------------------------
+    # Lifecycle and metrics
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        if self._conn is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"queue-{os.getpid()}.sqlite3")
+        self._lock_file = self._lock(self.path, blocking=True)
+        self._conn = self._open(self.path)
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+        self._wake = asyncio.Event()
+        try:
+            await self.adopt_orphans()
+        except Exception as e:
+            print(f"Write-behind could not replay orphaned queues yet: {e!r}")
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._flusher_done)
+
+    async def stop(self):
+        """Stop the flusher and try one last flush; anything left is replayed on the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is None:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            print(f"Write-behind left {self._depth} writes queued in {self.path}: {e!r}")
+        quarantined = self._quarantined(self._conn)
+        self._conn.close()
+        self._conn = None
+        if self._depth == 0 and not quarantined:
+            for suffix in ("", "-wal", "-shm", ".lock"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        oldest = None
+        if self._conn is not None:
+            row = self._conn.execute("SELECT MIN(enqueued_at) FROM writes").fetchone()
+            if row[0] is not None:
+                oldest = round(time.time() - row[0], 3)
+        return {
+            "enabled": self.running,
+            "path": self.path,
+            "depth": self._depth,
+            "oldest_age_seconds": oldest,
+            **self.stats
+        }
+
+
+write_behind = WriteBehindQueue()
+
+
+def get_write_behind() -> WriteBehindQueue:
+    return write_behind
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Tests for keyset (cursor) pagination (services/pagination.py)
+Pages are walked with an in-memory evaluation of the keyset filter, so ties
+on the sort field are covered without a database; the endpoint checks only
+exercise request validation, which rejects bad input before any query runs.
+Run with pytest, or directly.
+"""
+
+import base64
+from datetime import datetime, timedelta
+
+from bson import json_util
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import db.config.connection as connection
+from api.dashboard_api import router as dashboard_router
+from services.pagination import (
+    MAX_PAGE_SIZE,
+    REQUESTS_SORT,
+    USER_ACTIONS_SORT,
+    InvalidCursorError,
+    after_cursor,
+    decode_cursor,
+    encode_cursor,
+    paginate
+)
+
+BASE = datetime(2026, 5, 1, 12, 0, 0)
+
+
+def matches(document, query):
+    """Evaluate the subset of MongoDB filters keyset_after produces"""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+            continue
+        for operator, value in condition.items():
+            if operator == "$lt" and not document[field] < value:
+                return False
+            if operator == "$lte" and not document[field] <= value:
+                return False
+    return True
+
+
+def walk(documents, sort, limit):
+    """Every page of `documents`, following the cursors like a client would"""
+    ordered = sorted(documents, key=lambda doc: tuple(doc[field] for field, _ in sort), reverse=True)
+    pages, cursor = [], None
+    while True:
+        query = after_cursor(cursor, sort)
+        page, cursor = paginate([doc for doc in ordered if matches(doc, query)][:limit + 1], limit, sort)
+        pages.append(page)
+        if cursor is None:
+            return ordered, pages
+
+
+def test_cursor_round_trip():
+    document = {"lastUpdatedAt": BASE.replace(microsecond=123000), "requestId": "abc-123", "status": "completed"}
+    token = encode_cursor(document, REQUESTS_SORT)
+    assert "=" not in token and "+" not in token and "/" not in token
+    assert decode_cursor(token, REQUESTS_SORT) == [document["lastUpdatedAt"], "abc-123"]
+    assert after_cursor(None, REQUESTS_SORT) == {}
+    assert after_cursor(token, REQUESTS_SORT) == {
+        "lastUpdatedAt": {"$lte": document["lastUpdatedAt"]},
+        "$or": [{"lastUpdatedAt": {"$lt": document["lastUpdatedAt"]}}, {"requestId": {"$lt": "abc-123"}}]
+    }
+
+
+def test_pages_with_ties_on_the_sort_field():
+    # Five timestamps shared by five requests each: every page boundary falls inside a tie
+    documents = [
+        {"lastUpdatedAt": BASE - timedelta(minutes=i // 5), "requestId": f"REQ-{i:03d}"}
+        for i in range(25)
+    ]
+    for limit in (1, 3, 4, 5, 7, 25, 30):
+        ordered, pages = walk(documents, REQUESTS_SORT, limit)
+        assert [doc for page in pages for doc in page] == ordered, f"limit {limit}"
+        assert all(len(page) == limit for page in pages[:-1])
+        assert pages[-1], "an exactly full last page must not hand out a cursor to an empty one"
+
+    actions = [{"requestedAt": BASE, "id": f"ACT-{i}"} for i in range(10)]
+    ordered, pages = walk(actions, USER_ACTIONS_SORT, 3)
+    assert [doc for page in pages for doc in page] == ordered
+
+
+def test_tampered_cursors_are_rejected():
+    valid = encode_cursor({"lastUpdatedAt": BASE, "requestId": "abc"}, REQUESTS_SORT)
+
+    def token(value):
+        return base64.urlsafe_b64encode(json_util.dumps(value).encode()).decode().rstrip("=")
+
+    for bad in [
+        "not a cursor!",
+        valid[:-3],
+        valid + "xyz",
+        token({"lastUpdatedAt": 1}),
+        token([1, 2, 3]),
+        token([{"$gt": ""}, "abc"]),
+        token([BASE, {"$ne": None}]),
+        token([BASE, ["abc"]]),
+        base64.urlsafe_b64encode(b'[{"$date": "yesterday"}, "abc"]').decode(),
+        base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    ]:
+        try:
+            after_cursor(bad, REQUESTS_SORT)
+            assert False, f"{bad!r} should be rejected"
+        except InvalidCursorError:
+            pass
+
+
+def test_endpoints_validate_cursor_and_limit():
+    app = FastAPI()
+    app.include_router(dashboard_router, prefix="/api")
+    previous = connection.db, connection.analytics_db
+    # Never contacted: every request below is rejected before a query is sent
+    client = AsyncIOMotorClient("mongodb://localhost:1", serverSelectionTimeoutMS=100)
+    connection.db = connection.analytics_db = client["pagination_test"]
+    try:
+        with TestClient(app) as http:
+            for path in ("/api/dashboard/requests", "/api/dashboard/user-actions"):
+                response = http.get(path, params={"cursor": "bm90IGEgY3Vyc29y"})
+                assert response.status_code == 400, response.text
+                assert "Invalid cursor" in response.json()["detail"]
+                for limit in (0, -1, MAX_PAGE_SIZE + 1):
+                    assert http.get(path, params={"limit": limit}).status_code == 422
+    finally:
+        connection.db, connection.analytics_db = previous
+        client.close()
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_pages_with_ties_on_the_sort_field()
+    test_tampered_cursors_are_rejected()
+    test_endpoints_validate_cursor_and_limit()
+    print("✅ Pagination tests passed")
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression tests
+Seeds a scratch database on a local MongoDB with realistic volumes, applies
+the declared indexes and explains every shape in db/config/query_shapes.py.
+Fails on collection scans, in-memory sorts and poor keys-examined ratios,
+and on any database call in the API modules that isn't registered as a shape.
+Run with pytest, or directly to also print each plan summary.
+"""
+
+import ast
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from db.config.connection import MONGO_DB_NAME, MONGO_URI
+from db.config.indexes import apply_indexes
+from db.config.query_shapes import QUERY_SHAPES, SCANNED_MODULES, UNCHECKED_OPERATIONS
+from db.models.dbmodels.requestProgress import RequestStatus
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+QUERY_PLAN_MONGO_URI = os.getenv("QUERY_PLAN_MONGO_URI", MONGO_URI)
+QUERY_PLAN_DB_NAME = f"{MONGO_DB_NAME}_query_plans"
+# Requests to seed; each gets 3 user actions, 2 conversation messages and 6 events
+QUERY_PLAN_SEED_REQUESTS = int(os.getenv("QUERY_PLAN_SEED_REQUESTS", "20000"))
+
+# Plan stages that mean an index was used (EXPRESS_* are the MongoDB 8 fast paths)
+INDEX_STAGES = ("IXSCAN", "COUNT_SCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_IDHACK", "EXPRESS_CLUSTERED_IXSCAN")
+
+SAMPLE_PARAMS = {
+    "request_id": "REQ-00000042",
+    "action_id": "ACT-00000042-1",
+    "payer_id": "PAYER-007",
+    "user_id": "user-3",
+    "status": RequestStatus.IN_PROGRESS.value,
+    "start_date": datetime.now() - timedelta(days=7),
+    "end_date": datetime.now(),
+    "limit": 20,
+}
+
+
+# ============================================================================
+# Static check: every query in the API modules is registered
+# ============================================================================
+
+def find_query_call_sites(path):
+    """(function, collection, operation) for every db["coll"].op(...) / db.coll.op(...) call"""
+    with open(os.path.join(ROOT, path), "r") as file:
+        tree = ast.parse(file.read())
+    sites = set()
+    for function in ast.walk(tree):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(function):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+                continue
+            target = node.func.value
+            collection = None
+            if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) and target.value.id == "db":
+                if isinstance(target.slice, ast.Constant):
+                    collection = target.slice.value
+            elif isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name) and target.value.id == "db":
+                collection = target.attr
+            if collection is not None and node.func.attr not in UNCHECKED_OPERATIONS:
+                sites.add((function.name, collection, node.func.attr))
+    return sites
+
+
+def test_every_query_is_registered():
+    registered = {
+        (site, shape.collection, shape.operation)
+        for shape in QUERY_SHAPES
+        for site in shape.used_by
+    }
+    unregistered = []
+    for path in SCANNED_MODULES:
+        for function, collection, operation in sorted(find_query_call_sites(path)):
+            if (f"{path}:{function}", collection, operation) not in registered:
+                unregistered.append(f"{path}:{function} -> {collection}.{operation}")
+    assert not unregistered, "Queries missing from db/config/query_shapes.py:\n" + "\n".join(unregistered)
+
+
+def test_registered_call_sites_exist():
+    existing = {
+        (f"{path}:{function}", collection, operation)
+        for path in SCANNED_MODULES
+        for function, collection, operation in find_query_call_sites(path)
+    }
+    stale = [
+        f"{shape.name}: {site}"
+        for shape in QUERY_SHAPES
+        for site in shape.used_by
+        if (site, shape.collection, shape.operation) not in existing
+    ]
+    names = [shape.name for shape in QUERY_SHAPES]
+    assert len(names) == len(set(names)), "Query shape names must be unique"
+    assert not stale, "Shapes registered for call sites that no longer exist:\n" + "\n".join(stale)
+
+
+# ============================================================================
+# Live check: explain every shape against seeded data
+# ============================================================================
+
+def seed(db, requests: int = QUERY_PLAN_SEED_REQUESTS):
+    rng = random.Random(42)
+    now = datetime.now()
+    statuses = [status.value for status in RequestStatus]
+    progress, prior_auth, actions, conversations, events = [], [], [], [], []
+    for i in range(requests):
+        request_id = f"REQ-{i:08d}"
+        created = now - timedelta(days=rng.uniform(0, 90))
+        updated = created + timedelta(hours=rng.uniform(0, 48))
+        header = {
+            "userId": f"user-{rng.randrange(50)}",
+            "patientId": f"PAT-{i:08d}",
+            "patientName": f"Patient {i}",
+            "payerId": f"PAYER-{rng.randrange(20):03d}",
+            "createdAt": created
+        }
+        progress.append({
+            "requestId": request_id,
+            "status": rng.choice(statuses),
+            "lastUpdatedAt": updated,
+            "remarks": "Seeded for query plan tests",
+            "eventSeq": 6,
+            "pendingActions": 0,
+            **header
+        })
+        prior_auth.append({"requestId": request_id, **header, "lastUpdatedAt": updated})
+        for n in range(3):
+            actions.append({
+                "id": f"ACT-{i:08d}-{n}",
+                "requestId": request_id,
+                "userId": f"user-{rng.randrange(50)}",
+                "actionType": rng.choice(["INFO_REQUIRED", "SCREENSHOT_CAPTURE", "WORKFLOW_COMPLETED"]),
+                "actionStatus": "PENDING" if rng.random() < 0.2 else "COMPLETED",
+                "requestedAt": created + timedelta(minutes=10 * n),
+                "actionedAt": updated,
+                "metadata": ""
+            })
+        for n in range(2):
+            conversations.append({"requestId": request_id, "role": "agent", "message": f"Step {n}", "timestamp": updated})
+        for n in range(6):
+            events.append({
+                "requestId": request_id,
+                "seq": n + 1,
+                "eventType": "STATUS_UPDATE",
+                "timestamp": created + timedelta(minutes=n),
+                "status": rng.choice(statuses),
+                "description": f"Step {n}",
+                "details": {},
+                "truncated": False
+            })
+
+    db.requestProgress.insert_many(progress)
+    db.priorAuthRequest.insert_many(prior_auth)
+    db.priorAuthUserAction.insert_many(actions)
+    db.conversationHistory.insert_many(conversations)
+    db.requestEvents.insert_many(events)
+    db.priorAuthPayers.insert_many([{"id": f"PAYER-{n:03d}", "name": f"Payer {n}"} for n in range(20)])
+
+    # The first 10% of requests also get archived copies
+    archived = requests // 10
+    archived_ids = {f"REQ-{i:08d}" for i in range(archived)}
+    db.requestProgressArchive.insert_many(progress[:archived])
+    db.priorAuthUserActionArchive.insert_many([a for a in actions if a["requestId"] in archived_ids])
+    db.conversationHistoryArchive.insert_many([c for c in conversations if c["requestId"] in archived_ids])
+    db.requestEventsArchive.insert_many([e for e in events if e["requestId"] in archived_ids])
+
+    # Status counters: one per scope, as services/status_counters.py maintains them
+    counters = {}
+    for doc in progress:
+        for scope in ("global", f"payer:{doc['payerId']}", f"user:{doc['userId']}"):
+            counter = counters.setdefault(scope, {"_id": scope, "scope": scope.split(":")[0], "key": scope.split(":")[-1], "statuses": {}})
+            counter["statuses"][doc["status"]] = counter["statuses"].get(doc["status"], 0) + 1
+    db.statusCounters.insert_many(list(counters.values()))
+
+    # Daily rollups for the last year, per payer and for all payers
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    db.requestRollups.insert_many([
+        {"granularity": "day", "bucket": today - timedelta(days=d), "payerId": payer, "created": rng.randrange(50)}
+        for d in range(365)
+        for payer in ["*"] + [f"PAYER-{n:03d}" for n in range(20)]
+    ])
+
+
+def collect(node, key, found=None):
+    """Every value stored under `key` anywhere inside an explain document"""
+    found = [] if found is None else found
+    if isinstance(node, dict):
+        for k, value in node.items():
+            if k == key:
+                found.append(value)
+            collect(value, key, found)
+    elif isinstance(node, list):
+        for value in node:
+            collect(value, key, found)
+    return found
+
+
+def summarize(explain):
+    plans = collect(explain, "winningPlan")
+    stages = [str(stage).upper() for stage in collect(plans, "stage")]
+    keys_examined = sum(collect(explain, "totalKeysExamined"))
+    docs_examined = sum(collect(explain, "totalDocsExamined"))
+    # find returns documents, count counts them, update matches them
+    returned = max([0] + collect(explain, "nReturned") + collect(explain, "nCounted") + collect(explain, "nMatched"))
+    return {"stages": stages, "keys_examined": keys_examined, "docs_examined": docs_examined, "returned": returned}
+
+
+def check_shape(db, shape):
+    explain = db.command("explain", shape.command(SAMPLE_PARAMS), verbosity="executionStats")
+    summary = summarize(explain)
+    problems = []
+    if "COLLSCAN" in summary["stages"]:
+        problems.append("collection scan")
+    if "SORT" in summary["stages"]:
+        problems.append("in-memory sort")
+    if not any(stage in INDEX_STAGES or stage.endswith("IXSCAN") for stage in summary["stages"]):
+        problems.append(f"no index used ({summary['stages']})")
+    ratio = summary["keys_examined"] / max(summary["returned"], 1)
+    if ratio > shape.max_keys_per_doc:
+        problems.append(f"examined {summary['keys_examined']} keys for {summary['returned']} documents")
+    return summary, problems
+
+
+def connect():
+    client = MongoClient(QUERY_PLAN_MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+        return client
+    except PyMongoError:
+        client.close()
+        return None
+
+
+def prepare_database(client):
+    client.drop_database(QUERY_PLAN_DB_NAME)
+    db = client[QUERY_PLAN_DB_NAME]
+    seed(db)
+
+    async def create_indexes():
+        motor_client = AsyncIOMotorClient(QUERY_PLAN_MONGO_URI)
+        try:
+            report = await apply_indexes(motor_client[QUERY_PLAN_DB_NAME], mode="sync")
+            assert not report["errors"], report["errors"]
+        finally:
+            motor_client.close()
+
+    asyncio.run(create_indexes())
+    return db
+
+
+def explain_all_shapes(client):
+    db = prepare_database(client)
+    try:
+        return {shape.name: check_shape(db, shape) for shape in QUERY_SHAPES}
+    finally:
+        client.drop_database(QUERY_PLAN_DB_NAME)
+
+
+def test_query_plans_use_indexes():
+    client = connect()
+    if client is None:
+        import pytest
+        pytest.skip(f"No MongoDB reachable at {QUERY_PLAN_MONGO_URI}")
+    try:
+        results = explain_all_shapes(client)
+    finally:
+        client.close()
+    failures = [f"{name}: {', '.join(problems)}" for name, (_, problems) in results.items() if problems]
+    assert not failures, "Query plan regressions:\n" + "\n".join(failures)
+
+
+def test_duplicates_block_unique_index_with_a_clear_error():
+    client = connect()
+    if client is None:
+        import pytest
+        pytest.skip(f"No MongoDB reachable at {QUERY_PLAN_MONGO_URI}")
+    name = f"{QUERY_PLAN_DB_NAME}_duplicates"
+    client.drop_database(name)
+    client[name].priorAuthRequest.insert_many([{"requestId": "REQ-1"}, {"requestId": "REQ-1"}, {"requestId": "REQ-2"}])
+
+    async def apply():
+        motor_client = AsyncIOMotorClient(QUERY_PLAN_MONGO_URI)
+        try:
+            return await apply_indexes(motor_client[name], mode="apply")
+        finally:
+            motor_client.close()
+
+    try:
+        report = asyncio.run(apply())
+    finally:
+        client.drop_database(name)
+        client.close()
+    errors = [error for error in report["errors"] if error.startswith("priorAuthRequest.requestId_1")]
+    assert len(errors) == 1, report["errors"]
+    assert "already has documents sharing requestId" in errors[0] and "REQ-1" in errors[0]
+    assert report["drift"]["priorAuthRequest"]["missing"] == ["requestId_1"]
+
+
+if __name__ == "__main__":
+    test_every_query_is_registered()
+    test_registered_call_sites_exist()
+    print(f"✅ All queries in {', '.join(SCANNED_MODULES)} are registered")
+
+    client = connect()
+    if client is None:
+        print(f"⚠️  No MongoDB reachable at {QUERY_PLAN_MONGO_URI}, skipping explain checks")
+    else:
+        print(f"🔄 Seeding {QUERY_PLAN_SEED_REQUESTS} requests into {QUERY_PLAN_DB_NAME}...")
+        results = explain_all_shapes(client)
+        client.close()
+        for name, (summary, problems) in results.items():
+            status = "❌" if problems else "✅"
+            print(f"{status} {name}: {' > '.join(summary['stages'])} "
+                  f"(keys {summary['keys_examined']}, docs {summary['docs_examined']}, returned {summary['returned']})"
+                  + (f" - {', '.join(problems)}" if problems else ""))
+        test_duplicates_block_unique_index_with_a_clear_error()
+        print("✅ Duplicate requestIds block the unique index with a clear error")
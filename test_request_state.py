@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Tests for the request state machine (services/request_state.py)
+The transition table and the counter/rollup increments are checked on their
+own; the guarded pipeline update and retried n8n triggers run against a
+scratch database on a local MongoDB and are skipped when none is reachable.
+Run with pytest, or directly.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import db.config.connection as connection
+from api.agent_tools import N8NTriggerRequest, StartRequestTool, start_new_request, trigger_n8n_workflow
+from db.config.connection import MONGO_DB_NAME, MONGO_URI
+from db.models.dbmodels.requestEvent import RequestEventType
+from db.models.dbmodels.requestProgress import RequestStatus
+from services.request_events import build_event, get_timeline
+from services.request_archiver import archive_terminal_requests
+from services.request_state import (
+    InvalidTransitionError,
+    RequestArchivedError,
+    allowed_sources,
+    can_transition,
+    record_progress,
+    transition
+)
+from services.request_rollups import backfill_rollups, rollup_increments
+from services.status_counters import counter_increments, get_status_counts
+from services.write_behind import merge_increments
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI", MONGO_URI)
+TEST_DB_NAME = f"{MONGO_DB_NAME}_request_state"
+
+
+# ============================================================================
+# Transition table
+# ============================================================================
+
+def test_allowed_transitions():
+    assert can_transition(RequestStatus.CREATED, RequestStatus.PROCESSING)
+    assert can_transition(RequestStatus.IN_PROGRESS, RequestStatus.USER_ACTION_REQUIRED)
+    assert can_transition(RequestStatus.USER_ACTION_REQUIRED, RequestStatus.COMPLETED)
+    # A failed request may be retried from the start of the workflow
+    assert can_transition(RequestStatus.FAILED, RequestStatus.IN_PROGRESS)
+    # Staying in the same status is a progress update, always allowed
+    for status in RequestStatus:
+        assert can_transition(status, status)
+
+
+def test_rejected_transitions():
+    assert not can_transition(RequestStatus.CREATED, RequestStatus.COMPLETED)
+    assert not can_transition(RequestStatus.PROCESSING, RequestStatus.SUCCEEDED)
+    assert not can_transition(RequestStatus.FAILED, RequestStatus.COMPLETED)
+    for terminal in (RequestStatus.COMPLETED, RequestStatus.SUCCEEDED):
+        for status in RequestStatus:
+            assert can_transition(terminal, status) == (status == terminal)
+
+
+def test_allowed_sources_match_the_table():
+    for target in RequestStatus:
+        sources = allowed_sources(target)
+        assert target.value in sources
+        assert sources == [status.value for status in RequestStatus if can_transition(status, target)]
+    assert RequestStatus.COMPLETED.value not in allowed_sources(RequestStatus.IN_PROGRESS)
+
+
+def test_step_increments_are_merged_per_document():
+    at = datetime(2026, 3, 1, 10, 30)
+    created = {"requestId": "r", "status": "created", "statusEnteredAt": at - timedelta(minutes=5), "payerId": "P1", "userId": "u"}
+    # The trigger embeds the header: the request is counted as created under its payer
+    in_progress = dict(created, status="in_progress", statusEnteredAt=at, createdAt=at)
+    increments = (
+        counter_increments(None, created, at) + rollup_increments(None, created, at)
+        + counter_increments(created, in_progress, at) + rollup_increments(created, in_progress, at)
+    )
+    merged = merge_increments(increments)
+
+    assert set(merged["statusCounters"]) == {"global", "payer:P1", "user:u"}
+    # created +1 then -1 in the same batch nets out to 0
+    assert merged["statusCounters"]["global"]["$inc"] == {"statuses.created": 0, "statuses.in_progress": 1}
+    assert merged["statusCounters"]["payer:P1"]["$setOnInsert"] == {"scope": "payer", "key": "P1"}
+
+    day = merged["requestRollups"]["day:2026-03-01T00:00:00:P1"]
+    assert day["$inc"] == {
+        "entered.in_progress": 1,
+        "durations.created.count": 1,
+        "durations.created.totalMs": 5 * 60 * 1000,
+        "created": 1
+    }
+    # A retried trigger keeps createdAt and doesn't count the request again
+    retried = dict(in_progress, status="failed")
+    assert all("created" not in increment["$inc"] for increment in rollup_increments(retried, in_progress, at))
+    assert set(merged["requestRollups"]) == {
+        "hour:2026-03-01T10:00:00:P1", "hour:2026-03-01T10:00:00:*",
+        "day:2026-03-01T00:00:00:P1", "day:2026-03-01T00:00:00:*"
+    }
+
+
+# ============================================================================
+# Guarded pipeline update
+# ============================================================================
+
+async def run_state_machine(db):
+    entered = datetime.now() - timedelta(hours=1)
+    await db["requestProgress"].insert_one({
+        "requestId": "R1", "status": RequestStatus.CREATED.value, "lastUpdatedAt": entered,
+        "statusEnteredAt": entered, "eventSeq": 1, "pendingActions": 0, "userId": "u1"
+    })
+
+    # Allowed transition: status and statusEnteredAt move, seqs are reserved in the same update
+    document = await transition("R1", RequestStatus.PROCESSING, "Payer validated", db=db)
+    assert document["status"] == RequestStatus.PROCESSING
+    assert document["statusEnteredAt"] > entered
+    assert document["eventSeq"] == 2
+    stored = await db["requestProgress"].find_one({"requestId": "R1"})
+    assert stored["status"] == RequestStatus.PROCESSING.value
+    processing_since = stored["statusEnteredAt"]
+    assert processing_since > entered
+
+    # Same status, or no status: a progress update, statusEnteredAt stays
+    document = await transition("R1", RequestStatus.PROCESSING, "Still processing", {"workflowStep": "a"}, db=db)
+    assert document["statusEnteredAt"] == processing_since
+    assert await record_progress("R1", "Progress only", {"workflowStep": "b"}, db=db)
+    stored = await db["requestProgress"].find_one({"requestId": "R1"})
+    assert stored["statusEnteredAt"] == processing_since
+    assert stored["workflowStep"] == "b"
+    assert stored["lastUpdatedAt"] > processing_since
+
+    # Counters are $add'ed in the pipeline along with the seqs
+    document = await transition(
+        "R1", RequestStatus.USER_ACTION_REQUIRED, "Waiting", db=db,
+        events=[build_event(RequestEventType.USER_ACTION_REQUESTED, "User action required")],
+        counters={"pendingActions": 1}
+    )
+    assert document["eventSeq"] == 6
+    assert document["pendingActions"] == 1
+    assert document["statusEnteredAt"] > processing_since
+
+    # Rejected transition: nothing is written
+    before = await db["requestProgress"].find_one({"requestId": "R1"})
+    try:
+        await transition("R1", RequestStatus.SUCCEEDED, "Skipping ahead", db=db)
+        assert False, "USER_ACTION_REQUIRED -> SUCCEEDED should be rejected"
+    except InvalidTransitionError as e:
+        assert e.current == RequestStatus.USER_ACTION_REQUIRED.value
+        assert e.target == RequestStatus.SUCCEEDED
+    assert await db["requestProgress"].find_one({"requestId": "R1"}) == before
+
+    # Two writers leaving the same status: exactly one wins
+    results = await asyncio.gather(
+        transition("R1", RequestStatus.COMPLETED, "Done", db=db),
+        transition("R1", RequestStatus.FAILED, "Failed", db=db),
+        return_exceptions=True
+    )
+    assert sorted(type(result).__name__ for result in results) == ["InvalidTransitionError", "dict"]
+    final = await db["requestProgress"].find_one({"requestId": "R1"})
+    assert final["status"] in (RequestStatus.COMPLETED.value, RequestStatus.FAILED.value)
+
+    # A missing request is None, not an invalid transition
+    assert await transition("missing", RequestStatus.PROCESSING, db=db) is None
+
+    # Every reserved seq was written, in order (seq 1 is the creation, inserted by start_new_request)
+    timeline = await get_timeline("R1", db=db)
+    seqs = [event["seq"] for event in timeline]
+    assert seqs == list(range(2, len(seqs) + 2))
+    assert seqs[-1] == (await db["requestProgress"].find_one({"requestId": "R1"}))["eventSeq"]
+
+    # Counters follow the transitions (the CREATED insert above bypassed them, so its -1 isn't reported)
+    counts = await get_status_counts(db, "user:u1")
+    assert counts == {final["status"]: 1}
+
+
+class Webhook(BaseHTTPRequestHandler):
+    """Local stand-in for the n8n webhook, answering with the queued status codes in turn"""
+    status_codes = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(Webhook.status_codes.pop(0))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+async def run_trigger_retries(db):
+    server = HTTPServer(("127.0.0.1", 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    previous = connection.db, os.environ.get("N8N_WEBHOOK_URL")
+    connection.db = db
+    os.environ["N8N_WEBHOOK_URL"] = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        await db["requestProgress"].insert_one({
+            "requestId": "R2", "status": RequestStatus.CREATED.value, "lastUpdatedAt": datetime.now(), "eventSeq": 1
+        })
+        req = N8NTriggerRequest(
+            request_id="R2", user_id="u2", patient_id="p", patient_name="Pat", payer_id="P1",
+            prompt="prompt", validated_json={}
+        )
+
+        # The webhook fails: the request ends up FAILED with the header written
+        Webhook.status_codes = [500, 200, 200]
+        assert not (await trigger_n8n_workflow(req)).workflow_triggered
+        assert (await db["requestProgress"].find_one({"requestId": "R2"}))["status"] == RequestStatus.FAILED.value
+        created_at = (await db["priorAuthRequest"].find_one({"requestId": "R2"}))["createdAt"]
+
+        # Retrying the failed request, then triggering it again while IN_PROGRESS, rewrites the same header
+        for _ in range(2):
+            response = await trigger_n8n_workflow(req)
+            assert response.workflow_triggered, response.message
+            progress = await db["requestProgress"].find_one({"requestId": "R2"})
+            assert progress["status"] == RequestStatus.IN_PROGRESS.value
+        headers = await db["priorAuthRequest"].find({"requestId": "R2"}).to_list(None)
+        assert len(headers) == 1
+        assert headers[0]["createdAt"] == progress["createdAt"] == created_at
+    finally:
+        server.shutdown()
+        connection.db = previous[0]
+        if previous[1] is None:
+            os.environ.pop("N8N_WEBHOOK_URL", None)
+        else:
+            os.environ["N8N_WEBHOOK_URL"] = previous[1]
+
+
+async def run_failed_requests_stay_retryable(db):
+    """Failed requests outlive the terminal retention; an archived one reports that it is archived"""
+    old = datetime.now() - timedelta(days=40)
+    await db["requestProgress"].insert_many([
+        {"requestId": "DONE", "status": RequestStatus.COMPLETED.value, "lastUpdatedAt": old, "eventSeq": 0},
+        {"requestId": "FAILED", "status": RequestStatus.FAILED.value, "lastUpdatedAt": old, "eventSeq": 0},
+        {"requestId": "FAILED-LONG-AGO", "status": RequestStatus.FAILED.value,
+         "lastUpdatedAt": old - timedelta(days=200), "eventSeq": 0},
+    ])
+    moved = await archive_terminal_requests(db, older_than_days=30, failed_older_than_days=180)
+    assert moved["requestProgress"] == 2
+    hot = {doc["requestId"] async for doc in db["requestProgress"].find({"requestId": {"$in": ["DONE", "FAILED", "FAILED-LONG-AGO"]}})}
+    assert hot == {"FAILED"}
+
+    document = await transition("FAILED", RequestStatus.IN_PROGRESS, "Retry", db=db)
+    assert document["status"] == RequestStatus.IN_PROGRESS
+    try:
+        await transition("FAILED-LONG-AGO", RequestStatus.IN_PROGRESS, "Retry", db=db)
+        assert False, "an archived request can't be retried"
+    except RequestArchivedError as e:
+        assert "archived" in str(e)
+
+
+async def run_rollups_match_backfill(db):
+    """Rollups written live and rebuilt from the event history put the same steps under the same payers"""
+    for collection in ("requestProgress", "requestEvents", "requestRollups", "priorAuthRequest", "statusCounters"):
+        await db[collection].delete_many({})
+    server = HTTPServer(("127.0.0.1", 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    previous = connection.db, os.environ.get("N8N_WEBHOOK_URL")
+    connection.db = db
+    os.environ["N8N_WEBHOOK_URL"] = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        for payer_id in ("P1", "P2"):
+            request_id = (await start_new_request(StartRequestTool(user_id="u3", prompt="prompt"))).request_id
+            # The user is known from the start, before the trigger embeds the header
+            assert (await db["requestProgress"].find_one({"requestId": request_id}))["userId"] == "u3"
+            assert (await get_status_counts(db, "user:u3")).get("created") == 1
+            # Named by check-payer before the trigger embeds the header
+            await transition(request_id, RequestStatus.PROCESSING, "Payer validated", db=db, details={"payer_id": payer_id})
+            Webhook.status_codes = [200]
+            await trigger_n8n_workflow(N8NTriggerRequest(
+                request_id=request_id, user_id="u3", patient_id="p", patient_name="Pat", payer_id=payer_id,
+                prompt="prompt", validated_json={}
+            ))
+            await transition(request_id, RequestStatus.COMPLETED, "Done", db=db)
+    finally:
+        server.shutdown()
+        connection.db = previous[0]
+        if previous[1] is None:
+            os.environ.pop("N8N_WEBHOOK_URL", None)
+        else:
+            os.environ["N8N_WEBHOOK_URL"] = previous[1]
+
+    def counts(documents):
+        # Step durations are measured from slightly different timestamps live and in the replay
+        return {
+            doc["_id"]: (
+                doc["payerId"], doc.get("created", 0), doc.get("entered", {}),
+                {status: duration["count"] for status, duration in doc.get("durations", {}).items()}
+            )
+            for doc in documents
+        }
+
+    live = counts(await db["requestRollups"].find({}).to_list(None))
+    assert {payer for payer, *_ in live.values()} == {"P1", "P2", "*"}
+    assert all(created == 1 for payer, created, *_ in live.values() if payer in ("P1", "P2"))
+    await db["requestRollups"].delete_many({})
+    await backfill_rollups(db, datetime.now() + timedelta(days=1))
+    assert counts(await db["requestRollups"].find({}).to_list(None)) == live
+
+
+def connect():
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+def test_transitions_against_mongodb():
+    if not connect():
+        import pytest
+        pytest.skip(f"No MongoDB reachable at {TEST_MONGO_URI}")
+
+    async def run():
+        client = AsyncIOMotorClient(TEST_MONGO_URI)
+        await client.drop_database(TEST_DB_NAME)
+        try:
+            db = client[TEST_DB_NAME]
+            await db["requestEvents"].create_index([("requestId", 1), ("seq", 1)], unique=True)
+            await db["priorAuthRequest"].create_index([("requestId", 1)], unique=True)
+            await run_state_machine(db)
+            await run_trigger_retries(db)
+            await run_failed_requests_stay_retryable(db)
+            await run_rollups_match_backfill(db)
+        finally:
+            await client.drop_database(TEST_DB_NAME)
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_allowed_transitions()
+    test_rejected_transitions()
+    test_allowed_sources_match_the_table()
+    test_step_increments_are_merged_per_document()
+    print("✅ Transition table and increments")
+    if connect():
+        test_transitions_against_mongodb()
+        print("✅ Transitions against MongoDB")
+    else:
+        print(f"⚠️  No MongoDB reachable at {TEST_MONGO_URI}, skipping the transition checks")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming payload parser and validate_stream
+Bodies are fed in chunks of every size down to one byte, so values, escapes
+and multi-byte characters straddle chunk boundaries
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import services.streaming_validation as streaming
+from db.models.dbmodels.utility.httpResponseEnum import HttpResponseEnum
+from services.streaming_validation import StreamingJsonError, StreamingPayloadParser, validate_stream
+from services.validation_executor import ValidationExecutor
+from services.validation_service import check_with_validator, validate_item_chunk
+
+VALID_ITEM = {"payerid": "350007", "requestid": "r-1", "cptcodes": "71250"}
+INVALID_ITEM = {"payerid": "350007", "requestid": "", "cptcodes": "00000"}
+
+TRICKY_PAYLOAD = {
+    "response": [
+        {"a": "quote \" and backslash \\ and brace } ] {", "b": [1, -2.5e3, True, False, None]},
+        "é€😀 \u0001 \\\"",
+        [[[]], {}, {"x": {"y": []}}],
+        12345678901234567890,
+        -0.5,
+        None,
+    ],
+    "header": {"nested": ["}", "]", "\\"]},
+    "count": 42,
+    "empty": "",
+    "flag": False,
+}
+
+
+class Chunks:
+    """Async chunk source that records how many chunks were read"""
+
+    def __init__(self, data: bytes, size: int, delay: float = 0):
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.delay = delay
+        self.read = 0
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            self.read += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield chunk
+
+
+def parse(data: bytes, size: int, **kwargs):
+    async def collect():
+        return [event async for event in StreamingPayloadParser(Chunks(data, size), **kwargs).events()]
+    return asyncio.run(collect())
+
+
+def expected_events(payload):
+    events = []
+    for key, value in payload.items():
+        if key == "response":
+            events.extend(("item", index, item) for index, item in enumerate(value))
+            value = []
+        events.append(("field", key, value))
+    return events
+
+
+def test_values_split_across_chunks():
+    for separators in [(",", ":"), (", ", ": ")]:
+        data = json.dumps(TRICKY_PAYLOAD, ensure_ascii=False, separators=separators).encode("utf-8")
+        for size in [1, 2, 3, 5, 7, 64, len(data)]:
+            assert parse(data, size) == expected_events(TRICKY_PAYLOAD), f"chunk size {size}"
+
+    assert parse(b'{}', 1) == []
+    assert parse(b' { "response" : [ ] } ', 1) == [("field", "response", [])]
+    # A number split across chunks isn't cut short at the chunk boundary
+    assert parse(b'{"a":1234}', 2) == [("field", "a", 1234)]
+
+
+def test_each_value_is_decoded_once():
+    class CountingDecoder(json.JSONDecoder):
+        calls = 0
+
+        def raw_decode(self, s, idx=0):
+            CountingDecoder.calls += 1
+            return super().raw_decode(s, idx)
+
+    items = [{"text": "x" * 200, "n": i} for i in range(20)]
+    data = json.dumps({"response": items}).encode("utf-8")
+    original = streaming.DECODER
+    streaming.DECODER = CountingDecoder()
+    try:
+        events = parse(data, 3)
+    finally:
+        streaming.DECODER = original
+    assert events == expected_events({"response": items})
+    # One decode per key and per item, however many chunks each one spans
+    assert CountingDecoder.calls == 1 + len(items)
+
+
+def test_malformed_json():
+    for body in [
+        b'[1, 2]',
+        b'{"response": [1, 2}',
+        b'{"response": [1 2]}',
+        b'{"a": tru}',
+        b'{"a": 12abc}',
+        b'{"a": {"b": 1]}',
+        b'{"a": "unterminated',
+        b'{"a": 1',
+        b'{1: 2}',
+        b'{"a" 1}',
+        b'',
+    ]:
+        for size in [1, 4, max(len(body), 1)]:
+            with pytest.raises(StreamingJsonError):
+                parse(body, size)
+
+
+def test_oversized_items_are_rejected_before_the_body_is_read():
+    big = {"response": [{"text": "x" * 500}] + [VALID_ITEM] * 50}
+    data = json.dumps(big).encode("utf-8")
+    chunks = Chunks(data, 16)
+
+    async def collect():
+        return [event async for event in StreamingPayloadParser(chunks, max_item_bytes=100).events()]
+
+    with pytest.raises(StreamingJsonError, match="exceeds 100 bytes"):
+        asyncio.run(collect())
+    assert chunks.read < len(chunks.chunks) / 2
+
+    # The limit applies to each value, not to the body
+    small = {"response": [VALID_ITEM] * 50}
+    assert len(parse(json.dumps(small).encode("utf-8"), 16, max_item_bytes=100)) == 51
+
+
+def test_fast_fail_ends_the_parse_early():
+    executor = ValidationExecutor(mode="thread", workers=1, item_chunk_size=2)
+    payload = {"response": [INVALID_ITEM] + [VALID_ITEM] * 200}
+    data = json.dumps(payload).encode("utf-8")
+    try:
+        chunks = Chunks(data, 64, delay=0.001)
+        result = asyncio.run(validate_stream(executor, chunks, fast_fail=True))
+        assert not result.is_valid
+        assert [error.index for error in result.item_errors] == [0]
+        assert chunks.read < len(chunks.chunks) / 2
+
+        # Without fast_fail the whole body is read and every item checked
+        chunks = Chunks(data, 64)
+        result = asyncio.run(validate_stream(executor, chunks))
+        assert not result.is_valid
+        assert chunks.read == len(chunks.chunks)
+        assert {error.index for error in result.item_errors} == {0}
+    finally:
+        executor.get_pool().shutdown()
+
+
+def test_stream_validation_results():
+    executor = ValidationExecutor(mode="thread", workers=2, item_chunk_size=3)
+    try:
+        data = json.dumps({"response": [VALID_ITEM] * 10}).encode("utf-8")
+        result = asyncio.run(validate_stream(executor, Chunks(data, 7)))
+        assert result.is_valid, result
+
+        result = asyncio.run(validate_stream(executor, Chunks(b'{"response": [{"payerid": "350007",', 7)))
+        assert not result.is_valid
+        assert result.http_status == HttpResponseEnum.BAD_REQUEST
+    finally:
+        executor.get_pool().shutdown()
+
+
+def test_full_queue_is_service_unavailable():
+    executor = ValidationExecutor(mode="thread", workers=1, max_queued=0, item_chunk_size=2)
+    try:
+        data = json.dumps({"response": [VALID_ITEM] * 10}).encode("utf-8")
+        result = asyncio.run(validate_stream(executor, Chunks(data, 64)))
+        assert result.http_status == HttpResponseEnum.SERVICE_UNAVAILABLE
+        assert executor.rejected_count == 1
+    finally:
+        executor.get_pool().shutdown()
+
+
+def test_chunk_for_unknown_payer_is_rejected_like_a_single_item():
+    result = validate_item_chunk("no-such-payer", 0, [VALID_ITEM])
+    assert result == check_with_validator({"response": [VALID_ITEM]}, "no-such-payer", None)
+    assert result.http_status == HttpResponseEnum.BAD_REQUEST
+
+
+if __name__ == "__main__":
+    test_values_split_across_chunks()
+    test_each_value_is_decoded_once()
+    test_malformed_json()
+    test_oversized_items_are_rejected_before_the_body_is_read()
+    test_fast_fail_ends_the_parse_early()
+    test_stream_validation_results()
+    test_full_queue_is_service_unavailable()
+    test_chunk_for_unknown_payer_is_rejected_like_a_single_item()
+    print("✅ Streaming parser tests passed")
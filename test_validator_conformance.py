@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Conformance tests for the code-generated payer validators
+Every compiled schema must give exactly the same verdict (and, through the
+jsonschema fallback, the same errors) as jsonschema itself
+Run with pytest, or directly to also print a throughput comparison
+"""
+
+import copy
+import itertools
+import json
+import os
+import time
+
+from jsonschema.validators import validator_for
+
+from services.code_tables import CodeTables, get_code_table_registry
+from services.schema_compiler import compile_check
+from services.validator_registry import build_validator
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), "rulesets", "all_rules.json")
+
+# Values chosen to hit every type/format edge the compiler special-cases
+EDGE_VALUES = [
+    None, True, False, 0, 1, -1, 1.0, 1.5, "", "a", "1", "71271", "71250 ", "x71260",
+    "10/27/2025", "10/27/2025 6:00:00 PM", "1/2/2025", "350007", "123456", "é", "\u0000",
+    [], ["a"], [1, 2], {}, {"a": 1}
+]
+
+# Schemas exercising each keyword the compiler supports
+KEYWORD_SCHEMAS = [
+    {"type": "string"},
+    {"type": "integer"},
+    {"type": "number"},
+    {"type": "boolean"},
+    {"type": "null"},
+    {"type": "array"},
+    {"type": "object"},
+    {"type": ["string", "null"]},
+    {"type": ["integer", "boolean"]},
+    {"const": "71271"},
+    {"const": None},
+    {"enum": ["a", "1", "é"]},
+    {"minLength": 1},
+    {"maxLength": 1},
+    {"type": "string", "minLength": 2, "maxLength": 5},
+    {"pattern": "^\\d{2}/\\d{2}/\\d{4}$"},
+    {"pattern": "^(71271|71250|71260)$"},
+    {"required": ["a"]},
+    {"properties": {"a": {"type": "integer"}}},
+    {"properties": {"a": {"type": "integer"}}, "additionalProperties": False},
+    {"type": "object", "properties": {"a": True, "b": False}},
+    {"items": {"type": "string"}},
+    {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 1, "maxItems": 2},
+    {"minItems": 1},
+    True,
+    False,
+    {},
+]
+
+
+def load_payer_schemas():
+    with open(RULES_PATH, "r") as file:
+        return json.load(file)
+
+
+def reference_validator(schema):
+    if "codeTable" in json.dumps(schema):
+        # Custom keyword, only the registry's jsonschema validator knows it
+        return build_validator(schema, {}, engine="jsonschema")
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def payload_variants(schema):
+    """Valid payloads for a payer schema plus single-field mutations of them"""
+    item_schema = schema["properties"]["response"]["items"]
+    item = {}
+    for field, rules in item_schema["properties"].items():
+        if "const" in rules:
+            item[field] = rules["const"]
+        elif field == "cptcodes":
+            item[field] = "71271"
+        elif field == "appointmentdate":
+            item[field] = "10/27/2025"
+        else:
+            item[field] = "4473"
+
+    yield {"response": [item]}
+    yield {"response": [item, dict(item, extra="field")]}
+    yield {"response": []}
+    yield {"response": {}}
+    yield {}
+    yield []
+    yield "response"
+    yield {"response": [item], "other": None}
+
+    for field in item:
+        missing = dict(item)
+        del missing[field]
+        yield {"response": [item, missing]}
+        for value in EDGE_VALUES:
+            yield {"response": [dict(item, **{field: value})]}
+            yield {"response": [item, item, dict(item, **{field: value})]}
+
+    for value in EDGE_VALUES:
+        yield {"response": [value]}
+        yield {"response": value}
+
+
+def assert_same_verdicts(schema, instances):
+    check = compile_check(schema)
+    assert check is not None, f"schema should be compilable: {schema}"
+    reference = reference_validator(schema)
+    compiled = build_validator(schema, {}, engine="codegen")
+    for instance in instances:
+        expected = reference.is_valid(instance)
+        assert check(instance) == expected, f"verdict differs for {instance!r} against {schema!r}"
+        assert [e.message for e in compiled.iter_errors(instance)] == \
+            [e.message for e in reference.iter_errors(instance)]
+
+
+def test_payer_schemas_match_jsonschema():
+    for payer_id, schema in load_payer_schemas().items():
+        assert_same_verdicts(schema, list(payload_variants(schema)))
+
+
+def test_keyword_schemas_match_jsonschema():
+    instances = EDGE_VALUES + [
+        {"a": value} for value in EDGE_VALUES
+    ] + [
+        {"a": 1, "b": 2}, {"b": 1}, ["a", "bb"], ["a", "b", "c"], [""]
+    ]
+    for schema in KEYWORD_SCHEMAS:
+        assert_same_verdicts(schema, instances)
+
+
+def test_nested_keyword_combinations_match_jsonschema():
+    leaves = [{"type": "string", "minLength": 1}, {"const": "x"}, {"enum": ["x", "y"]}, {"type": "integer"}]
+    instances = [{"r": [{"f": value}]} for value in EDGE_VALUES + ["x", "y"]] + [{"r": [{}]}, {"r": []}, {"r": [1]}]
+    for leaf, required in itertools.product(leaves, [[], ["f"]]):
+        schema = {
+            "type": "object",
+            "required": ["r"],
+            "properties": {
+                "r": {"type": "array", "items": {"type": "object", "required": required, "properties": {"f": leaf}}}
+            }
+        }
+        assert_same_verdicts(schema, instances)
+
+
+def test_code_tables_match_jsonschema():
+    registry = get_code_table_registry()
+    previous = registry.get_tables()
+    registry.install(CodeTables({"cpt": frozenset({"71271", "1", "é"}), "empty": frozenset()}, "file", {}))
+    try:
+        instances = EDGE_VALUES + [{"code": value} for value in EDGE_VALUES]
+        for schema in [
+            {"codeTable": "cpt"},
+            {"type": "string", "codeTable": "cpt"},
+            {"codeTable": "empty"},
+            {"codeTable": "missing"},
+            {"type": "object", "properties": {"code": {"type": "string", "codeTable": "cpt"}}, "required": ["code"]},
+        ]:
+            assert_same_verdicts(schema, instances)
+
+        # Reloaded tables apply to already compiled validators
+        check = compile_check({"codeTable": "cpt"})
+        assert not check("71250")
+        registry.install(CodeTables({"cpt": frozenset({"71250"})}, "file", {}))
+        assert check("71250")
+    finally:
+        registry.install(previous)
+
+
+def test_unsupported_keywords_fall_back_to_jsonschema():
+    for schema in [
+        {"$ref": "#/$defs/a", "$defs": {"a": {"type": "string"}}},
+        {"anyOf": [{"type": "string"}, {"type": "integer"}]},
+        {"format": "date"},
+        {"minimum": 1},
+        {"const": 1},
+        {"enum": [1, "a"]},
+        {"$schema": "http://json-schema.org/draft-07/schema#", "items": [{"type": "string"}]},
+        {"$schema": "http://json-schema.org/draft-04/schema#", "type": "integer"},
+        {"additionalProperties": {"type": "string"}},
+        {"patternProperties": {"^a": {"type": "string"}}},
+    ]:
+        assert compile_check(schema) is None, f"{schema} should not be compiled"
+        validator = build_validator(schema, {}, engine="codegen")
+        assert validator.__class__.__name__ != "CompiledValidator"
+
+
+def benchmark(iterations=2000):
+    """Compare validation throughput on the payer schemas for valid payloads"""
+    payload = json.load(open(os.path.join(os.path.dirname(__file__), "tmp", "json-payload.json"), encoding="utf-8-sig"))
+    for payer_id, schema in load_payer_schemas().items():
+        instance = copy.deepcopy(payload)
+        valid = next(payload_variants(schema))["response"][0]
+        instance["response"] = [dict(item, **valid) for item in instance["response"]] * 10
+        reference = build_validator(schema, {}, engine="jsonschema")
+        compiled = build_validator(schema, {}, engine="codegen")
+
+        timings = {}
+        for name, validator in (("jsonschema", reference), ("codegen", compiled)):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                assert not list(validator.iter_errors(instance))
+            timings[name] = time.perf_counter() - start
+        print(f"Payer {payer_id}: jsonschema {iterations / timings['jsonschema']:.0f}/s, "
+              f"codegen {iterations / timings['codegen']:.0f}/s "
+              f"({timings['jsonschema'] / timings['codegen']:.1f}x)")
+
+
+if __name__ == "__main__":
+    test_payer_schemas_match_jsonschema()
+    test_keyword_schemas_match_jsonschema()
+    test_nested_keyword_combinations_match_jsonschema()
+    test_code_tables_match_jsonschema()
+    test_unsupported_keywords_fall_back_to_jsonschema()
+    print("✅ Compiled validators match jsonschema")
+    benchmark()